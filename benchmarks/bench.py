@@ -0,0 +1,183 @@
+#!/usr/bin/python
+"""Benchmarks of dm3_lib on synthetic DM3/DM4 files
+
+Times DM3 object creation (tag parsing), imagedata, Image, tnImage and tag
+lookups, and records tags/s, MB/s and peak memory (tracemalloc) in a JSON
+file, which can be compared with a previous run (--compare).
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py -o new.json --compare results.json"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import argparse
+import tracemalloc
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import dm3_lib as dm3
+
+from synthetic import make_file
+
+# benchmark cases: name -> make_file arguments
+CASES = {
+    'tags': dict(shape=(256, 256), data_type=1, ntags=40000, depth=6),
+    'image': dict(shape=(2048, 2048), data_type=2, ntags=500, depth=4),
+    'stack': dict(shape=(32, 512, 512), data_type=10, ntags=500, depth=4),
+    }
+
+# smaller cases (--quick)
+QUICKCASES = {
+    'tags': dict(shape=(128, 128), data_type=1, ntags=4000, depth=5),
+    'image': dict(shape=(512, 512), data_type=2, ntags=200, depth=4),
+    'stack': dict(shape=(8, 128, 128), data_type=10, ntags=200, depth=4),
+    }
+
+NLOOKUPS = 1000
+
+
+def _time(func, repeat):
+    """Returns (best time, median time, peak memory in bytes) of func()."""
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return times[0], times[len(times)//2], peak
+
+
+def run_case(filename, repeat):
+    """Runs benchmarks on file filename; returns dict of metrics."""
+    results = {}
+    fileSize = os.path.getsize(filename)
+
+    def record(name, func, amount=None, unit=None):
+        best, median, peak = _time(func, repeat)
+        results[name] = {'best_s': best, 'median_s': median,
+                         'peak_bytes': peak}
+        if amount is not None:
+            results[name][unit] = amount / best
+
+    dm3f = dm3.DM3(filename)
+    ntags = len(dm3f.typedtags)
+    dataSize = dm3f.images[1].data_size
+    results['file_bytes'] = fileSize
+    results['tags'] = ntags
+
+    record('init', lambda: dm3.DM3(filename).close(), ntags, 'tags_per_s')
+    record('init_lazy', lambda: dm3.DM3(filename, lazy=True).close())
+    record('probe', lambda: dm3.probe(filename))
+    record('imagedata', lambda: dm3f.imagedata, dataSize / 1e6, 'MB_per_s')
+    record('Image', lambda: dm3f.Image, dataSize / 1e6, 'MB_per_s')
+    record('tnImage', lambda: dm3f.tnImage)
+    record('thumbnail', lambda: dm3.thumbnail(filename))
+
+    names = list(dm3f.typedtags)
+    rnd = random.Random(0)
+    sample = [rnd.choice(names) for i in range(NLOOKUPS)]
+    typedtags = dm3f.typedtags
+    tags = dm3f.tags
+
+    def lookups(mapping):
+        for name in sample:
+            mapping[name]
+
+    record('typedtags_lookup', lambda: lookups(typedtags), NLOOKUPS,
+           'lookups_per_s')
+    record('tags_lookup', lambda: lookups(tags), NLOOKUPS, 'lookups_per_s')
+    dm3f.close()
+    return results
+
+
+def compare(results, baseline):
+    """Prints best times of results vs. baseline (ratio < 1: faster)."""
+    for case in sorted(results['cases']):
+        old = baseline['cases'].get(case)
+        if old is None:
+            continue
+        for name, metrics in sorted(results['cases'][case].items()):
+            if not isinstance(metrics, dict) or (name not in old):
+                # (not a benchmark)
+                continue
+            ratio = metrics['best_s'] / old[name]['best_s']
+            print("%-12s %-18s %10.5fs -> %10.5fs  x%.2f" % (
+                case, name, old[name]['best_s'], metrics['best_s'], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark dm3_lib on synthetic DM3/DM4 files.")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="JSON results file (default: %(default)s)")
+    parser.add_argument("--compare", help="JSON results file to compare with")
+    parser.add_argument("--quick", action="store_true",
+                        help="run smaller cases")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per benchmark (default: %(default)s)")
+    parser.add_argument("--versions", default="3,4",
+                        help="file versions (default: %(default)s)")
+    parser.add_argument("--keep", help="keep generated files in directory")
+    args = parser.parse_args(argv)
+
+    cases = QUICKCASES if args.quick else CASES
+    workdir = args.keep or tempfile.mkdtemp(prefix='dm3bench')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    results = {
+        'meta': {
+            'dm3_lib': dm3.VERSION,
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'quick': args.quick,
+            'repeat': args.repeat,
+            },
+        'params': {},
+        'cases': {},
+        }
+    try:
+        for version in [int(v) for v in args.versions.split(',')]:
+            for name, params in sorted(cases.items()):
+                case = "%s.dm%s" % (name, version)
+                filename = os.path.join(workdir, case)
+                make_file(filename, version, **params)
+                print("%s..." % case, file=sys.stderr)
+                metrics = run_case(filename, args.repeat)
+                results['cases'][case] = metrics
+                results['params'][case] = dict(params, version=version)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    for case, metrics in sorted(results['cases'].items()):
+        print("%-10s init %8.4fs (%9.0f tags/s)  imagedata %8.1f MB/s  "
+              "init peak %6.1f MB" % (
+                  case, metrics['init']['best_s'],
+                  metrics['init']['tags_per_s'],
+                  metrics['imagedata']['MB_per_s'],
+                  metrics['init']['peak_bytes'] / 1e6))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
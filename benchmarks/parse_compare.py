@@ -0,0 +1,104 @@
+#!/usr/bin/python
+"""Comparison of tag parsing times of two dm3_lib source trees
+
+Times DM3(filename) and list(tags) only (the API common to all versions of
+dm3_lib), on synthetic DM3/DM4 files (written by this tree), for each
+source tree (run in its own Python process). Tag counts are those of the
+tags found by both trees (e.g., old versions do not store struct tags);
+tags of the old tree missing in the new one are reported. E.g., to compare
+a commit with its parent:
+
+    git worktree add /tmp/dm3_old <commit>^
+    git worktree add /tmp/dm3_new <commit>
+    python benchmarks/parse_compare.py /tmp/dm3_old /tmp/dm3_new
+
+Without 'new' tree, compares with this tree."""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+from synthetic import make_file
+from bench import CASES, QUICKCASES
+
+# timing of one file by one source tree (run in subprocess): prints JSON
+_TIMER = """
+import sys, json, time
+sys.path.insert(0, sys.argv[1])
+import dm3_lib
+filename, repeat = sys.argv[2], int(sys.argv[3])
+clock = getattr(time, 'perf_counter', time.time)
+times = []
+for i in range(repeat):
+    t0 = clock()
+    names = list(dm3_lib.DM3(filename).tags)
+    times.append(clock() - t0)
+print(json.dumps({'best_s': min(times), 'tags': names,
+                  'lib': dm3_lib.__file__}))
+"""
+
+
+def time_parse(tree, filename, repeat):
+    """Returns {'best_s', 'tags', 'lib'} of parsing file filename w/ dm3_lib
+    of source tree 'tree' ('tags': list of tag names)."""
+    out = subprocess.check_output(
+        [sys.executable, '-c', _TIMER, os.path.abspath(tree), filename,
+         str(repeat)])
+    # (last line: old versions may print notices)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare tag parsing times of two dm3_lib source "
+                    "trees on synthetic DM3/DM4 files.")
+    parser.add_argument("old", help="baseline source tree")
+    parser.add_argument("new", nargs='?',
+                        default=os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), os.pardir),
+                        help="source tree to compare (default: this tree)")
+    parser.add_argument("--quick", action="store_true",
+                        help="run smaller cases")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per file (default: %(default)s)")
+    parser.add_argument("--versions", default="3,4",
+                        help="file versions (default: %(default)s)")
+    parser.add_argument("--keep", help="keep generated files in directory")
+    args = parser.parse_args(argv)
+
+    cases = QUICKCASES if args.quick else CASES
+    workdir = args.keep or tempfile.mkdtemp(prefix='dm3parse')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        for version in [int(v) for v in args.versions.split(',')]:
+            for name, params in sorted(cases.items()):
+                case = "%s.dm%s" % (name, version)
+                filename = os.path.join(workdir, case)
+                make_file(filename, version, **params)
+                old = time_parse(args.old, filename, args.repeat)
+                new = time_parse(args.new, filename, args.repeat)
+                # (compare tags found by both trees)
+                ntags = len(set(old['tags']) & set(new['tags']))
+                missing = len(old['tags']) - ntags
+                if missing:
+                    print("%s: %s tags (old) not found (new)"
+                          % (case, missing), file=sys.stderr)
+                print("%-10s %6d tags  old %9.4fs (%8.0f tags/s)  new "
+                      "%9.4fs (%8.0f tags/s)  speedup %.2fx" % (
+                          case, ntags, old['best_s'], ntags / old['best_s'],
+                          new['best_s'], ntags / new['best_s'],
+                          old['best_s'] / new['best_s']))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
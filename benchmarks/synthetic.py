@@ -0,0 +1,119 @@
+#!/usr/bin/python
+"""Generator of synthetic DM3/DM4 files for benchmarks
+
+Files (written by dm3_lib.write_dm) have a thumbnail (image 0 of ImageList)
+and one image (image 1) of given shape and DataType, and random tag trees
+of given size and depth (in DocumentTags and in image 1 ImageTags)."""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import random
+import argparse
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from dm3_lib import write_dm
+
+__all__ = ["make_file", "random_tags", "DATATYPES"]
+
+# image DataType -> numpy dtype of generated image data
+DATATYPES = {
+    1: '<i2',
+    2: '<f4',
+    6: 'u1',
+    7: '<i4',
+    9: 'i1',
+    10: '<u2',
+    11: '<u4',
+    12: '<f8',
+    13: '<c16',
+    }
+
+
+class Unnamed(dict):
+    """Tag group whose tags have no labels (e.g. ImageList)."""
+
+
+def random_tags(ntags, depth, rnd):
+    """Returns random tag tree of 'ntags' tags (and groups), at most
+    'depth' levels deep."""
+    count = [0]
+
+    def fill(group, level):
+        while count[0] < ntags:
+            label = (str(len(group)) if isinstance(group, Unnamed)
+                     else 'Tag %s' % count[0])
+            count[0] += 1
+            r = rnd.random()
+            if (r < 0.1) and (level < depth):
+                sub = Unnamed() if rnd.random() < 0.3 else {}
+                group[label] = sub
+                fill(sub, level + 1)
+                if rnd.random() < 0.5:
+                    return
+                continue
+            elif r < 0.35:
+                group[label] = rnd.randint(-1000, 1000)
+            elif r < 0.55:
+                group[label] = rnd.random()
+            elif r < 0.65:
+                group[label] = (1.5, 2.5, 7)
+            elif r < 0.7:
+                group[label] = numpy.arange(64, dtype='<f4')
+            elif r < 0.75:
+                group[label] = rnd.random() < .5
+            else:
+                group[label] = 'text %s' % count[0]
+            if rnd.random() < 0.05:
+                return
+
+    tags = {}
+    while count[0] < ntags:
+        fill(tags, 0)
+    return tags
+
+
+def make_file(filename, version=3, shape=(512, 512), data_type=1,
+              ntags=1000, depth=5, seed=0):
+    """Writes synthetic DM3/DM4 file ('version' 3 or 4) w/ image data of
+    'shape' (numpy order, e.g. (depth, height, width) for stacks) and
+    'data_type', and about 'ntags' random tags, 'depth' levels deep.
+
+    Returns image data array."""
+    rnd = random.Random(seed)
+    dtype = numpy.dtype(DATATYPES[data_type])
+    data = (numpy.arange(int(numpy.prod(shape))) % 251).astype(dtype)
+    data = data.reshape(shape)
+    tags = random_tags(ntags // 2, depth, rnd)
+    tags['Microscope Info'] = {
+        'Voltage': 200000.0,
+        'Indicated Magnification': 50000.0,
+        'Operator': 'synthetic',
+        }
+    write_dm(filename, data, tags, version,
+             calibrations=[(0.0, 0.5, u'\xb5m')] * len(shape),
+             cuts=(10.0, 240.0), name='synthetic',
+             document_tags=random_tags(ntags - ntags // 2, depth, rnd))
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Write synthetic DM3/DM4 file.")
+    parser.add_argument("file", help="output file")
+    parser.add_argument("--version", type=int, choices=[3, 4], default=3)
+    parser.add_argument("--shape", default="512,512",
+                        help="image data shape, e.g. 16,512,512 for stack")
+    parser.add_argument("--data-type", type=int, default=1,
+                        choices=sorted(DATATYPES))
+    parser.add_argument("--tags", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_file(args.file, args.version,
+              tuple(int(n) for n in args.shape.split(',')),
+              args.data_type, args.tags, args.depth, args.seed)
@@ -1,3 +1,39 @@
 from ._dm3_lib import VERSION
 from ._dm3_lib import DM3
+from ._dm3_lib import DM3Image
+from ._dm3_lib import LazyArray
+from ._dm3_lib import probe
+from ._dm3_lib import thumbnail
+from ._dm3_lib import TagCache
+from ._dm3_lib import FilePool
+from ._dm3_lib import ArrayCache
+from ._dm3_lib import array_cache
+from ._dm3_lib import ImageStats
+from ._dm3_lib import image_stats
+from ._stats import histogram_cuts
 from ._dm3_lib import SUPPORTED_DATA_TYPES
+from ._batch import read_many
+from ._batch import scan_dir
+from ._batch import read_thumbnails
+from ._batch import contact_sheet
+from ._convert import convert_file
+from ._convert import convert_many
+from ._writer import write_dm
+from ._archive import DMArchive
+from ._trace import FileTrace
+from ._trace import add_trace_hook
+from ._trace import remove_trace_hook
+
+
+def set_executor(executor):
+    """Sets executor used by DM3.aopen/aread_image (None: default executor
+    of asyncio event loop)."""
+    from ._aio import set_executor
+    set_executor(executor)
+
+
+def set_max_open(n):
+    """Sets max. number of files opened by DM3.aopen and not closed yet
+    (per asyncio event loop): aopen waits for files to be closed."""
+    from ._aio import set_max_open
+    set_max_open(n)
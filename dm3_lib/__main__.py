@@ -0,0 +1,8 @@
+#!/usr/bin/python
+"""Command line conversion of DM3/DM4 files (python -m dm3_lib ...)"""
+
+import sys
+
+from ._convert import main
+
+sys.exit(main())
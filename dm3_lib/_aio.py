@@ -0,0 +1,95 @@
+#!/usr/bin/python
+"""asyncio support: DM3/DM4 files opened and read w/o blocking event loop"""
+
+import asyncio
+import functools
+import threading
+import weakref
+
+__all__ = ["aopen", "aread_image", "aenter", "aexit", "set_executor",
+           "set_max_open"]
+
+DEFAULTMAXOPEN = 16
+
+_executor = None
+_maxOpen = DEFAULTMAXOPEN
+# semaphores (by event loop) capping files opened by aopen and not closed
+_semaphores = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def set_executor(executor):
+    """Sets executor parsing and reading files (None: default executor of
+    event loop)."""
+    global _executor
+    _executor = executor
+
+
+def set_max_open(n):
+    """Sets max. number of files opened by aopen and not closed yet (per
+    event loop; applies to event loops where aopen was not used yet)."""
+    global _maxOpen
+    with _lock:
+        _maxOpen = n
+        _semaphores.clear()
+
+
+def _semaphore(loop):
+    with _lock:
+        sem = _semaphores.get(loop)
+        if sem is None:
+            sem = _semaphores[loop] = asyncio.Semaphore(_maxOpen)
+        return sem
+
+
+def _release(loop, sem):
+    # release open file slot (from any thread)
+    try:
+        loop.call_soon_threadsafe(sem.release)
+    except RuntimeError:
+        # (event loop closed)
+        pass
+
+
+async def _run(executor, func, *args, **kwargs):
+    # run blocking func in executor
+    loop = asyncio.get_running_loop()
+    if executor is None:
+        executor = _executor
+    return await loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs))
+
+
+async def aopen(cls, filename, executor=None, **kwargs):
+    """Returns DM3 object ('cls') of file filename, parsed in executor.
+
+    Waits for an open file slot (see set_max_open), held until the DM3
+    object is closed (or collected)."""
+    loop = asyncio.get_running_loop()
+    sem = _semaphore(loop)
+    await sem.acquire()
+    try:
+        dm3 = await _run(executor, cls, filename, **kwargs)
+    except BaseException:
+        sem.release()
+        raise
+    dm3._closeCallbacks.append(weakref.finalize(dm3, _release, loop, sem))
+    return dm3
+
+
+async def aread_image(dm3, index=None, executor=None):
+    """Returns data of image 'index' of DM3 object (chosen image by
+    default), read in executor."""
+    if index is None:
+        index = dm3._chosenImage
+    return await _run(executor, lambda: dm3.images[index].data)
+
+
+async def aenter(dm3):
+    """'async with' entry: returns DM3 object."""
+    return dm3
+
+
+async def aexit(dm3):
+    """'async with' exit: closes DM3 object."""
+    dm3.close()
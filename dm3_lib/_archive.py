@@ -0,0 +1,294 @@
+#!/usr/bin/python
+"""Random access to DM3/DM4 files stored in zip/tar archives"""
+
+from __future__ import print_function
+
+import os
+import mmap
+import struct
+import fnmatch
+import tarfile
+import zipfile
+import threading
+from collections import OrderedDict
+
+from ._batch import DEFAULTPATTERNS
+from ._tagcache import TagCache, _fileKey
+
+__all__ = ["DMArchive"]
+
+# zip local file header: signature, ..., file name length, extra field length
+_ZIPLOCALHEADER = struct.Struct('<4s22xHH')
+
+# number of member indexes kept in memory (by archive)
+MAXINDEXES = 64
+
+# member indexes by archive identity (see _fileKey)
+_indexes = OrderedDict()
+_indexesLock = threading.Lock()
+
+
+def _zipIndex(path, patterns):
+    """Returns index of DM3/DM4 members of zip archive: list of (name,
+    data offset (None if compressed), size)."""
+    index = []
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            if not _isDMFile(info.filename, patterns):
+                continue
+            offset = None
+            if (info.compress_type == zipfile.ZIP_STORED) and not (
+                    info.flag_bits & 0x1):
+                # stored (and not encrypted): data follow local header
+                f.seek(info.header_offset)
+                sig, nameLen, extraLen = _ZIPLOCALHEADER.unpack(
+                    f.read(_ZIPLOCALHEADER.size))
+                if sig == b'PK\x03\x04':
+                    offset = (info.header_offset + _ZIPLOCALHEADER.size
+                              + nameLen + extraLen)
+            index.append((info.filename, offset, info.file_size))
+    return index
+
+
+def _tarIndex(path, patterns):
+    """Returns index of DM3/DM4 members of tar archive (see _zipIndex)."""
+    try:
+        tf = tarfile.open(path, 'r:')
+        compressed = False
+    except tarfile.ReadError:
+        # (compressed tar)
+        tf = tarfile.open(path)
+        compressed = True
+    index = []
+    with tf:
+        for member in tf:
+            if not member.isreg() or not _isDMFile(member.name, patterns):
+                continue
+            if compressed or member.issparse():
+                offset = None
+            else:
+                offset = member.offset_data
+            index.append((member.name, offset, member.size))
+    return index
+
+
+def _isDMFile(name, patterns):
+    name = name.rsplit('/', 1)[-1].lower()
+    return any( fnmatch.fnmatch(name, p) for p in patterns )
+
+
+class _WindowFile(object):
+    """Read-only binary file over bytes [offset, offset+size[ of archive
+    file (stored member), read at offsets w/o copy of the whole member."""
+
+    def __init__(self, archive, name, offset, size):
+        self._archive = archive
+        self.name = name
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        out = memoryview(b)
+        if (out.ndim != 1) or (out.itemsize != 1):
+            out = out.cast('B')
+        n = max(min(len(out), self._size - self._pos), 0)
+        n = self._archive._readInto(self._offset + self._pos, out[:n])
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        if (size < 0) or (size > self._size - self._pos):
+            size = max(self._size - self._pos, 0)
+        data = bytearray(size)
+        n = self.readinto(data)
+        return bytes(data[:n])
+
+    def getbuffer(self):
+        # (buffer over member, to parse tags from)
+        return self._archive._buffer(self._offset, self._size)
+
+
+class DMArchive(object):
+    """DM3/DM4 files in zip or tar archive 'path'.
+
+    Archive members matching 'patterns' are indexed once (index kept in
+    memory by archive, and in 'cache' (TagCache object or cache directory)
+    if given, until archive changes). Members are opened as DM3 objects:
+    stored members (uncompressed zip members, members of uncompressed
+    tar archives) are read at their offset in the archive (tags parsed
+    from the memory-mapped archive, image data read on demand), compressed
+    members are decompressed (once) into memory."""
+
+    def __init__(self, path, cache=None, patterns=DEFAULTPATTERNS):
+        self._path = path
+        self._lock = threading.Lock()
+        self._closed = False
+        self._isZip = zipfile.is_zipfile(path)
+        if (cache is not None) and not isinstance(cache, TagCache):
+            cache = TagCache(cache)
+        self._index = OrderedDict(
+            (name, (offset, size))
+            for name, offset, size in self._getIndex(cache, patterns) )
+        self._f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            self._map = None
+        self._zip = None
+        self._tar = None
+
+    def _getIndex(self, cache, patterns):
+        # returns member index, from memory, cache or archive
+        key = _fileKey(self._path) + (tuple(patterns),)
+        with _indexesLock:
+            index = _indexes.pop(key, None)
+            if index is not None:
+                # (mark as recently used)
+                _indexes[key] = index
+                return index
+        if cache is not None:
+            cached = cache.get(self._path)
+            if (cached is not None) and (cached.get('patterns') ==
+                                         tuple(patterns)):
+                index = cached['index']
+        if index is None:
+            if self._isZip:
+                index = _zipIndex(self._path, patterns)
+            elif tarfile.is_tarfile(self._path):
+                index = _tarIndex(self._path, patterns)
+            else:
+                raise Exception("'%s' is not a zip/tar archive"
+                                % os.path.split(self._path)[1])
+            if cache is not None:
+                cache.put(self._path, {'patterns': tuple(patterns),
+                                       'index': index})
+        with _indexesLock:
+            _indexes[key] = index
+            while len(_indexes) > MAXINDEXES:
+                _indexes.popitem(last=False)
+        return index
+
+    def _checkOpen(self):
+        if self._closed:
+            raise Exception("I/O operation on closed archive %s"
+                            % os.path.split(self._path)[1])
+
+    def _readInto(self, offset, out):
+        # read archive data at offset into byte memoryview out
+        self._checkOpen()
+        if self._map is not None:
+            n = max(min(len(out), len(self._map) - offset), 0)
+            out[:n] = memoryview(self._map)[offset:offset+n]
+            return n
+        with self._lock:
+            self._f.seek(offset)
+            return self._f.readinto(out)
+
+    def _buffer(self, offset, size):
+        # returns buffer over archive data at offset (no copy if mapped)
+        self._checkOpen()
+        if self._map is not None:
+            return memoryview(self._map)[offset:offset+size]
+        with self._lock:
+            self._f.seek(offset)
+            return memoryview(self._f.read(size))
+
+    def _readMember(self, name):
+        # returns content of compressed member
+        with self._lock:
+            self._checkOpen()
+            if self._isZip:
+                if self._zip is None:
+                    self._zip = zipfile.ZipFile(self._path)
+                return self._zip.read(name)
+            if self._tar is None:
+                self._tar = tarfile.open(self._path)
+            return self._tar.extractfile(name).read()
+
+    @property
+    def path(self):
+        """Returns archive path."""
+        return self._path
+
+    def names(self):
+        """Returns names of DM3/DM4 members (in archive order)."""
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def is_stored(self, name):
+        """Returns True if member 'name' is stored (read at its offset in
+        archive), False if compressed."""
+        return self._index[name][0] is not None
+
+    def _source(self, name):
+        # returns DM3 source of member (stream over stored member, or
+        # in-memory file of decompressed member)
+        from ._dm3_lib import _MemoryFile
+        offset, size = self._index[name]
+        fullName = "%s/%s" % (self._path, name)
+        if offset is not None:
+            return _WindowFile(self, fullName, offset, size)
+        return _MemoryFile(memoryview(self._readMember(name)), fullName)
+
+    def open(self, name, **kwargs):
+        """Returns DM3 object of member 'name'; keyword arguments are
+        passed to DM3 (no pool, no cache). The DM3 object cannot read data
+        any more once the archive is closed."""
+        from ._dm3_lib import DM3
+        return DM3(self._source(name), **kwargs)
+
+    def thumbnail(self, name):
+        """Returns thumbnail data of member 'name' (see thumbnail)."""
+        from ._dm3_lib import thumbnail
+        return thumbnail(self._source(name))
+
+    def probe(self, name, imageIndex=1):
+        """Returns image data characteristics of member 'name' (see
+        probe)."""
+        from ._dm3_lib import probe
+        return probe(self._source(name), imageIndex)
+
+    def close(self):
+        """Closes archive."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    # (still exported to member buffers: closed when
+                    #  collected)
+                    pass
+                self._map = None
+            self._f.close()
+            for archive in (self._zip, self._tar):
+                if archive is not None:
+                    archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
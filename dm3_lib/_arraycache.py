@@ -0,0 +1,94 @@
+#!/usr/bin/python
+"""Process-wide LRU cache of image data arrays"""
+
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+
+__all__ = ["ArrayCache", "array_cache"]
+
+
+class ArrayCache(object):
+    """In-memory LRU cache of (read-only) numpy arrays, holding at most
+    'max_bytes' bytes of array data (cache disabled if 0).
+
+    Keys are typically (path, size, modification time, image index), so
+    that entries are shared by all DM3 objects of a file and out of date
+    as soon as the file changes."""
+
+    def __init__(self, max_bytes=0):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._arrays = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self):
+        """Returns cache budget (bytes)."""
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        """Sets cache budget (bytes); 0 disables cache."""
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    @property
+    def enabled(self):
+        """Returns True if cache is enabled."""
+        return self._max_bytes > 0
+
+    @property
+    def nbytes(self):
+        """Returns size of cached arrays (bytes)."""
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def get(self, key):
+        """Returns cached array for key (None if not cached)."""
+        with self._lock:
+            array = self._arrays.pop(key, None)
+            if array is None:
+                self.misses += 1
+                return None
+            # (most recently used last)
+            self._arrays[key] = array
+            self.hits += 1
+            return array
+
+    def put(self, key, array):
+        """Stores array for key (made read-only), if it fits in cache."""
+        if array.nbytes > self._max_bytes:
+            return
+        array.flags.writeable = False
+        with self._lock:
+            old = self._arrays.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._arrays[key] = array
+            self._nbytes += array.nbytes
+            self._evict()
+
+    def clear(self):
+        """Removes all cached arrays and resets hit/miss counters."""
+        with self._lock:
+            self._arrays.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        # remove least recently used arrays until cache fits in max_bytes
+        while self._arrays and (self._nbytes > self._max_bytes):
+            key, array = self._arrays.popitem(last=False)
+            self._nbytes -= array.nbytes
+
+
+# process-wide cache (disabled by default)
+array_cache = ArrayCache()
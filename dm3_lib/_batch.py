@@ -0,0 +1,129 @@
+#!/usr/bin/python
+"""Parallel batch reading of DM3/DM4 file metadata"""
+
+from __future__ import print_function
+
+import os
+import fnmatch
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # (Python 2 w/o futures backport: files read serially)
+    ProcessPoolExecutor = None
+
+__all__ = ["read_many", "scan_dir", "read_thumbnails", "contact_sheet",
+           "METADATA_FIELDS"]
+
+# metadata table columns (DM3.info fields are added as they are found)
+METADATA_FIELDS = ('filename', 'error', 'file_version', 'size', 'data_type',
+                   'data_type_str', 'pxsize')
+
+DEFAULTPATTERNS = ('*.dm3', '*.dm4')
+
+
+def _readMetadata(args):
+    """Returns metadata table row of one file (error captured in row)."""
+    filename, lazy, cache = args
+    from ._dm3_lib import DM3
+    row = dict.fromkeys(METADATA_FIELDS)
+    row['filename'] = filename
+    try:
+        with DM3(filename, lazy=lazy, cache=cache) as dm3f:
+            row['file_version'] = dm3f.file_version
+            row['size'] = dm3f.size
+            row['data_type'] = dm3f.data_type
+            row['data_type_str'] = dm3f.data_type_str
+            row['pxsize'] = dm3f.pxsize
+            row.update(dm3f.info)
+    except Exception as e:
+        row['error'] = "%s: %s" % (e.__class__.__name__, e)
+    return row
+
+
+def _readThumbnail(filename):
+    """Returns (thumbnail data, error message) of one file."""
+    from ._dm3_lib import thumbnail
+    try:
+        return thumbnail(filename), None
+    except Exception as e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+
+def _map(func, tasks, workers, chunksize):
+    # map func over tasks, in pool of 'workers' processes if worth it
+    if (workers == 1) or (ProcessPoolExecutor is None) or (len(tasks) < 2):
+        return [func(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, tasks, chunksize=chunksize))
+
+
+def _findFiles(directory, patterns=DEFAULTPATTERNS, recursive=True):
+    # returns paths of files matching patterns in directory (sorted)
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if any(fnmatch.fnmatch(name.lower(), p) for p in patterns):
+                paths.append(os.path.join(dirpath, name))
+        if not recursive:
+            break
+    return paths
+
+
+def read_many(paths, workers=None, lazy=True, cache=None, chunksize=16):
+    """Reads metadata of DM3/DM4 files 'paths' in parallel, using a pool of
+    'workers' processes (number of CPUs by default; files are read serially
+    if workers is 1).
+
+    Returns metadata table as list of rows (one dict per file, in 'paths'
+    order) with METADATA_FIELDS and DM3.info fields as keys. Files which
+    could not be read have an 'error' message (None otherwise) instead of
+    aborting the whole run. 'lazy' and 'cache' are passed to DM3."""
+    tasks = [(filename, lazy, cache) for filename in paths]
+    return _map(_readMetadata, tasks, workers, chunksize)
+
+
+def scan_dir(directory, patterns=DEFAULTPATTERNS, recursive=True, **kwargs):
+    """Reads metadata of all files matching 'patterns' in 'directory' (and
+    its sub-directories if 'recursive'). Keyword arguments are passed to
+    read_many."""
+    return read_many(_findFiles(directory, patterns, recursive), **kwargs)
+
+
+def read_thumbnails(paths, workers=None, chunksize=16):
+    """Reads thumbnails of DM3/DM4 files 'paths' (or of all DM3/DM4 files
+    in directory 'paths') in parallel (see read_many), using the thumbnail
+    fast path.
+
+    Returns list of (filename, thumbnail data or None, error message or
+    None), in 'paths' order."""
+    if isinstance(paths, str):
+        paths = _findFiles(paths)
+    paths = list(paths)
+    results = _map(_readThumbnail, paths, workers, chunksize)
+    return [ (filename, tndata, error)
+             for filename, (tndata, error) in zip(paths, results) ]
+
+
+def contact_sheet(paths, columns=8, tile_size=(128, 128), workers=None,
+                  background=0):
+    """Returns contact sheet (PIL Image, mode 'L') of the thumbnails of
+    DM3/DM4 files 'paths' (or of all DM3/DM4 files in directory 'paths'),
+    'columns' thumbnails per row, each fitted in a tile of 'tile_size'
+    (width, height) px. Tiles of files w/o readable thumbnail are left
+    blank ('background' gray level)."""
+    from PIL import Image
+    thumbnails = read_thumbnails(paths, workers)
+    tile_w, tile_h = tile_size
+    rows = max((len(thumbnails) + columns - 1) // columns, 1)
+    sheet = Image.new('L', (columns*tile_w, rows*tile_h), background)
+    for i, (filename, tndata, error) in enumerate(thumbnails):
+        if tndata is None:
+            continue
+        tn = Image.fromarray(tndata, 'L')
+        tn.thumbnail(tile_size)
+        x = (i % columns)*tile_w + (tile_w - tn.size[0])//2
+        y = (i // columns)*tile_h + (tile_h - tn.size[1])//2
+        sheet.paste(tn, (x, y))
+    return sheet
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+"""Batch conversion of DM3/DM4 files to TIFF (full depth) and PNG/JPEG
+(8-bit) images"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import glob
+import argparse
+
+import numpy
+
+from ._batch import _map, _findFiles
+
+__all__ = ["convert_file", "convert_many", "FORMATS"]
+
+# output formats: file extension -> (PIL format, 8-bit output)
+FORMATS = {
+    'tif': ('TIFF', False),
+    'png': ('PNG', True),
+    'jpg': ('JPEG', True),
+    }
+DEFAULTFORMATS = ('tif', 'png', 'jpg')
+
+# max. size (bytes) of image data normalized at once
+CHUNKBYTES = 16 * 1024**2
+
+
+def _outputPaths(filename, outdir, formats):
+    # returns output file paths (by format) of file filename
+    if outdir is None:
+        outdir = os.path.dirname(filename)
+    fileref = os.path.splitext(os.path.basename(filename))[0]
+    return dict( (fmt, os.path.join(outdir, "%s.%s" % (fileref, fmt)))
+                 for fmt in formats )
+
+
+def _isUpToDate(filename, paths):
+    # True if all output files exist and are newer than file filename
+    mtime = os.path.getmtime(filename)
+    for path in paths:
+        if not os.path.exists(path) or (os.path.getmtime(path) < mtime):
+            return False
+    return True
+
+
+def _normalize(ima, low, high):
+    """Returns image data array ima scaled from [low, high] to 0--255 (and
+    clipped) as 8-bit array, computed chunk by chunk (no full-size
+    temporary array)."""
+    out = numpy.empty(ima.shape, dtype=numpy.uint8)
+    if high == low:
+        out[...] = 0
+        return out
+    scale = 255. / (high - low)
+    flat = ima.reshape(-1)
+    flatOut = out.reshape(-1)
+    n = max(CHUNKBYTES // 4, 1)
+    for start in range(0, flat.size, n):
+        chunk = flat[start:start+n].astype(numpy.float32)
+        chunk -= low
+        chunk *= scale
+        numpy.clip(chunk, 0, 255, out=chunk)
+        numpy.rint(chunk, out=chunk)
+        flatOut[start:start+n] = chunk
+    return out
+
+
+def _displayRange(dm3f, ima, cuts, cutoff):
+    # returns display range for 8-bit conversion
+    if cuts == 'file':
+        try:
+            low, high = dm3f.contrastlimits
+        except KeyError:
+            low = high = None
+        if (low is not None) and (low != high):
+            return low, high
+        # (no cuts in file: fall back to computed cuts)
+        cuts = 'auto'
+    if cuts == 'auto':
+        from ._stats import image_stats
+        return image_stats(ima).cuts(cutoff)
+    return ima.min(), ima.max()
+
+
+def convert_file(filename, outdir=None, formats=DEFAULTFORMATS, cuts='file',
+                 cutoff=.1, force=False):
+    """Converts DM3/DM4 file filename to image files in 'outdir' (file
+    directory by default), named after the file, in 'formats' (among
+    FORMATS): TIFF w/ full depth image data, PNG/JPEG w/ image data scaled
+    to 8 bits within display range.
+
+    Display range is the file's cuts if 'cuts' is 'file' (computed cuts if
+    not set in file), cuts computed ignoring the 'cutoff'% lowest/highest
+    value pixels if 'auto', data min/max if 'none'.
+    Returns False if outputs were up to date (and not 'force'), True
+    otherwise."""
+    from PIL import Image
+    from ._dm3_lib import DM3
+    paths = _outputPaths(filename, outdir, formats)
+    if not force and _isUpToDate(filename, paths.values()):
+        return False
+    with DM3(filename) as dm3f:
+        ima = dm3f.imagedata
+        image8 = None
+        for fmt in formats:
+            pil_format, is8bit = FORMATS[fmt]
+            if not is8bit:
+                im = dm3f._makeImage(ima)
+            elif image8 is None:
+                image = dm3f.images[dm3f._chosenImage]
+                if ima.dtype.names:
+                    # (packed 8-bit colour: no scaling)
+                    image8 = dm3f._makeImage(ima)
+                elif image.dtype.shape:
+                    # (channel axis: RGB, RGBA, point, rect...)
+                    raise Exception(
+                        "Cannot convert %s data of %s to 8-bit %s image"
+                        % (image.data_type_str,
+                           os.path.split(filename)[1], fmt.upper()))
+                else:
+                    low, high = _displayRange(dm3f, ima, cuts, cutoff)
+                    ima8 = _normalize(ima, low, high)
+                    # (stacks as tall images, as DM3.Image)
+                    image8 = Image.fromarray(
+                        ima8.reshape(-1, ima8.shape[-1]), 'L')
+                im = image8
+            else:
+                im = image8
+            im.save(paths[fmt], pil_format)
+    return True
+
+
+def _convertTask(args):
+    """Converts one file; returns (status, error message)."""
+    filename, kwargs = args
+    try:
+        if convert_file(filename, **kwargs):
+            return 'converted', None
+        return 'skipped', None
+    except Exception as e:
+        return 'failed', "%s: %s" % (e.__class__.__name__, e)
+
+
+def _expandInputs(inputs):
+    # returns (path, output subdirectory) of DM3/DM4 files from files,
+    # directories (subdirectories mirrored in output directory) or glob
+    # patterns
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in _findFiles(item):
+                subdir = os.path.relpath(os.path.dirname(path), item)
+                paths.append( (path, '' if subdir == os.curdir else subdir) )
+        elif glob.has_magic(item):
+            paths.extend( (path, '') for path in sorted(glob.glob(item)) )
+        else:
+            paths.append( (item, '') )
+    return paths
+
+
+def _checkOutputs(tasks, formats):
+    # raises Exception if files of tasks (path, output dir.) have the same
+    # output files (e.g. img.dm3 and img.dm4)
+    targets = {}
+    for path, outdir in tasks:
+        for target in _outputPaths(path, outdir, formats).values():
+            target = os.path.normcase(os.path.abspath(target))
+            other = targets.setdefault(target, path)
+            if other != path:
+                raise Exception("%s and %s have the same output file %s"
+                                % (other, path, target))
+
+
+def convert_many(inputs, outdir=None, formats=DEFAULTFORMATS, cuts='file',
+                 cutoff=.1, force=False, workers=None):
+    """Converts DM3/DM4 files (files, directories or glob patterns
+    'inputs') in parallel, using a pool of 'workers' processes (see
+    read_many and convert_file).
+
+    Files of directories given in 'inputs' are converted to the same
+    subdirectories of 'outdir'. Raises Exception (before converting any
+    file) if two files would have the same output file.
+
+    Returns list of (filename, status, error message) where status is
+    'converted', 'skipped' (outputs up to date) or 'failed'."""
+    tasks = [ (path, os.path.join(outdir, subdir) if subdir else outdir)
+              for path, subdir in _expandInputs(inputs) ]
+    _checkOutputs(tasks, formats)
+    for fileOutdir in set( d for path, d in tasks ):
+        if (fileOutdir is not None) and not os.path.isdir(fileOutdir):
+            os.makedirs(fileOutdir)
+    kwargs = dict(formats=tuple(formats), cuts=cuts, cutoff=cutoff,
+                  force=force)
+    results = _map(_convertTask,
+                   [(path, dict(kwargs, outdir=d)) for path, d in tasks],
+                   workers, 4)
+    return [ (path, status, error)
+             for (path, d), (status, error) in zip(tasks, results) ]
+
+
+def main(argv=None):
+    """Command line interface: converts DM3/DM4 files."""
+    parser = argparse.ArgumentParser(
+        description="Convert DM3/DM4 files to TIFF/PNG/JPEG images.")
+    parser.add_argument("inputs", nargs='+',
+                        help="DM3/DM4 files, directories or glob patterns")
+    parser.add_argument("-o", "--outdir",
+                        help="output directory (default: next to files)")
+    parser.add_argument("-f", "--formats", default=",".join(DEFAULTFORMATS),
+                        help="comma-separated output formats, among %s "
+                             "(default: %%(default)s)"
+                             % ", ".join(sorted(FORMATS)))
+    parser.add_argument("--cuts", choices=['file', 'auto', 'none'],
+                        default='file',
+                        help="display range of 8-bit outputs: file cuts, "
+                             "computed cuts or data min/max "
+                             "(default: %(default)s)")
+    parser.add_argument("--cutoff", type=float, default=.1,
+                        help="%% of lowest/highest value pixels ignored by "
+                             "computed cuts (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number "
+                             "of CPUs)")
+    parser.add_argument("--force", action="store_true",
+                        help="convert files even if outputs are up to date")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print status of every file")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',')]
+    for fmt in formats:
+        if fmt not in FORMATS:
+            parser.error("unknown format '%s'" % fmt)
+
+    try:
+        results = convert_many(args.inputs, args.outdir, formats, args.cuts,
+                               args.cutoff, args.force, args.workers)
+    except Exception as e:
+        parser.error(str(e))
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    for path, status, error in results:
+        counts[status] += 1
+        if error is not None:
+            print("%s: %s" % (path, error), file=sys.stderr)
+        elif args.verbose:
+            print("%s: %s" % (path, status))
+    print("%(converted)s converted, %(skipped)s up to date, %(failed)s failed"
+          % counts)
+    return 1 if counts['failed'] else 0
@@ -14,17 +14,31 @@
 
 from __future__ import print_function
 
+import io
 import sys
 import os.path
 import struct
+import codecs
+import mmap
+import threading
+import contextlib
 import numpy
 from PIL import Image
 
-__all__ = ["DM3", "VERSION", "SUPPORTED_DATA_TYPES"]
+from ._tagcache import TagCache, _fileKey
+from ._filepool import FilePool
+from ._arraycache import ArrayCache, array_cache
+from ._tagstore import TagGroup, TagArray, TagStore, TagStringView
+from ._lazyarray import LazyArray, DEFAULTCHUNKBYTES
+from ._stats import ImageStats, image_stats, DEFAULTBINS
+from ._trace import FileTrace
+from . import _trace
 
-VERSION = '1.5'
+__all__ = ["DM3", "DM3Image", "LazyArray", "probe", "thumbnail", "TagCache",
+           "FilePool", "ArrayCache", "array_cache", "ImageStats",
+           "image_stats", "FileTrace", "VERSION", "SUPPORTED_DATA_TYPES"]
 
-debugLevel = 0   # 0=none, 1-3=basic, 4-5=simple, 6-10 verbose
+VERSION = '1.5'
 
 ## check for Python version
 PY3 = (sys.version_info[0] == 3)
@@ -190,8 +204,64 @@ dataTypes = {
     37: 'LAST_DATA',
     }
 
+## numpy dtypes of packed 8-bit colour pixels (4 bytes, LE: B,G,R[,A])
+## (the layout of RGB_UINT8_n and RGBA_UINT8_n pixels is not documented:
+##  assumed to be B,G,R[,A] from byte n on, wrapping around for RGBA)
+def _rgba(first):
+    # packed B,G,R,A bytes from byte 'first' on (wrapping around; fields
+    # in byte order)
+    names = 'BGRA'[-first:] + 'BGRA'[:-first] if first else 'BGRA'
+    return {'names': list(names), 'formats': ['u1']*4,
+            'offsets': [0, 1, 2, 3], 'itemsize': 4}
+
+_BGRA = _rgba(0)
+_BGR_0 = {'names': ['B', 'G', 'R'], 'formats': ['u1']*3,
+          'offsets': [0, 1, 2], 'itemsize': 4}
+_BGR_1 = {'names': ['B', 'G', 'R'], 'formats': ['u1']*3,
+          'offsets': [1, 2, 3], 'itemsize': 4}
+
+## numpy dtype strings associated to the various image dataTypes
+## (multi-channel pixels: structured dtype, or subarray dtype giving
+##  image data arrays a trailing channel axis)
+dT_str = {
+    1: '<i2',     #16-bit LE signed integer
+    2: '<f4',     #32-bit LE floating point
+    3: '<c8',     #64-bit LE complex (2x 32-bit float)
+    6: 'u1',      #8-bit unsigned integer
+    7: '<i4',     #32-bit LE signed integer
+    8: _BGRA,     #packed 8-bit colour (B,G,R,A)
+    9: 'i1',      #8-bit signed integer
+    10: '<u2',    #16-bit LE unsigned integer
+    11: '<u4',    #32-bit LE unsigned integer
+    12: '<f8',    #64-bit LE floating point
+    13: '<c16',   #128-bit LE complex (2x 64-bit float)
+    14: 'u1',     #binary
+    15: _BGR_0,   #packed 8-bit colour (B,G,R,-)
+    16: _BGR_1,   #packed 8-bit colour (-,B,G,R)
+    17: ('<u2', (3,)),    #16-bit LE unsigned R,G,B
+    18: ('<f4', (3,)),    #32-bit LE floating point R,G,B
+    19: ('<f8', (3,)),    #64-bit LE floating point R,G,B
+    20: _BGRA,    #packed 8-bit colour (B,G,R,A)
+    21: _rgba(1),     #packed 8-bit colour (A,B,G,R)
+    22: _rgba(2),     #packed 8-bit colour (R,A,B,G)
+    23: _rgba(3),     #packed 8-bit colour (G,R,A,B)
+    24: ('<u2', (4,)),    #16-bit LE unsigned R,G,B,A
+    25: ('<f4', (4,)),    #32-bit LE floating point R,G,B,A
+    26: ('<f8', (4,)),    #64-bit LE floating point R,G,B,A
+    27: ('<i2', (2,)),    #16-bit LE signed integer point (2 coords)
+    28: ('<i2', (2,)),
+    29: ('<i4', (2,)),    #32-bit LE signed integer point
+    30: ('<f4', (2,)),    #32-bit LE floating point point
+    31: ('<i2', (4,)),    #16-bit LE signed integer rectangle (4 coords)
+    32: ('<i4', (4,)),    #32-bit LE signed integer rectangle
+    33: ('<f4', (4,)),    #32-bit LE floating point rectangle
+    34: ('<f4', (4,)),
+    35: '<i8',    #64-bit LE signed integer
+    36: '<u8',    #64-bit LE unsigned integer
+    }
+
 ## supported Data Types
-dT_supported = [1, 2, 6, 7, 9, 10, 11, 14]
+dT_supported = sorted(dT_str)
 SUPPORTED_DATA_TYPES = {i: dataTypes[i] for i in dT_supported}
 
 ## other constants ##
@@ -202,339 +272,970 @@ MAXDEPTH = 64
 DEFAULTCHARSET = 'utf-8'
 ## END constants ##
 
+## precompiled binary formats ##
+_BELONG = struct.Struct('>l')
+_BELONGLONG = struct.Struct('>q')
+_ENTRYHEAD = struct.Struct('>bh')    # tag entry: data/group flag, label length
+
+# - decoders of tag labels and strings (from bytes, mmap or memoryview slices)
+_latin1 = codecs.latin_1_decode
+_utf16 = codecs.utf_16_le_decode
+
+# - association data type <--> binary format (buffer-based parsing)
+nativeStruct = {
+    SHORT: struct.Struct('<h'),
+    LONG: struct.Struct('<l'),
+    LONGLONG: struct.Struct('<q'),      # DM4
+    BELONGLONG: struct.Struct('>q'),    # DM4
+    USHORT: struct.Struct('<H'),
+    ULONG: struct.Struct('<L'),
+    FLOAT: struct.Struct('<f'),
+    DOUBLE: struct.Struct('<d'),
+    BOOLEAN: struct.Struct('<?'),
+    CHAR: struct.Struct('c'),
+    OCTET: struct.Struct('c'),
+}
 
-class DM3(object):
-    """DM3 object. """
+# - size in bytes of encoded data types (-1 for unrecognised types)
+encodedTypeSize = {
+    0: 0,
+    BOOLEAN: 1, CHAR: 1, OCTET: 1,
+    SHORT: 2, USHORT: 2,
+    LONG: 4, ULONG: 4, FLOAT: 4,
+    DOUBLE: 8, LONGLONG: 8, BELONGLONG: 8,
+}
 
-    ## utility functions
-    def _makeGroupString(self):
-        tString = str(self._curGroupAtLevelX[0])
-        for i in range( 1, self._curGroupLevel+1 ):
-            tString += '.{}'.format(self._curGroupAtLevelX[i])
-        return tString
-
-    def _makeGroupNameString(self):
-        tString = self._curGroupNameAtLevelX[0]
-        for i in range( 1, self._curGroupLevel+1 ):
-            tString += '.' + str( self._curGroupNameAtLevelX[i] )
-        return tString
-
-    def _readIntValue(self):
-        if (self._fileVersion == 4):
-            Val = readLongLong(self._f)
+# - association data type <--> numpy dtype (array tags)
+encodedTypeDtype = {
+    SHORT: '<i2',
+    LONG: '<i4',
+    LONGLONG: '<i8',      # DM4
+    BELONGLONG: '>i8',    # DM4
+    USHORT: '<u2',
+    ULONG: '<u4',
+    FLOAT: '<f4',
+    DOUBLE: '<f8',
+    BOOLEAN: '?',
+    CHAR: 'S1',
+    OCTET: 'u1',
+}
+
+def _arrayDtype(tagArray):
+    """Returns numpy dtype of items of TagArray tagArray (structured dtype
+    w/ fields f0, f1... if array of structs)"""
+    for encodedType in tagArray.itemTypes:
+        if encodedType not in encodedTypeDtype:
+            raise Exception("%s: unsupported array item type %s"
+                            % (tagArray.name, encodedType))
+    if tagArray.isStruct:
+        return numpy.dtype([ ('f%s' % i, encodedTypeDtype[encodedType])
+                             for i, encodedType
+                             in enumerate(tagArray.itemTypes) ])
+    elif len(tagArray.itemTypes) == 1:
+        return numpy.dtype( encodedTypeDtype[tagArray.itemTypes[0]] )
+    else:
+        raise Exception("%s: unsupported array item types %s"
+                        % (tagArray.name, tagArray.itemTypes))
+
+def _readHeader(buf):
+    """Reads DM3/DM4 file header in buffer buf.
+
+    Returns (file version, root tag dir. size, byte order, size consistency,
+    offset of root tag group); file version is 0 if not a DM3/DM4 file."""
+    fileSize = len(buf)
+    if fileSize < 16:
+        # (too short for header)
+        return 0, None, None, False, 0
+    # get version
+    fileVersion = _BELONG.unpack_from(buf, 0)[0]
+    # get size of root tag directory, check consistency
+    rootLen = None
+    sizeOK = True
+    pos = 4
+    if (fileVersion == 3):
+        rootLen = _BELONG.unpack_from(buf, pos)[0]
+        pos += 4
+        sizeOK = (rootLen == fileSize - 16)
+    elif (fileVersion == 4):
+        rootLen = _BELONGLONG.unpack_from(buf, pos)[0]
+        pos += 8
+        sizeOK = (rootLen == fileSize - 24)
+    # get byte-ordering
+    lE = _BELONG.unpack_from(buf, pos)[0]
+    pos += 4
+    littleEndian = (lE == 1)
+    if (rootLen is None) or not littleEndian:
+        fileVersion = 0
+    return fileVersion, rootLen, lE, sizeOK, pos
+
+def _mapFile(f):
+    """Returns read-only buffer over the whole content of (binary) file f,
+    memory-mapped if possible (or shared w/ in-memory file)"""
+    if isinstance(f, _MemoryFile):
+        # (new view: can be released independently)
+        return f.buffer[:]
+    if _isOSFile(f):
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # (e.g. empty file)
+            pass
+    if hasattr(f, 'getbuffer'):
+        # (io.BytesIO)
+        return f.getbuffer()
+    f.seek(0)
+    # (read until end of stream: read() may return less)
+    parts = []
+    while True:
+        data = f.read()
+        if not data:
+            break
+        parts.append(data)
+    return b''.join(parts)
+
+def _isOSFile(f):
+    """Returns True if f is a plain binary file over an OS file (content
+    of file is content of stream, e.g. not a gzip.GzipFile), which can be
+    memory-mapped."""
+    if isinstance(f, io.BufferedReader):
+        f = f.raw
+    return isinstance(f, io.FileIO) or (not PY3 and isinstance(f, file))
+
+def _sourceKind(source):
+    """Returns kind of DM3/DM4 file source: 'path' (file path), 'stream'
+    (seekable binary file-like object) or 'buffer' (file content as
+    bytes-like object)."""
+    if hasattr(source, 'read'):
+        return 'stream'
+    if isinstance(source, (unicode_str, str)) or hasattr(source, '__fspath__'):
+        # (NB: bytes are file content in Python 3)
+        return 'path'
+    return 'buffer'
+
+def _sourceName(source):
+    """Returns file name of source (for messages)."""
+    kind = _sourceKind(source)
+    if kind == 'path':
+        return os.path.split(source)[1]
+    name = getattr(source, 'name', None)
+    if isinstance(name, (unicode_str, str)):
+        return os.path.split(name)[1]
+    return '<%s>' % kind
+
+def _asBuffer(source):
+    """Returns 1D byte memoryview over bytes-like object source (no copy)."""
+    buf = memoryview(source)
+    if (buf.ndim != 1) or (buf.itemsize != 1):
+        buf = buf.cast('B')
+    return buf
+
+def _closeBuffer(buf):
+    """Closes memory map (or releases memoryview) buf, if no longer used."""
+    if hasattr(buf, 'close'):
+        buf.close()
+    elif hasattr(buf, 'release'):
+        try:
+            buf.release()
+        except BufferError:
+            # (still exported, e.g. to arrays: released when collected)
+            pass
+
+@contextlib.contextmanager
+def _sourceBuffer(source):
+    """Yields read-only buffer over the whole content of source (file path,
+    seekable binary stream or bytes-like object; see _sourceKind)."""
+    kind = _sourceKind(source)
+    if kind == 'buffer':
+        yield _asBuffer(source)
+        return
+    if kind == 'path':
+        f = open(source, 'rb')
+    else:
+        f = source
+    try:
+        buf = _mapFile(f)
+        try:
+            yield buf
+        finally:
+            _closeBuffer(buf)
+    finally:
+        if kind == 'path':
+            f.close()
+
+
+def _readIntoFrom(f, buf):
+    """Reads binary stream f (w/o readinto method) into writable buffer
+    buf, until buf is full or end of stream; returns number of bytes
+    read."""
+    out = memoryview(buf)
+    if (out.ndim != 1) or (out.itemsize != 1):
+        out = out.cast('B')
+    n = 0
+    while n < len(out):
+        data = f.read(len(out) - n)
+        if not data:
+            break
+        out[n:n+len(data)] = data
+        n += len(data)
+    return n
+
+
+class _MemoryFile(object):
+    """Read-only binary file 'name' over a byte buffer (memoryview), read
+    w/o intermediate copies."""
+
+    def __init__(self, buf, name=None):
+        self.buffer = buf
+        self.name = name
+        self._pos = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self.buffer)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        out = memoryview(b)
+        if (out.ndim != 1) or (out.itemsize != 1):
+            out = out.cast('B')
+        data = self.buffer[self._pos:self._pos+len(out)]
+        out[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[self._pos:self._pos+size].tobytes()
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self.buffer = None
+
+
+class _TagParser(object):
+    """Parser of a DM3/DM4 tag directory held in a buffer.
+
+    Tags are decoded at running offsets in buffer 'buf' with precompiled
+    struct.Struct objects, and stored (as native Python values) in TagGroup
+    objects.
+    If 'lazy' is True, tag groups met in a group being read are not read
+    but skipped: they are stored empty w/ their offset and size, and can
+    then be read later on with readTagGroup().
+    'base' is the file offset of buffer start (e.g., if buffer only holds
+    a tag group read from file): offsets stored in tags are file offsets."""
+
+    def __init__(self, buf, fileVersion, lazy=False, base=0):
+        self._buf = buf
+        self._lazy = lazy
+        self._base = base
+        # - end offsets of (DM3) groups already skipped, by start offset
+        self._groupEnd = {}
+        # number of tags (and groups) read
+        self.tagCount = 0
+        self._isDM4 = (fileVersion == 4)
+        if self._isDM4:
+            intFmt = 'q'
         else:
-            Val = readLong(self._f)
-        return Val
-
-    def _readTagGroup(self):
-        # go down a level
-        self._curGroupLevel += 1
-        # increment group counter
-        self._curGroupAtLevelX[self._curGroupLevel] += 1
-        # set number of current tag to -1
-        # --- readTagEntry() pre-increments => first gets 0
-        self._curTagAtLevelX[self._curGroupLevel] = -1
-        if ( debugLevel > 5):
-            print("rTG: Current Group Level:", self._curGroupLevel)
-        # is the group sorted?
-        sorted_ = readByte(self._f)
-        isSorted = (sorted_ == 1)
-        # is the group open?
-        opened = readByte(self._f)
-        isOpen = (opened == 1)
-        # number of Tags
-        nTags = self._readIntValue()
-        if ( debugLevel > 5):
-            print("rTG: Iterating over the", nTags, "tag entries in this group")
+            intFmt = 'l'
+        self._intStruct = struct.Struct('>' + intFmt)
+        self._intSize = self._intStruct.size
+        # tag type header: delimiter, nb. of type info. values, encoded type
+        self._typeHead = struct.Struct('>4s' + 2*intFmt)
+
+    def _readIntValue(self, pos):
+        return self._intStruct.unpack_from(self._buf, pos)[0]
+
+    def readTagGroup(self, pos, group):
+        """Reads tag group starting at pos into TagGroup group;
+        returns position after group."""
+        group.offset = None
+        # skip 'sorted' and 'open' flags, get number of Tags
+        nTags = self._readIntValue(pos + 2)
+        pos += 2 + self._intSize
+        self.tagCount += nTags
         # read Tags
         for i in range( nTags ):
-            self._readTagEntry()
-        # go back up one level as reading group is finished
-        self._curGroupLevel += -1
-        return 1
-
-    def _readTagEntry(self):
-        # is data or a new group?
-        data = readByte(self._f)
-        isData = (data == 21)
-        self._curTagAtLevelX[self._curGroupLevel] += 1
+            pos = self.readTagEntry(pos, group, i)
+        return pos
+
+    def readTagEntry(self, pos, group, tagIndex):
+        """Reads tag entry (data or group) starting at pos;
+        returns position after entry."""
+        buf = self._buf
+        # is data or a new group? get tag label length
+        data, lenTagLabel = _ENTRYHEAD.unpack_from(buf, pos)
+        pos += 3
         # get tag label if exists
-        lenTagLabel = readShort(self._f)
         if ( lenTagLabel != 0 ):
-            tagLabel = readString(self._f, lenTagLabel).decode('latin-1')
+            tagLabel = _latin1(buf[pos:pos+lenTagLabel])[0]
+            pos += lenTagLabel
         else:
-            tagLabel = str( self._curTagAtLevelX[self._curGroupLevel] )
-        if ( debugLevel > 5):
-            print("{}|{}:".format(self._curGroupLevel, self._makeGroupString()),
-                  end=' ')
-            print("Tag label = "+tagLabel)
-        elif ( debugLevel > 1 ):
-            print(str(self._curGroupLevel)+": Tag label = "+tagLabel)
+            tagLabel = str(tagIndex)
         # if DM4 file, get tag data size
-        if (self._fileVersion == 4):
-            lenTagData = readLongLong(self._f)
-            if ( debugLevel > 1 ):
-                print(str(self._curGroupLevel)+": Tag data size = "+str(lenTagData)+" bytes")
-        if isData:
-            # give it a name
-            self._curTagName = self._makeGroupNameString()+"."+tagLabel
-            # read it
-            self._readTagType()
-        else:
-            # it is a tag group
-            self._curGroupNameAtLevelX[self._curGroupLevel+1] = tagLabel
-            self._readTagGroup()  # increments curGroupLevel
-        return 1
-
-    def _readTagType(self):
-        delim = readString(self._f, 4).decode('latin-1')
-        if ( delim != '%%%%' ):
-            raise Exception(hex( self._f.tell() )
-                            + ": Tag Type delimiter not %%%%")
-        nInTag = self._readIntValue()
-        self._readAnyData()
-        return 1
-
-    def _encodedTypeSize(self, eT):
-        # returns the size in bytes of the data type
-        if eT == 0:
-            width = 0
-        elif eT in (BOOLEAN, CHAR, OCTET):
-            width = 1
-        elif eT in (SHORT, USHORT):
-            width = 2
-        elif eT in (LONG, ULONG, FLOAT):
-            width = 4
-        elif eT in (DOUBLE, LONGLONG, BELONGLONG):
-            width = 8
+        if self._isDM4:
+            lenTagData = _BELONGLONG.unpack_from(buf, pos)[0]
+            pos += 8
+        if (data == 21):
+            # it is data: read it
+            return self.readTagType(pos, group, tagLabel)
+        # it is a tag group
+        subGroup = TagGroup(group.name + "." + tagLabel)
+        group[tagLabel] = subGroup
+        if self._lazy:
+            # record it, then skip it
+            if self._isDM4:
+                end = pos + lenTagData
+            else:
+                end = self.skipTagGroup(pos)
+            subGroup.offset = pos + self._base
+            subGroup.size = end - pos
+            return end
         else:
-            # returns -1 for unrecognised types
-            width = -1
-        return width
+            return self.readTagGroup(pos, subGroup)
+
+    def readTagType(self, pos, group, tagLabel):
+        delim, nInTag, encodedType = self._typeHead.unpack_from(self._buf, pos)
+        if ( delim != b'%%%%' ):
+            raise Exception(hex(pos) + ": Tag Type delimiter not %%%%")
+        return self.readAnyData(pos + self._typeHead.size, group, tagLabel,
+                                encodedType)
 
-    def _readAnyData(self):
+    def readAnyData(self, pos, group, tagLabel, encodedType):
         ## higher level function dispatching to handling data types
         ## to other functions
-        # - get Type category (short, long, array...)
-        encodedType = self._readIntValue()
-        # - calc size of encodedType
-        etSize = self._encodedTypeSize(encodedType)
-        if ( debugLevel > 5):
-            print("rAnD, " + hex( self._f.tell() ) + ":", end=' ')
-            print("Tag Type = " + str(encodedType) + ",", end=' ')
-            print("Tag Size = " + str(etSize))
-        if ( etSize > 0 ):
-            self._storeTag( self._curTagName,
-                            self._readNativeData(encodedType, etSize) )
+        # - encodedType: Type category (short, long, array...)
+        if encodedType in nativeStruct:
+            val = nativeStruct[encodedType].unpack_from(self._buf, pos)[0]
+            pos += encodedTypeSize[encodedType]
+            group[tagLabel] = val
         elif ( encodedType == STRING ):
-            stringSize = self._readIntValue()
-            self._readStringData(stringSize)
+            stringSize = self._readIntValue(pos)
+            pos = self.readStringData(pos + self._intSize, stringSize,
+                                      group, tagLabel)
         elif ( encodedType == STRUCT ):
-            # does not store tags yet
-            structTypes = self._readStructTypes()
-            self._readStructData(structTypes)
+            pos, structTypes = self.readStructTypes(pos)
+            pos = self.readStructData(pos, structTypes, group, tagLabel)
         elif ( encodedType == ARRAY ):
-            # does not store tags yet
             # indicates size of skipped data blocks
-            arrayTypes = self._readArrayTypes()
-            self._readArrayData(arrayTypes)
+            isStruct = ( self._readIntValue(pos) == STRUCT )
+            pos, arrayTypes = self.readArrayTypes(pos)
+            pos = self.readArrayData(pos, arrayTypes, group, tagLabel,
+                                     isStruct)
         else:
-            raise Exception("rAnD, " + hex(self._f.tell())
+            raise Exception("rAnD, " + hex(pos)
                             + ": Can't understand encoded type")
-        return 1
+        return pos
 
-    def _readNativeData(self, encodedType, etSize):
-        # reads ordinary data types
-        if encodedType in readFunc:
-            val = readFunc[encodedType](self._f)
-        else:
-            raise Exception("rND, " + hex(self._f.tell())
-                            + ": Unknown data type " + str(encodedType))
-        if ( debugLevel > 3 ):
-            print("rND, " + hex(self._f.tell()) + ": " + str(val))
-        elif ( debugLevel > 1 ):
-            print(val)
-        return val
-
-    def _readStringData(self, stringSize):
+    def readStringData(self, pos, stringSize, group, tagLabel):
         # reads string data
         if ( stringSize <= 0 ):
             rString = ""
         else:
-            if ( debugLevel > 3 ):
-                print("rSD @ " + str(self._f.tell()) + "/" + hex(self._f.tell()) +" :", end=' ')
-            rString = readString(self._f, stringSize)
             # /!\ UTF-16 unicode string => convert to Python unicode str
-            rString = rString.decode('utf-16-le')
-            if ( debugLevel > 3 ):
-                print(rString + "   <"  + repr( rString ) + ">")
-        if ( debugLevel > 1 ):
-            print("StringVal:", rString)
-        self._storeTag( self._curTagName, rString )
-        return rString
-
-    def _readArrayTypes(self):
+            rString = _utf16(self._buf[pos:pos+stringSize])[0]
+            pos += stringSize
+        group[tagLabel] = rString
+        return pos
+
+    def readArrayTypes(self, pos):
         # determines the data types in an array data type
-        arrayType = self._readIntValue()
-        itemTypes = []
+        arrayType = self._readIntValue(pos)
+        pos += self._intSize
         if ( arrayType == STRUCT ):
-            itemTypes = self._readStructTypes()
+            pos, itemTypes = self.readStructTypes(pos)
         elif ( arrayType == ARRAY ):
-            itemTypes = self._readArrayTypes()
+            pos, itemTypes = self.readArrayTypes(pos)
         else:
-            itemTypes.append( arrayType )
-        return itemTypes
+            itemTypes = [arrayType]
+        return pos, itemTypes
 
-    def _readArrayData(self, arrayTypes):
+    def readArrayData(self, pos, arrayTypes, group, tagLabel, isStruct=False):
         # reads array data
-        arraySize = self._readIntValue()
-        
-        if ( debugLevel > 3 ):
-            print("rArD, " + hex( self._f.tell() ) + ":", end=' ')
-            print("Reading array of size = " + str(arraySize))
+        arraySize = self._readIntValue(pos)
+        pos += self._intSize
 
         itemSize = 0
         encodedType = 0
-
-        for i in range( len(arrayTypes) ):
-            encodedType = int( arrayTypes[i] )
-            etSize = self._encodedTypeSize(encodedType)
-            itemSize += etSize
-            if ( debugLevel > 5 ):
-                print("rArD: Tag Type = " + str(encodedType) + ",", end=' ')
-                print("Tag Size = " + str(etSize))
-            ##! readNativeData( encodedType, etSize ) !##
-
-        if ( debugLevel > 5 ):
-            print("rArD: Array Item Size = " + str(itemSize))
-
+        for encodedType in arrayTypes:
+            itemSize += encodedTypeSize.get(encodedType, -1)
         bufSize = arraySize * itemSize
 
-        if ( (not self._curTagName.endswith("ImageData.Data"))
-                and  ( len(arrayTypes) == 1 )
+        if ( ( len(arrayTypes) == 1 )
                 and  ( encodedType == USHORT )
-                and  ( arraySize < 256 ) ):
+                and  ( arraySize < 256 )
+                and  not (group.name + "." + tagLabel).endswith(
+                    "ImageData.Data") ):
             # treat as string
-            val = self._readStringData( bufSize )
+            return self.readStringData(pos, bufSize, group, tagLabel)
         else:
             # treat as binary data
             # - store data size and offset as tags
-            self._storeTag( self._curTagName + ".Size", bufSize )
-            self._storeTag( self._curTagName + ".Offset", self._f.tell() )
+            arrayGroup = TagArray(group.name + "." + tagLabel, arrayTypes,
+                                  isStruct)
+            arrayGroup["Size"] = bufSize
+            arrayGroup["Offset"] = pos + self._base
+            group[tagLabel] = arrayGroup
             # - skip data w/o reading
-            self._f.seek( self._f.tell() + bufSize )
-
-        return 1
+            return pos + bufSize
 
-    def _readStructTypes(self):
+    def readStructTypes(self, pos):
         # analyses data types in a struct
+        # skip struct name length, get number of fields
+        nFields = self._readIntValue(pos + self._intSize)
+        pos += 2 * self._intSize
+        if ( nFields > 100 ):
+            raise Exception(hex(pos) + ": Too many fields")
+        # get field types (skip field name lengths)
+        fieldTypes = []
+        for i in range( nFields ):
+            fieldTypes.append( self._readIntValue(pos + self._intSize) )
+            pos += 2 * self._intSize
+        return pos, fieldTypes
 
-        if ( debugLevel > 3 ):
-            print("Reading Struct Types at Pos = " + hex(self._f.tell()))
-        
-        structNameLength = self._readIntValue()
-        nFields = self._readIntValue()
+    def readStructData(self, pos, structTypes, group, tagLabel):
+        # reads struct data based on type info in structType
+        fieldValues = []
+        for encodedType in structTypes:
+            if encodedType not in nativeStruct:
+                raise Exception("rSD, " + hex(pos)
+                                + ": Unknown data type " + str(encodedType))
+            fieldValues.append(
+                nativeStruct[encodedType].unpack_from(self._buf, pos)[0] )
+            pos += encodedTypeSize[encodedType]
+        group[tagLabel] = tuple(fieldValues)
+        return pos
+
+    ## structural scan: skip tags w/o decoding them (lazy parsing, probing)
+
+    def findTagGroup(self, pos, groupLabels):
+        """Returns offset of tag group reached from group starting at pos
+        following the tag labels in groupLabels (None if not found);
+        tags and groups met on the way are skipped."""
+        buf = self._buf
+        for label in groupLabels:
+            nTags = self._readIntValue(pos + 2)
+            pos += 2 + self._intSize
+            for i in range( nTags ):
+                data, lenTagLabel = _ENTRYHEAD.unpack_from(buf, pos)
+                pos += 3
+                if ( lenTagLabel != 0 ):
+                    tagLabel = _latin1(buf[pos:pos+lenTagLabel])[0]
+                    pos += lenTagLabel
+                else:
+                    tagLabel = str(i)
+                if self._isDM4:
+                    lenTagData = _BELONGLONG.unpack_from(buf, pos)[0]
+                    pos += 8
+                if (data == 21):
+                    pos = self.skipTagType(pos)
+                elif (tagLabel == label):
+                    # found: go down one level
+                    break
+                elif self._isDM4:
+                    pos += lenTagData
+                else:
+                    pos = self.skipTagGroup(pos)
+            else:
+                return None
+        return pos
+
+
+    def skipTagGroup(self, pos):
+        """Skips tag group starting at pos; returns position after group."""
+        start = pos
+        end = self._groupEnd.get(start)
+        if end is not None:
+            return end
+        buf = self._buf
+        nTags = self._readIntValue(pos + 2)
+        pos += 2 + self._intSize
+        for i in range( nTags ):
+            data, lenTagLabel = _ENTRYHEAD.unpack_from(buf, pos)
+            pos += 3 + lenTagLabel
+            if self._isDM4:
+                pos += 8
+            if (data == 21):
+                pos = self.skipTagType(pos)
+            else:
+                pos = self.skipTagGroup(pos)
+        self._groupEnd[start] = pos
+        return pos
+
+    def skipTagType(self, pos):
+        """Skips tag data starting at pos; returns position after data."""
+        delim, nInTag, encodedType = self._typeHead.unpack_from(self._buf, pos)
+        pos += self._typeHead.size
+        if encodedType in nativeStruct:
+            return pos + encodedTypeSize[encodedType]
+        elif ( encodedType == STRING ):
+            return pos + self._intSize + max(self._readIntValue(pos), 0)
+        elif ( encodedType == STRUCT ):
+            pos, structTypes = self.readStructTypes(pos)
+            for encodedType in structTypes:
+                pos += encodedTypeSize.get(encodedType, -1)
+            return pos
+        elif ( encodedType == ARRAY ):
+            pos, arrayTypes = self.readArrayTypes(pos)
+            itemSize = 0
+            for encodedType in arrayTypes:
+                itemSize += encodedTypeSize.get(encodedType, -1)
+            return pos + self._intSize + self._readIntValue(pos) * itemSize
+        else:
+            raise Exception("sTT, " + hex(pos)
+                            + ": Can't understand encoded type")
 
-        if ( debugLevel > 5 ):
-            print("nFields = ", nFields)
 
-        if ( nFields > 100 ):
-            raise Exception(hex(self._f.tell())+": Too many fields")
 
-        fieldTypes = []
-        nameLength = 0
-        for i in range( nFields ):
-            nameLength = self._readIntValue()
-            if ( debugLevel > 9 ):
-                print("{}th nameLength = {}".format(i, nameLength))
-            fieldType = self._readIntValue()
-            fieldTypes.append( fieldType )
+class DM3Image(object):
+    """Image of a DM3/DM4 file (i.e., entry of root.ImageList): gives
+    access to image characteristics (from parsed Tags) and image data (read
+    on demand). Obtained from DM3.images."""
 
-        return fieldTypes
+    def __init__(self, dm3, index):
+        self._dm3 = dm3
+        self._index = index
+        self._name = "%s%s" % (IMGLIST, index)
 
-    def _readStructData(self, structTypes):
-        # reads struct data based on type info in structType
-        for i in range( len(structTypes) ):
-            encodedType = structTypes[i]
-            etSize = self._encodedTypeSize(encodedType)
-
-            if ( debugLevel > 5 ):
-                print("Tag Type = " + str(encodedType) + ",", end=' ')
-                print("Tag Size = " + str(etSize))
-
-            # get data
-            self._readNativeData(encodedType, etSize)
-
-        return 1
-
-    def _storeTag(self, tagName, tagValue):
-        # store Tags as list and dict
-        # NB: all tag values (and names) stored as unicode objects;
-        #     => can then be easily converted to any encoding
-        if ( debugLevel == 1 ):
-            print(" - storing Tag:")
-            print("  -- name:  ", tagName)
-            print("  -- value: ", tagValue, type(tagValue))
-        # - convert tag value to unicode if not already unicode object
-        self._storedTags.append( tagName + " = " + unicode_str(tagValue) )
-        self._tagDict[tagName] = unicode_str(tagValue)
+    def __repr__(self):
+        return "<DM3Image %s of '%s': %s %s>" % (
+            self._index, os.path.split(self._dm3.filename)[1],
+            'x'.join(str(n) for n in self.dimensions),
+            dataTypes.get(self.data_type))
+
+    def _tag(self, tagName):
+        # get typed value of Tag 'ImageData.tagName' of image
+        return self._dm3.typedtags["%s.ImageData.%s" % (self._name, tagName)]
+
+    @property
+    def index(self):
+        """Returns image index in ImageList."""
+        return self._index
+
+    @property
+    def name(self):
+        """Returns image tag group name."""
+        return self._name
+
+    @property
+    def dimensions(self):
+        """Returns image dimensions (width,height[,depth...])."""
+        dims = self._dm3.typedtags.group("%s.ImageData.Dimensions"
+                                         % self._name)
+        return tuple( dims[str(i)] for i in range(len(dims)) )
+
+    @property
+    def shape(self):
+        """Returns image data array shape (i.e., reversed dimensions)."""
+        return tuple(reversed(self.dimensions))
+
+    @property
+    def data_type(self):
+        """Returns image DataType."""
+        return self._tag("DataType")
+
+    @property
+    def data_type_str(self):
+        """Returns image DataType string."""
+        return dataTypes[self.data_type]
+
+    @property
+    def dtype(self):
+        """Returns numpy dtype of image data (None if unsupported)."""
+        if self.data_type in dT_str:
+            return numpy.dtype( dT_str[self.data_type] )
+        return None
+
+    @property
+    def data_offset(self):
+        """Returns image data offset in file."""
+        return self._tag("Data.Offset")
+
+    @property
+    def data_size(self):
+        """Returns image data size (bytes)."""
+        return self._tag("Data.Size")
+
+    @property
+    def calibrations(self):
+        """Returns (origin, scale, units) calibrations of image dimensions."""
+        calibrations = []
+        for i in range(len(self.dimensions)):
+            tag_root = "Calibrations.Dimension.%s" % i
+            try:
+                calibrations.append( (self._tag("%s.Origin" % tag_root),
+                                      self._tag("%s.Scale" % tag_root),
+                                      self._tag("%s.Units" % tag_root)) )
+            except KeyError:
+                calibrations.append( (0., 1., '') )
+        return calibrations
+
+    def _dataFormat(self):
+        # returns image data numpy dtype and shape (checked against data size)
+        filename = os.path.split(self._dm3.filename)[1]
+        data_type = self.data_type
+        # check if image DataType is implemented
+        np_dt = self.dtype
+        if np_dt is None:
+            raise Exception(
+                "Cannot extract image data from %s: unimplemented "
+                "DataType (%s:%s)." % (filename, data_type,
+                                       dataTypes[data_type])
+                )
+        if self._dm3._debug > 0:
+            print("Notice: image data in %s starts at %s" % (
+                filename, hex(self.data_offset)
+                ))
+            print("Notice: image data type: %s ('%s'), read as %s" % (
+                data_type, dataTypes[data_type], np_dt
+                ))
+        shape = self.shape
+        if self.data_size != numpy.prod(shape) * np_dt.itemsize:
+            raise Exception(
+                "Cannot extract image data from %s: inconsistent data size." %
+                filename)
+        return np_dt, shape
+
+    @property
+    def data(self):
+        """Extracts image data as numpy.array
+        (as read-only numpy.memmap if DM3 object created w/ mmap=True;
+        as read-only numpy.array shared by all DM3 objects of the file if
+        array_cache is enabled)"""
+        # - fetch from process-wide cache if enabled
+        cacheKey = None
+        if array_cache.enabled and not self._dm3._mmap and (
+                self._dm3._path is not None):
+            cacheKey = _fileKey(self._dm3.filename) + (self._index,)
+            ima = array_cache.get(cacheKey)
+            if ima is not None:
+                return ima
+        np_dt, shape = self._dataFormat()
+        # - read image data straight into numpy array (or map it)
+        ima = self._dm3._readArray(self.data_offset, np_dt, shape)
+
+        # if image dataType is BINARY, binarize image
+        # (i.e., px_value>0 is True)
+        if self.data_type == 14:
+            if self._dm3._mmap:
+                # (memory map is read-only)
+                ima = (ima > 0).astype(ima.dtype)
+            else:
+                ima[ima>0] = 1
+
+        if cacheKey is not None:
+            array_cache.put(cacheKey, ima)
+        return ima
+
+    @property
+    def lazydata(self):
+        """Returns image data as LazyArray: only the data needed are read
+        from file when indexed (e.g., lazydata[5] reads 6th frame of stack,
+        lazydata[:512,:512] reads top-left 512x512 px)."""
+        np_dt, shape = self._dataFormat()
+        if self.data_type == 14:
+            # binary: px_value>0 is True
+            convert = lambda ima: numpy.minimum(ima, 1)
+        else:
+            convert = None
+        return LazyArray(self._dm3._readInto, self.data_offset, np_dt, shape,
+                         convert)
+
+    def iter_chunks(self, axis=0, chunk_size=None, max_bytes=DEFAULTCHUNKBYTES,
+                    prefetch=False):
+        """Yields (start, chunk) pairs, reading image data chunk by chunk
+        along data array 'axis' (see LazyArray.iter_chunks)."""
+        return self.lazydata.iter_chunks(axis, chunk_size, max_bytes, prefetch)
+
+    def to_dask(self, chunks=None):
+        """Returns image data as dask array, chunks being read from file
+        when computed (see LazyArray.to_dask; needs dask)."""
+        return self.lazydata.to_dask(chunks)
+
+
+class DM3(object):
+    """DM3 object. """
+
+    ## utility functions
+    def _readTagGroup(self, group):
+        # read (not yet read) tag group
+        if self._closed:
+            raise Exception("Cannot read tags from closed file %s"
+                            % os.path.split(self._filename)[1])
+        if self._debug > 1:
+            print("Reading tag group '%s' at %s" % (group.name,
+                                                    hex(group.offset)))
+        tracing = _trace.enabled()
+        if tracing:
+            t0 = _trace.clock()
+        parser = self._parser
+        pos = group.offset
+        if parser is None:
+            # (file not kept mapped, e.g. w/ pool: read group from file)
+            buf = bytearray(group.size)
+            self._readInto(group.offset, buf)
+            parser = _TagParser(buf, self._fileVersion, True, group.offset)
+            pos = 0
+        n0 = parser.tagCount
+        parser.readTagGroup(pos, group)
+        if tracing:
+            _trace.emit(self._trace, 'tags', _trace.clock() - t0,
+                        ntags=parser.tagCount - n0)
+
+    @contextlib.contextmanager
+    def _openFile(self):
+        # yields open file (from pool if any)
+        if self._closed:
+            raise Exception("I/O operation on closed file %s"
+                            % os.path.split(self._filename)[1])
+        if self._pool is not None:
+            with self._pool.handle(self._poolKey, self._filename) as f:
+                yield f
+        else:
+            yield self._f
+
+    def _readInto(self, offset, buf):
+        # read data at offset in file into (writable) buffer buf
+        # (all file reads go through here)
+        tracing = _trace.enabled()
+        if tracing:
+            t0 = _trace.clock()
+        with self._lock:
+            with self._openFile() as f:
+                f.seek( offset )
+                if hasattr(f, 'readinto'):
+                    n = f.readinto(buf)
+                else:
+                    n = _readIntoFrom(f, buf)
+        if n != memoryview(buf).nbytes:
+            raise Exception("Unexpected end of file in %s"
+                            % os.path.split(self._filename)[1])
+        if tracing:
+            _trace.emit(self._trace, 'data', _trace.clock() - t0, nbytes=n)
+
+    def _readArray(self, offset, dtype, shape):
+        # read array of given dtype and shape at offset in file
+        # (or map it, read-only, if mmap: file or in-memory content;
+        #  streams are always read)
+        if self._mmap and ( (self._path is not None)
+                            or (self._memory is not None) ):
+            if self._closed:
+                raise Exception("I/O operation on closed file %s"
+                                % os.path.split(self._filename)[1])
+            if self._path is not None:
+                return numpy.memmap(self._filename, dtype=dtype, mode='r',
+                                    offset=offset, shape=shape)
+            ima = numpy.ndarray(shape, dtype=dtype, buffer=self._memory,
+                                offset=offset)
+            ima.flags.writeable = False
+            return ima
+        else:
+            ima = numpy.empty(shape, dtype=dtype)
+            self._readInto(offset, ima)
+            return ima
 
     ### END utility functions ###
 
-    def __init__(self, filename, debug=0):
-        """DM3 object: parses DM3 file."""
+    def __init__(self, filename, debug=0, mmap=False, lazy=False, cache=None,
+                 pool=None):
+        """DM3 object: parses DM3 file.
+
+        'filename' is a file path, a seekable binary file-like object (e.g.
+        io.BytesIO; file content from offset 0, not closed by close()) or
+        the file content as bytes-like object (bytes, bytearray,
+        memoryview..., parsed and read w/o copy).
+
+        If 'mmap' is True, image data are not read into memory but returned
+        as a read-only numpy.memmap over the file (pages are then only
+        loaded when accessed).
+        If 'lazy' is True, tag groups are only read when one of their tags
+        is first accessed (the file then remains mapped in memory, unless
+        a pool is given: groups are then read from the pool's file).
+        If 'cache' (TagCache object or cache directory) is given, tags are
+        fetched from cache if file did not change since cached, and stored
+        in cache otherwise (all tag groups are then read, even if lazy).
+        If 'pool' (FilePool object) is given, the file is not kept open but
+        (re)opened from the pool when data have to be read.
+        (Caches and pools only apply to file paths; in mmap mode, image
+        data of bytes-like objects are read-only arrays over their
+        content.)
+
+        The file remains open until close() is called (or until the end of
+        the 'with' block if DM3 object is used as context manager)."""
 
         ## initialize variables ##
         self._debug = debug
+        self._mmap = mmap
+        self._lazy = lazy
         self._outputcharset = DEFAULTCHARSET
-        self._filename = filename
+        # - file source: path, stream or content (see _sourceKind)
+        kind = _sourceKind(filename)
+        self._path = None
+        self._memory = None
+        if kind == 'path':
+            self._path = filename
+            self._filename = filename
+        else:
+            self._filename = getattr(filename, 'name', None)
+            if not isinstance(self._filename, (unicode_str, str)):
+                self._filename = _sourceName(filename)
+            # (no path to reopen file from)
+            pool = None
+            cache = None
+        if kind == 'buffer':
+            self._memory = _asBuffer(filename)
         self._chosenImage = 1
-        # - track currently read group
-        self._curGroupLevel = -1
-        self._curGroupAtLevelX = [ 0 for x in range(MAXDEPTH) ]
-        self._curGroupNameAtLevelX = [ '' for x in range(MAXDEPTH) ]
-        # - track current tag
-        self._curTagAtLevelX = [ '' for x in range(MAXDEPTH) ]
-        self._curTagName = ''
-        # - open file for reading
-        self._f = open( self._filename, 'rb' )
-        # - create Tags repositories
-        self._storedTags = []
-        self._tagDict = {}
+        self._images = None
+        self._parser = None
+        self._buf = None
+        self._trace = FileTrace(self._filename)
+        # - open file for reading (lock for seek+read)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pool = pool
+        self._poolKey = object()
+        # (called once closed, e.g. to release open file slot of aopen)
+        self._closeCallbacks = []
+        self._ownFile = (kind != 'stream')
+        if pool is not None:
+            self._f = None
+        elif kind == 'path':
+            self._f = open( self._filename, 'rb' )
+        elif kind == 'stream':
+            self._f = filename
+        else:
+            self._f = _MemoryFile(self._memory)
+
+        # get Tags from cache if available...
+        if (cache is not None) and not isinstance(cache, TagCache):
+            cache = TagCache(cache)
+        cached = None
+        if cache is not None:
+            t0 = _trace.clock()
+            cached = cache.get(self._filename)
+            if (cached is not None) and _trace.enabled():
+                _trace.emit(self._trace, 'tags', _trace.clock() - t0)
+        if cached is not None:
+            self._lazy = False
+            self._fileVersion = cached['file_version']
+            self._tagStore = TagStore(cached['tags'])
+            if self._debug > 0:
+                print("-- Tags read from cache --")
+        else:
+            # ... or map whole file (i.e., header and tag directory) for
+            # parsing
+            t0 = _trace.clock()
+            with self._openFile() as f:
+                buf = _mapFile(f)
+            try:
+                self._parse(buf, t0)
+            except:
+                self.close()
+                _closeBuffer(buf)
+                raise
+            # (buf is a memory map unless file could not be mapped;
+            #  kept for reading tag groups on demand if lazy, unless file
+            #  is opened from pool: a map would keep the file open)
+            if self._lazy and (pool is None):
+                self._buf = buf
+            else:
+                self._parser = None
+                _closeBuffer(buf)
+            if cache is not None:
+                self._tagStore.loadAll()
+                cache.put(self._filename, {
+                    'file_version': self._fileVersion,
+                    'tags': self._tagStore.root,
+                    })
+        # - Tag values as unicode strings
+        self._tagDict = TagStringView(self._tagStore)
+
+        # fetch image characteristics
+        image = self.images[self._chosenImage]
+        self._data_type = image.data_type
+        dims = image.dimensions
+        self._im_dims = dims
+        self._im_width = dims[0]
+        if len(dims) > 1:
+            self._im_height = dims[1]
+        else:
+            self._im_height = 1
+        # (number of 2D images, e.g. in stack or 4D dataset)
+        self._im_depth = int(numpy.prod(dims[2:]))
+
+        if self._debug > 0:
+            print("Notice: image size: %sx%s px" % (self._im_width,
+                                                    self._im_height))
+            if len(dims) > 3:
+                print("Notice: %s dataset"
+                      % "x".join(str(n) for n in dims[2:]))
+            elif self._im_depth>1:
+                print("Notice: %s image stack" % (self._im_depth))
+
+    def close(self):
+        """Closes file (tag groups and image data cannot be read any more,
+        data already read and read-only memory maps remain available)."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if (self._f is not None) and self._ownFile:
+                self._f.close()
+            self._f = None
+            if self._pool is not None:
+                self._pool.release(self._poolKey)
+            self._parser = None
+            _closeBuffer(self._buf)
+            self._buf = None
+            self._memory = None
+        for callback in self._closeCallbacks:
+            callback()
+        self._closeCallbacks = []
+
+    @property
+    def closed(self):
+        """Returns True if file is closed."""
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
+    def __aenter__(self):
+        from ._aio import aenter
+        return aenter(self)
+
+    def __aexit__(self, exc_type, exc_value, traceback):
+        from ._aio import aexit
+        return aexit(self)
+
+    def _parse(self, buf, t0=None):
+        """Parses file header and tag directory held in buffer buf
+        (mapped from time t0, for tracing)."""
         ## parse header
-        isDM3,isDM4 = (False, False)
-        # get version
-        fileVersion = readLong(self._f)
-        if (fileVersion == 3):
-            isDM3 = True
-        elif (fileVersion == 4): 
-            isDM4 = True
-        # get size of root tag directory, check consistency
-        fileSize = os.path.getsize(self._filename)
-        sizeOK = True
-        if isDM3:
-            rootLen = readLong(self._f)
-            if (rootLen != fileSize - 16):
-                sizeOK = False
-        elif isDM4:
-            rootLen = readLongLong(self._f)
-            if (rootLen != fileSize - 24):
-                sizeOK = False
-        # get byte-ordering
-        lE = readLong(self._f)
-        littleEndian = (lE == 1)
-        if not littleEndian:
-            isDM3,isDM4 = (False, False)
-            
+        fileVersion, rootLen, lE, sizeOK, pos = _readHeader(buf)
+        fileSize = len(buf)
+        if (t0 is not None) and _trace.enabled():
+            _trace.emit(self._trace, 'header', _trace.clock() - t0)
+
         # raise Exception if not DM3 or DM4
-        if not (isDM3 or isDM4):
+        if not fileVersion:
             raise Exception("'%s' does not appear to be a DM3/DM4 file."
                             % os.path.split(self._filename)[1])
         elif self._debug > 0:
-            print("'%s' appears to be a DM%s file" % (self._filename, fileVersion))
+            print("'%s' appears to be a DM%s file" % (self._filename,
+                                                      fileVersion))
 
-        if ( debugLevel > 5 or self._debug > 1):
+        if self._debug > 1:
             print("Header info. found:")
             print("- file version:", fileVersion)
             print("- byte order:", lE)
@@ -543,30 +1244,25 @@ class DM3(object):
             if not sizeOK:
                 msg = "Warning: file size and root tag dir. size inconsistent"
                 print("+ %s"%msg)
-        
+
         self._fileVersion = fileVersion
-        
-        # set name of root group (contains all data)...
-        self._curGroupNameAtLevelX[0] = "root"
-        # ... then read it
-        self._readTagGroup()
-        if self._debug > 0:
-            print("-- %s Tags read --" % len(self._storedTags))
 
-        # fetch image characteristics
-        tag_root = 'root.ImageList.1'
-        self._data_type = int( self.tags["%s.ImageData.DataType" % tag_root] )
-        self._im_width = int( self.tags["%s.ImageData.Dimensions.0" % tag_root] )
-        self._im_height = int( self.tags["%s.ImageData.Dimensions.1" % tag_root] )
-        try:
-            self._im_depth = int( self.tags['root.ImageList.1.ImageData.Dimensions.2'] )
-        except KeyError:
-            self._im_depth = 1        
+        # read root group (contains all data)
+        self._parser = _TagParser(buf, fileVersion, self._lazy)
+        root = TagGroup("root", pos)
+        self._tagStore = TagStore(root, self._readTagGroup)
+        self._readTagGroup(root)
+        if not self._lazy:
+            self._parser = None
+            if self._debug > 0:
+                print("-- %s Tags read --" % len(self._tagStore))
 
-        if self._debug > 0:
-            print("Notice: image size: %sx%s px" % (self._im_width, self._im_height))
-            if self._im_depth>1:
-                print("Notice: %s image stack" % (self._im_depth))
+    @property
+    def trace(self):
+        """Returns reading statistics of file (FileTrace: time spent per
+        phase, number of tags, read calls and bytes read), gathered while
+        tracing is enabled (see add_trace_hook)."""
+        return self._trace
 
     @property
     def file_version(self):
@@ -595,14 +1291,17 @@ class DM3(object):
 
     @property
     def depth(self):
-        """Returns image depth (i.e. number of images in stack)."""
+        """Returns image depth (i.e. number of images in stack, or in
+        higher-dimensional dataset)."""
         return self._im_depth
 
     @property
     def size(self):
-        """Returns image size (width,height[,depth])."""
+        """Returns image size (width,height[,depth...]): all image
+        dimensions (e.g., 4 for 4D-STEM datasets) if more than one 2D
+        image, (width,height) otherwise."""
         if self._im_depth > 1:
-            return (self._im_width, self._im_height, self._im_depth)
+            return self._im_dims
         else:
             return (self._im_width, self._im_height)
 
@@ -623,9 +1322,25 @@ class DM3(object):
 
     @property
     def tags(self):
-        """Returns all image Tags."""
+        """Returns all image Tags (values as unicode strings)."""
         return self._tagDict
 
+    @property
+    def typedtags(self):
+        """Returns all image Tags (values as native Python types)."""
+        return self._tagStore
+
+    def tagArray(self, tagName):
+        """Returns data of array Tag 'tagName' as numpy.array, read from file
+        in one go (structured array w/ fields f0, f1... if array of structs;
+        read-only numpy.memmap if DM3 object created w/ mmap=True)."""
+        tagArray = self._tagStore.group(tagName)
+        if not isinstance(tagArray, TagArray):
+            raise KeyError(tagName)
+        dtype = _arrayDtype(tagArray)
+        count = tagArray["Size"] // dtype.itemsize
+        return self._readArray(tagArray["Offset"], dtype, (count,))
+
     def dumpTags(self, dump_dir='/tmp'):
         """Dumps image Tags in a txt file."""
         dump_file = os.path.join(dump_dir,
@@ -636,7 +1351,7 @@ class DM3(object):
         except:
             print("Warning: cannot generate dump file.")
         else:
-            for tag in self._storedTags:
+            for tag in self._tagStore.dump():
                 dumpf.write( "{}\n".format(tag.encode(self._outputcharset)))
             dumpf.close
 
@@ -644,7 +1359,7 @@ class DM3(object):
     def info(self):
         """Extracts useful experiment info from DM3 file."""
         # define useful information
-        tag_root = 'root.ImageList.1.ImageTags'
+        tag_root = '%s.ImageTags' % self.images[self._chosenImage].name
         info_ = {
             'gms_v': "GMS Version.Created",
             'gms_v_': "GMS Version.Saved",
@@ -666,81 +1381,83 @@ class DM3(object):
             'specimen_old': "Microscope Info.Specimen",
         #    'image_notes': "root.DocumentObjectList.10.Text' # = Image Notes
             }
-        # get experiment information
+        # get experiment information (looked up in ImageTags group)
         infoDict = {}
+        try:
+            imageTags = self._tagStore.group(tag_root)
+        except KeyError:
+            return infoDict
         for key in info_.keys():
-            tag_name = "%s.%s" % (tag_root, info_[key])
-            if tag_name in self.tags:
-                # tags supplied as Python unicode str; convert to chosen charset
-                # (typically latin-1 or utf-8)
-                infoDict[key] = self.tags[tag_name].encode(self._outputcharset)
+            try:
+                value = self._tagStore.lookup(imageTags, info_[key])
+            except KeyError:
+                continue
+            # tags supplied as Python unicode str; convert to chosen charset
+            # (typically latin-1 or utf-8)
+            infoDict[key] = unicode_str(value).encode(self._outputcharset)
         # return experiment information
         return infoDict
 
     @property
-    def imagedata(self):
-        """Extracts image data as numpy.array"""
-
-        # numpy dtype strings associated to the various image dataTypes
-        dT_str = {
-            1: '<i2',     #16-bit LE signed integer
-            2: '<f4',     #32-bit LE floating point
-            6: 'u1',      #8-bit unsigned integer
-            7: '<i4',     #32-bit LE signed integer
-            9: 'i1',      #8-bit signed integer
-            10: '<u2',    #16-bit LE unsigned integer
-            11: '<u4',    #32-bit LE unsigned integer
-            14: 'u1',     #binary
-            }
-
-        # get relevant Tags
-        tag_root = 'root.ImageList.1'
-        data_offset = int( self.tags["%s.ImageData.Data.Offset" % tag_root] )
-        data_size = int( self.tags["%s.ImageData.Data.Size" % tag_root] )
-        data_type = self._data_type
-        im_width = self._im_width
-        im_height = self._im_height
-        im_depth = self._im_depth
-
-        if self._debug > 0:
-            print("Notice: image data in %s starts at %s" % (
-                os.path.split(self._filename)[1], hex(data_offset)
-                ))
-
-        # check if image DataType is implemented, then read
-        if data_type in dT_str:
-            np_dt = numpy.dtype( dT_str[data_type] )
-            if self._debug > 0:
-                print("Notice: image data type: %s ('%s'), read as %s" % (
-                    data_type, dataTypes[data_type], np_dt
-                    ))
-            self._f.seek( data_offset )
-            # - fetch image data
-            rawdata = self._f.read(data_size)
-            # - convert raw to numpy array w/ correct dtype
-            ima = numpy.fromstring(rawdata, dtype=np_dt)
-            # - reshape to matrix or stack
-            if im_depth > 1:
-                ima = ima.reshape(im_depth, im_height, im_width)
-            else:
-                ima = ima.reshape(im_height, im_width)
-        else:
-            raise Exception(
-                "Cannot extract image data from %s: unimplemented DataType (%s:%s)." %
-                (os.path.split(self._filename)[1], data_type, dataTypes[data_type])
-                )
+    def images(self):
+        """Returns list of images (DM3Image objects) in ImageList
+        (image 0 is usually the thumbnail)."""
+        if self._images is None:
+            imageList = self._tagStore.group(IMGLIST[:-1])
+            self._images = [ DM3Image(self, i) for i in range(len(imageList)) ]
+        return self._images
 
-        # if image dataType is BINARY, binarize image
-        # (i.e., px_value>0 is True)
-        if data_type == 14:
-            ima[ima>0] = 1
-
-        return ima
+    @property
+    def imagedata(self):
+        """Extracts image data as numpy.array
+        (as read-only numpy.memmap if DM3 object created w/ mmap=True)"""
+        return self.images[self._chosenImage].data
 
+    @property
+    def lazydata(self):
+        """Returns image data as LazyArray (read from file when indexed)."""
+        return self.images[self._chosenImage].lazydata
+
+    def iter_chunks(self, axis=0, chunk_size=None, max_bytes=DEFAULTCHUNKBYTES,
+                    prefetch=False):
+        """Yields (start, chunk) pairs, reading image data chunk by chunk
+        along data array 'axis' (e.g., axis 0 of stack/4D dataset), with
+        'chunk_size' indices per chunk or chunks of at most 'max_bytes'
+        bytes. If 'prefetch' is True, next chunk is read in background."""
+        return self.images[self._chosenImage].iter_chunks(
+            axis, chunk_size, max_bytes, prefetch)
+
+    def to_dask(self, chunks=None):
+        """Returns image data as dask array (e.g. for parallel, out-of-core
+        computations on stacks and 4D datasets), chunks being read from
+        file when computed; 'chunks' is any dask chunks specification
+        (by default, whole frames, up to 128 MB per chunk). Needs dask."""
+        return self.images[self._chosenImage].to_dask(chunks)
+
+    @classmethod
+    def aopen(cls, filename, executor=None, **kwargs):
+        """Coroutine: returns DM3 object of file filename, parsed in
+        'executor' (see dm3_lib.set_executor) w/o blocking asyncio event
+        loop. Keyword arguments are passed to DM3.
+        Files opened this way and not closed yet are capped (see
+        dm3_lib.set_max_open): close them (or use 'async with')."""
+        from ._aio import aopen
+        return aopen(cls, filename, executor, **kwargs)
+
+    def aread_image(self, index=None, executor=None):
+        """Coroutine: returns data of image 'index' (chosen image by
+        default), read in 'executor' w/o blocking asyncio event loop."""
+        from ._aio import aread_image
+        return aread_image(self, index, executor)
 
     @property
     def Image(self):
         """Returns image data as PIL Image"""
+        return self._makeImage()
+
+    def _makeImage(self, ima=None):
+        """Returns image data (array ima if given, read from file otherwise)
+        as PIL Image"""
 
         # define PIL Image mode for the various (supported) image dataTypes,
         # among:
@@ -748,15 +1465,24 @@ class DM3(object):
         # - 'L': 8-bit pixels, gray levels
         # - 'I': 32-bit integer pixels
         # - 'F': 32-bit floating point pixels
+        # - 'RGB': 3x8-bit pixels, true color
         dT_modes = {
             1: 'I',     # 16-bit LE signed integer
             2: 'F',     # 32-bit LE floating point
             6: 'L',     # 8-bit unsigned integer
             7: 'I',     # 32-bit LE signed integer
+            8: 'RGB',   # packed 8-bit colour
             9: 'I',     # 8-bit signed integer
             10: 'I',    # 16-bit LE unsigned integer
             11: 'I',    # 32-bit LE unsigned integer
+            12: 'F',    # 64-bit LE floating point
             14: 'L',    # "binary"
+            15: 'RGB',  # packed 8-bit colour
+            16: 'RGB',  # packed 8-bit colour
+            20: 'RGB',  # packed 8-bit colour (alpha ignored)
+            21: 'RGB',
+            22: 'RGB',
+            23: 'RGB',
             }
         
         # define loaded array dtype if has to be fixed to match Image mode
@@ -765,6 +1491,7 @@ class DM3(object):
             2:  'float32',    # 32-bit LE float to 32-bit float
             9:  'int32',      # 8-bit signed integer to 32-bit int
             10: 'int32',      # 16-bit LE u. integer to 32-bit int
+            12: 'float32',    # 64-bit LE float to 32-bit float
             }   
 
         # get relevant Tags
@@ -773,14 +1500,27 @@ class DM3(object):
         im_height = self._im_height    
         im_depth = self._im_depth
 
-        # fetch image data array
-        ima = self.imagedata
         # assign Image mode
+        if data_type not in dT_modes:
+            raise Exception(
+                "Cannot convert image data of %s to PIL Image "
+                "(DataType %s:%s)." % (os.path.split(self._filename)[1],
+                                       data_type, dataTypes[data_type]))
         mode_ = dT_modes[data_type]
 
+        # fetch image data array
+        if ima is None:
+            ima = self.imagedata
+        if mode_ == 'RGB':
+            # (packed colour pixels to R,G,B channels)
+            ima = numpy.stack([ima['R'], ima['G'], ima['B']], axis=-1)
+
         # reshape array if image stack
         if im_depth > 1:
-            ima = ima.reshape(im_height*im_depth, im_width)
+            if mode_ == 'RGB':
+                ima = ima.reshape(im_height*im_depth, im_width, 3)
+            else:
+                ima = ima.reshape(im_height*im_depth, im_width)
 
         # load image data array into Image object (recast array if necessary)
         if data_type in dT_newdtypes:
@@ -795,8 +1535,8 @@ class DM3(object):
     def contrastlimits(self):
         """Returns display range (cuts)."""
         tag_root = 'root.DocumentObjectList.0'
-        low = int(float(self.tags["%s.ImageDisplayInfo.LowLimit" % tag_root]))
-        high = int(float(self.tags["%s.ImageDisplayInfo.HighLimit" % tag_root]))
+        low = int(self.typedtags["%s.ImageDisplayInfo.LowLimit" % tag_root])
+        high = int(self.typedtags["%s.ImageDisplayInfo.HighLimit" % tag_root])
         cuts = (low, high)
         return cuts
 
@@ -805,14 +1545,21 @@ class DM3(object):
         """Returns display range (cuts)."""
         return self.contrastlimits
 
+    def stats(self, bins=DEFAULTBINS, max_bytes=DEFAULTCHUNKBYTES,
+              prefetch=False):
+        """Returns image statistics (ImageStats: min, max, histogram and
+        display range from cuts(cutoff), interchangeable with
+        contrastlimits), computed in one pass over image data read chunk
+        by chunk (see iter_chunks)."""
+        return image_stats(self.images[self._chosenImage], bins, max_bytes,
+                           prefetch)
+
     @property
     def pxsize(self):
-        """Returns pixel size and unit."""
-        tag_root = 'root.ImageList.1'
-        pixel_size = float(
-            self.tags["%s.ImageData.Calibrations.Dimension.0.Scale" % tag_root])
-        unit = self.tags["%s.ImageData.Calibrations.Dimension.0.Units" %
-                         tag_root]
+        """Returns pixel size and unit (KeyError if not calibrated)."""
+        image = self.images[self._chosenImage]
+        pixel_size = float(image._tag("Calibrations.Dimension.0.Scale"))
+        unit = image._tag("Calibrations.Dimension.0.Units")
         if unit == u'\xb5m':
             unit = 'micron'
         else:
@@ -825,69 +1572,27 @@ class DM3(object):
     @property
     def tnImage(self):
         """Returns thumbnail as PIL Image."""
-        # get thumbnail
-        tag_root = 'root.ImageList.0'
-        tn_size = int( self.tags["%s.ImageData.Data.Size" % tag_root] )
-        tn_offset = int( self.tags["%s.ImageData.Data.Offset" % tag_root] )
-        tn_width = int( self.tags["%s.ImageData.Dimensions.0" % tag_root] )
-        tn_height = int( self.tags["%s.ImageData.Dimensions.1" % tag_root] )
-
-        if self._debug > 0:
-            print("Notice: tn data in %s starts at %s" % (
-                os.path.split(self._filename)[1], hex(tn_offset)
-                ))
-            print("Notice: tn size: %sx%s px" % (tn_width, tn_height))
-
-        if (tn_width*tn_height*4) != tn_size:
-            raise Exception("Cannot extract thumbnail from %s"
-                            % os.path.split(self._filename)[1])
-        else:
-            self._f.seek( tn_offset )
-            rawdata = self._f.read(tn_size)
-            # - read as 32-bit LE unsigned integer
-            tn = Image.frombytes( 'F', (tn_width, tn_height), rawdata,
-                                   'raw', 'F;32' )
-            # - rescale and convert px data
-            tn = tn.point(lambda x: x * (1./65536) + 0)
-            tn = tn.convert('L')
-        # - return image
-        return tn
+        return Image.fromarray(self.thumbnaildata, 'L')
 
     @property
     def thumbnaildata(self):
-        """Fetch thumbnail image data as numpy.array"""
- 
+        """Fetch thumbnail image data as numpy.array (uint8)"""
         # get useful thumbnail Tags
-        tag_root = 'root.ImageList.0'
-        tn_size = int( self.tags["%s.ImageData.Data.Size" % tag_root] )
-        tn_offset = int( self.tags["%s.ImageData.Data.Offset" % tag_root] )
-        tn_width = int( self.tags["%s.ImageData.Dimensions.0" % tag_root] )
-        tn_height = int( self.tags["%s.ImageData.Dimensions.1" % tag_root] )
+        tn_image = self.images[0]
+        tn_offset = tn_image.data_offset
+        tn_shape = _thumbnailShape(tn_image.dimensions, tn_image.data_size,
+                                   self._filename)
 
         if self._debug > 0:
             print("Notice: tn data in %s starts at %s" % (
                 os.path.split(self._filename)[1], hex(tn_offset)
                 ))
-            print("Notice: tn size: %sx%s px" % (tn_width, tn_height))
-
-        # get thumbnail data
-        if (tn_width*tn_height*4) == tn_size:
-            self._f.seek(tn_offset)
-            rawtndata = self._f.read(tn_size)
-            print('## rawdata:', len(rawtndata))
-           # - read as 32-bit LE unsigned integer
-            np_dt_tn = numpy.dtype('<u4')
-            tndata = numpy.fromstring(rawtndata, dtype=np_dt_tn)
-            print('## tndata:', len(tndata))
-            tndata = tndata.reshape(tn_height, tn_width)
-            # - rescale and convert to integer
-            tndata = tndata/65536. + 0.
-            tndata = tndata.astype(int)
-            # - return thumbnail data
-            return tndata
-        else:
-            raise Exception("Cannot extract thumbnail from %s"
-                            % os.path.split(self._filename)[1])
+            print("Notice: tn size: %sx%s px" % tn_shape[::-1])
+
+        # get thumbnail data, read as 32-bit LE unsigned integer
+        tndata = numpy.empty(tn_shape, dtype='<u4')
+        self._readInto(tn_offset, tndata)
+        return _decodeThumbnail(tndata, inplace=True)
 
     def makePNGThumbnail(self, tn_file=''):
         """Save thumbnail as PNG file."""
@@ -902,13 +1607,91 @@ class DM3(object):
                 tn_path = tn_file
         # - save tn file
         try:
-            self.thumbnail.save(tn_path, 'PNG')
+            self.tnImage.save(tn_path, 'PNG')
             if self._debug > 0:
                 print("Thumbnail saved as '%s'." % tn_path)
         except:
             print("Warning: could not save thumbnail.")
 
 
+def _thumbnailShape(dims, data_size, filename):
+    """Returns thumbnail data array shape (checked against data size)."""
+    tn_width, tn_height = dims[:2]
+    if (tn_width*tn_height*4) != data_size:
+        raise Exception("Cannot extract thumbnail from %s"
+                        % _sourceName(filename))
+    return (tn_height, tn_width)
+
+def _decodeThumbnail(tndata, inplace=False):
+    """Converts thumbnail data (32-bit LE unsigned integers) to 8-bit
+    grayscale (px_value/65536, clipped to 255), in place if 'inplace' (only
+    for arrays allocated here, never for arrays over file content)."""
+    tndata = numpy.right_shift(tndata, 16, out=tndata if inplace else None)
+    return numpy.minimum(tndata, 255, out=tndata).astype(numpy.uint8)
+
+def _readImageData(buf, filename, imageIndex):
+    """Reads ImageData tag group of image 'imageIndex' in ImageList (and
+    nothing else) from buffer buf. Returns (header info, ImageData group)."""
+    fileVersion, rootLen, lE, sizeOK, pos = _readHeader(buf)
+    if not fileVersion:
+        raise Exception("'%s' does not appear to be a DM3/DM4 file."
+                        % _sourceName(filename))
+    info = {
+        'file_version': fileVersion,
+        'file_size': len(buf),
+        'root_len': rootLen,
+        'size_ok': sizeOK,
+        }
+    # go straight to image data group, then read it
+    parser = _TagParser(buf, fileVersion)
+    pos = parser.findTagGroup(pos,
+                              ['ImageList', str(imageIndex), 'ImageData'])
+    if pos is None:
+        raise Exception("No image #%s found in %s"
+                        % (imageIndex, _sourceName(filename)))
+    imageData = TagGroup("root.ImageList.%s.ImageData" % imageIndex)
+    parser.readTagGroup(pos, imageData)
+    return info, imageData
+
+def probe(filename, imageIndex=1):
+    """Fast probe of DM3/DM4 file: only reads header and image data
+    characteristics of image 'imageIndex' in ImageList ('filename': file
+    path, stream or file content, as for DM3).
+
+    Returns dict with file version, root tag dir. size and its consistency
+    with file size, image dimensions, DataType, and data offset and size."""
+    with _sourceBuffer(filename) as buf:
+        info, imageData = _readImageData(buf, filename, imageIndex)
+    dims = imageData["Dimensions"]
+    data_type = imageData["DataType"]
+    info.update({
+        'dimensions': tuple( dims[str(i)] for i in range(len(dims)) ),
+        'data_type': data_type,
+        'data_type_str': dataTypes.get(data_type),
+        'data_offset': imageData["Data"]["Offset"],
+        'data_size': imageData["Data"]["Size"],
+        })
+    return info
+
+def thumbnail(filename):
+    """Fast thumbnail extraction: only parses tags up to thumbnail image
+    (image 0 in ImageList) of file 'filename' (path, stream or content).
+    Returns thumbnail data as numpy.array (uint8), as DM3.thumbnaildata."""
+    with _sourceBuffer(filename) as buf:
+        info, imageData = _readImageData(buf, filename, 0)
+        dims = imageData["Dimensions"]
+        tn_shape = _thumbnailShape(
+            tuple( dims[str(i)] for i in range(len(dims)) ),
+            imageData["Data"]["Size"], filename)
+        raw = numpy.frombuffer(buf, dtype='<u4',
+                               count=tn_shape[0]*tn_shape[1],
+                               offset=imageData["Data"]["Offset"])
+        tndata = _decodeThumbnail(raw.reshape(tn_shape))
+        # (release buffer before closing it)
+        del raw
+    return tndata
+
+
 ## MAIN ##
 if __name__ == '__main__':
     print("dm3_lib %s" % VERSION)
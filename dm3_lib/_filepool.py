@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""Bounded pool of open file handles shared by DM3 objects"""
+
+from __future__ import print_function
+
+import threading
+import contextlib
+from collections import OrderedDict
+
+__all__ = ["FilePool"]
+
+DEFAULTMAXOPEN = 256
+
+
+class FilePool(object):
+    """LRU pool of (binary, read-only) file handles, one per owner (e.g.
+    DM3 object) keyed by an owner token.
+
+    At most 'max_open' files are kept open: least recently used handles
+    are closed when more are needed, and transparently reopened on the
+    next access of their owner. Handles in use are never closed (so the
+    limit may be exceeded while more than 'max_open' are in use at once)."""
+
+    def __init__(self, max_open=DEFAULTMAXOPEN):
+        self._max_open = max_open
+        self._lock = threading.Lock()
+        # owner token -> [file, number of users]
+        self._handles = OrderedDict()
+
+    @property
+    def max_open(self):
+        """Returns max. number of open files."""
+        return self._max_open
+
+    @property
+    def open_count(self):
+        """Returns number of files currently open."""
+        return len(self._handles)
+
+    @contextlib.contextmanager
+    def handle(self, owner, filename):
+        """Context manager: yields open file filename of 'owner' (file is
+        opened if needed, and not closed by pool while in use)."""
+        with self._lock:
+            entry = self._handles.pop(owner, None)
+            if entry is None:
+                entry = [open(filename, 'rb'), 0]
+            entry[1] += 1
+            # (most recently used last)
+            self._handles[owner] = entry
+            self._evict()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if (entry[1] == 0) and (self._handles.get(owner) is not entry):
+                    # (released while in use)
+                    entry[0].close()
+
+    def release(self, owner):
+        """Closes file of 'owner' (if open, once not in use any more)."""
+        with self._lock:
+            entry = self._handles.pop(owner, None)
+            if (entry is not None) and (entry[1] == 0):
+                entry[0].close()
+
+    def clear(self):
+        """Closes all files not in use."""
+        with self._lock:
+            for owner in list(self._handles):
+                if self._handles[owner][1] == 0:
+                    self._handles.pop(owner)[0].close()
+
+    def _evict(self):
+        # close least recently used files not in use, down to max_open
+        n = len(self._handles) - self._max_open
+        if n <= 0:
+            return
+        for owner in list(self._handles):
+            if n <= 0:
+                break
+            if self._handles[owner][1] == 0:
+                self._handles.pop(owner)[0].close()
+                n -= 1
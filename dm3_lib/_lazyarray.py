@@ -0,0 +1,341 @@
+#!/usr/bin/python
+"""Lazily read arrays for DM3/DM4 image data"""
+
+from __future__ import print_function, division
+
+import numbers
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+__all__ = ["LazyArray"]
+
+# max. gap (bytes) between two data blocks to read them in one go
+MAXGAP = 4096
+
+# default memory budget (bytes) of chunks read by LazyArray.iter_chunks
+DEFAULTCHUNKBYTES = 256 * 1024**2
+
+# default max. size (bytes) of dask array chunks (LazyArray.to_dask)
+DASKCHUNKBYTES = 128 * 1024**2
+
+
+class LazyArray(object):
+    """Array of given dtype and shape stored (C order) at 'offset' in a
+    file, only read when indexed.
+
+    Indexing follows numpy rules; only the requested indices of leading
+    axes (and the range they span along the last axis) are read, through
+    the 'readInto' callable (taking a file offset and a writable buffer to
+    fill). Close byte ranges are read in one go. 'convert' (if any) is
+    applied to the data read."""
+
+    def __init__(self, readInto, offset, dtype, shape, convert=None):
+        self._readInto = readInto
+        self._offset = offset
+        self._dtype = numpy.dtype(dtype)
+        self._shape = tuple(int(n) for n in shape)
+        if self._dtype.subdtype is not None:
+            # (subarray dtype, e.g. RGB pixels: trailing channel axis)
+            self._dtype, channels = self._dtype.subdtype
+            self._shape += channels
+        self._convert = convert
+        # - byte strides (C order)
+        strides = []
+        stride = self._dtype.itemsize
+        for n in reversed(self._shape):
+            strides.insert(0, stride)
+            stride *= n
+        self._strides = tuple(strides)
+
+    def __repr__(self):
+        return "LazyArray(shape=%s, dtype=%s)" % (self._shape, self._dtype)
+
+    @property
+    def shape(self):
+        """Returns array shape."""
+        return self._shape
+
+    @property
+    def dtype(self):
+        """Returns array dtype."""
+        return self._dtype
+
+    @property
+    def ndim(self):
+        """Returns number of array dimensions."""
+        return len(self._shape)
+
+    @property
+    def size(self):
+        """Returns number of array items."""
+        return int(numpy.prod(self._shape))
+
+    @property
+    def nbytes(self):
+        """Returns array size (bytes)."""
+        return self.size * self._dtype.itemsize
+
+    @property
+    def offset(self):
+        """Returns array data offset in file."""
+        return self._offset
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def _normalizeKey(self, key):
+        # returns (indices read along each axis: [lo, hi) range, or sorted
+        # index array on leading axes; key to apply to block read)
+        if not isinstance(key, tuple):
+            key = (key,)
+        # - expand Ellipsis
+        nAxes = sum(1 for k in key if (k is not None) and (k is not Ellipsis))
+        expanded = []
+        for k in key:
+            if k is Ellipsis:
+                expanded.extend([slice(None)] * (len(self._shape) - nAxes))
+                nAxes = len(self._shape)
+            else:
+                expanded.append(k)
+        if nAxes > len(self._shape):
+            raise IndexError("too many indices for array")
+        expanded.extend([slice(None)] * (len(self._shape) - nAxes))
+
+        ranges = []
+        blockKey = []
+        axis = 0
+        for k in expanded:
+            if k is None:
+                blockKey.append(None)
+                continue
+            n = self._shape[axis]
+            if isinstance(k, numbers.Integral):
+                k = int(k)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError("index %s is out of bounds for axis %s "
+                                     "with size %s" % (k, axis, n))
+                ranges.append( (k, k+1) )
+                blockKey.append(0)
+            elif isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                # (number of indices, last index)
+                if step > 0:
+                    count = max((stop - start + step - 1) // step, 0)
+                else:
+                    count = max((start - stop - step - 1) // -step, 0)
+                if count == 0:
+                    ranges.append( (0, 0) )
+                    blockKey.append(slice(0, 0))
+                else:
+                    last = start + (count - 1) * step
+                    lo = min(start, last)
+                    hi = max(start, last) + 1
+                    if (abs(step) > 1) and (axis < len(self._shape) - 1):
+                        # (leading axis: selected indices only)
+                        ranges.append(numpy.arange(lo, hi, abs(step)))
+                        blockKey.append(slice(None, None, 1 if step > 0
+                                              else -1))
+                    else:
+                        stop = last - lo + (1 if step > 0 else -1)
+                        ranges.append( (lo, hi) )
+                        blockKey.append(slice(start - lo,
+                                              stop if stop >= 0 else None,
+                                              step))
+            else:
+                # index array (integer or boolean)
+                a = numpy.asarray(k)
+                if a.dtype == bool:
+                    if a.shape != (n,):
+                        raise IndexError("boolean index of shape %s does not "
+                                         "match axis %s" % (a.shape, axis))
+                    a = numpy.nonzero(a)[0]
+                elif a.dtype.kind not in 'iu':
+                    raise IndexError("only integers, slices, ellipsis, "
+                                     "numpy.newaxis and integer or boolean "
+                                     "arrays are valid indices")
+                a = numpy.where(a < 0, a + n, a)
+                if a.size and ((a.min() < 0) or (a.max() >= n)):
+                    raise IndexError("index out of bounds for axis %s with "
+                                     "size %s" % (axis, n))
+                if axis < len(self._shape) - 1:
+                    # (leading axis: selected indices only)
+                    indices = numpy.unique(a)
+                    ranges.append(indices)
+                    blockKey.append(numpy.searchsorted(indices, a))
+                    axis += 1
+                    continue
+                if a.size:
+                    lo, hi = int(a.min()), int(a.max()) + 1
+                else:
+                    lo, hi = 0, 0
+                ranges.append( (lo, hi) )
+                blockKey.append(a - lo)
+            axis += 1
+        return ranges, tuple(blockKey)
+
+    def _readBlock(self, ranges):
+        # read block spanned by ranges (per axis: [lo, hi) range, or sorted
+        # index array)
+        shape = tuple( len(r) if isinstance(r, numpy.ndarray) else r[1] - r[0]
+                       for r in ranges )
+        block = numpy.empty(shape, dtype=self._dtype)
+        if block.size == 0:
+            return block
+        # - find first axis from which block is contiguous in file
+        c = len(ranges)
+        while ( c > 0 ) and not isinstance(ranges[c-1], numpy.ndarray) and (
+                tuple(ranges[c-1]) == (0, self._shape[c-1]) ):
+            c -= 1
+        if ( c > 0 ) and not isinstance(ranges[c-1], numpy.ndarray):
+            c -= 1
+        # - offsets of contiguous data chunks (one per index on axes < c)
+        start = self._offset + sum( r[0] * stride for r, stride
+                                    in zip(ranges[c:], self._strides[c:]) )
+        offsets = numpy.array([start], dtype=numpy.int64)
+        for r, stride in zip(ranges[:c], self._strides[:c]):
+            if isinstance(r, numpy.ndarray):
+                indices = r.astype(numpy.int64)
+            else:
+                indices = numpy.arange(r[0], r[1], dtype=numpy.int64)
+            offsets = ( offsets[:, numpy.newaxis] + indices * stride
+                        ).ravel()
+        chunks = block.reshape(len(offsets), -1)
+        chunkSize = chunks[0].nbytes
+        # - read chunks, in one go for chunks close to each other
+        i = 0
+        while i < len(offsets):
+            j = i + 1
+            while ( j < len(offsets)
+                    and offsets[j] - offsets[j-1] - chunkSize <= MAXGAP ):
+                j += 1
+            if j == i + 1:
+                self._readInto(int(offsets[i]), chunks[i])
+            else:
+                span = numpy.empty(int(offsets[j-1] - offsets[i]) + chunkSize,
+                                   dtype=numpy.uint8)
+                self._readInto(int(offsets[i]), span)
+                for k in range(i, j):
+                    pos = int(offsets[k] - offsets[i])
+                    chunks[k] = span[pos:pos+chunkSize].view(chunks.dtype)
+            i = j
+        return block
+
+    def __getitem__(self, key):
+        ranges, blockKey = self._normalizeKey(key)
+        data = self._readBlock(ranges)[blockKey]
+        if self._convert is not None:
+            data = self._convert(data)
+        return data
+
+    def to_dask(self, chunks=None):
+        """Returns array as dask array, each chunk being read from file (by
+        LazyArray indexing) when computed. 'chunks' is any dask chunks
+        specification; by default, chunks span whole trailing axes (i.e.,
+        contiguous byte ranges, e.g. whole frames of stack) and are at
+        most DASKCHUNKBYTES bytes ('auto' chunks if a single index along
+        axis 0 is larger).
+
+        Needs dask (imported on demand); chunks are read by threads (array
+        cannot be pickled, e.g. for multi-process schedulers)."""
+        import dask.array
+        if chunks is None:
+            chunks = 'auto'
+            if self._shape:
+                n = self._shape[0]
+                indexBytes = self.nbytes // max(n, 1)
+                size = DASKCHUNKBYTES // max(indexBytes, 1)
+                if size >= 1:
+                    chunks = (max(min(size, n), 1),) + self._shape[1:]
+        # (file reads are serialized by readInto: no dask lock needed)
+        return dask.array.from_array(
+            self, chunks=chunks, name=False, lock=False, asarray=False,
+            fancy=False, meta=numpy.empty((0,) * len(self._shape),
+                                          dtype=self._dtype))
+
+    def iter_chunks(self, axis=0, chunk_size=None, max_bytes=DEFAULTCHUNKBYTES,
+                    prefetch=False):
+        """Yields (start, chunk) pairs, chunk being array[start:start+n]
+        along 'axis' (n = 'chunk_size' indices, the last chunk possibly
+        smaller), i.e., reads array chunk by chunk.
+
+        If 'chunk_size' is None, it is chosen so that chunks held in memory
+        at once do not exceed 'max_bytes' bytes. If 'prefetch' is True, the
+        next chunk is read by a background thread while the current one is
+        processed (then at most 3 chunks are held in memory at once)."""
+        if not self._shape:
+            raise IndexError("cannot iterate over 0-d array")
+        if axis < 0:
+            axis += len(self._shape)
+        if not 0 <= axis < len(self._shape):
+            raise IndexError("axis %s is out of bounds for array of "
+                             "dimension %s" % (axis, len(self._shape)))
+        n = self._shape[axis]
+        if chunk_size is None:
+            indexBytes = self.nbytes // max(n, 1)
+            nChunks = 3 if prefetch else 1
+            chunk_size = max_bytes // max(nChunks * indexBytes, 1)
+        chunk_size = max(int(chunk_size), 1)
+        starts = range(0, n, chunk_size)
+        head = (slice(None),) * axis
+
+        def readChunk(start):
+            return self[head + (slice(start, start + chunk_size),)]
+
+        if not prefetch:
+            for start in starts:
+                yield start, readChunk(start)
+            return
+
+        # - read chunks in background thread (one chunk ahead)
+        chunks = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(item):
+            # queue item unless consumer stopped; returns False if stopped
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def reader():
+            try:
+                for start in starts:
+                    if not put((start, readChunk(start), None)):
+                        return
+            except Exception as e:
+                put((None, None, e))
+                return
+            put((None, None, None))
+
+        thread = threading.Thread(target=reader)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                start, chunk, error = chunks.get()
+                if error is not None:
+                    raise error
+                if start is None:
+                    break
+                yield start, chunk
+        finally:
+            # (generator closed early: stop reader)
+            stop.set()
+            thread.join()
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+"""Image statistics (min/max, histogram, display range) computed in one
+chunked pass over image data"""
+
+from __future__ import print_function, division
+
+import numpy
+
+from ._lazyarray import LazyArray, DEFAULTCHUNKBYTES
+
+__all__ = ["ImageStats", "image_stats", "histogram_cuts"]
+
+DEFAULTBINS = 512
+
+# number of values binned at once (bounds temporary arrays size)
+BLOCKSIZE = 1024**2
+
+
+def histogram_cuts(counts, edges, cutoff=.1):
+    """Returns display range (cuts) from histogram (bin 'counts' and bin
+    'edges'), i.e. ignoring the 'cutoff'% lowest/highest value pixels."""
+    counts = numpy.asarray(counts)
+    threshold = counts.sum() * cutoff / 100.
+    # - lower cut: first bin edge w/ 'cutoff'% pixels below
+    i = numpy.searchsorted(numpy.cumsum(counts), threshold) + 1
+    # - higher cut: last bin edge w/ 'cutoff'% pixels above
+    j = numpy.searchsorted(numpy.cumsum(counts[::-1]), threshold) + 1
+    i = min(i, len(counts) - 1)
+    j = min(j, len(counts))
+    return (int(round(edges[i])), int(round(edges[len(counts) - j])))
+
+
+class ImageStats(object):
+    """Statistics of image data: min, max, (finite) pixel count and
+    histogram, accumulated chunk by chunk with add().
+
+    The histogram has 'bins' bins; its range grows as needed (bin width
+    doubled, pairs of bins merged), so that counts stay exact w/o knowing
+    the data range beforehand (bins may then be wider than if the range
+    was known, e.g. if first chunks only span part of it)."""
+
+    def __init__(self, bins=DEFAULTBINS):
+        if bins % 2:
+            bins += 1
+        self._counts = numpy.zeros(bins, dtype=numpy.int64)
+        self._lo = None
+        self._width = None
+        self._min = None
+        self._max = None
+
+    def _grow(self, cmin, cmax):
+        # double histogram range until it covers [cmin, cmax]
+        bins = len(self._counts)
+        while ( cmin < self._lo ) or ( cmax > self._lo + bins*self._width ):
+            merged = self._counts.reshape(-1, 2).sum(axis=1)
+            self._counts[:] = 0
+            if cmin < self._lo:
+                # (extend downwards)
+                self._lo -= bins*self._width
+                self._counts[bins//2:] = merged
+            else:
+                self._counts[:bins//2] = merged
+            self._width *= 2
+
+    def add(self, data):
+        """Adds data (array of any shape) to statistics."""
+        data = numpy.asarray(data)
+        if data.dtype.kind not in 'biuf':
+            raise Exception("Cannot compute statistics of %s data"
+                            % data.dtype)
+        data = data.ravel()
+        if data.dtype.kind == 'f':
+            data = data[numpy.isfinite(data)]
+        if data.size == 0:
+            return
+        cmin = data.min().item()
+        cmax = data.max().item()
+        bins = len(self._counts)
+        if self._lo is None:
+            self._lo = float(cmin)
+            self._width = (cmax - cmin) / bins
+            if self._width == 0:
+                self._width = max(abs(cmin), 1.) / bins
+            if data.dtype.kind in 'biu':
+                # (integers: at least 1 value per bin)
+                self._width = max(self._width, 1.)
+            self._min, self._max = cmin, cmax
+        else:
+            self._grow(cmin, cmax)
+            self._min = min(self._min, cmin)
+            self._max = max(self._max, cmax)
+        for start in range(0, data.size, BLOCKSIZE):
+            block = data[start:start+BLOCKSIZE]
+            idx = ((block - self._lo) * (1. / self._width)).astype(numpy.intp)
+            numpy.clip(idx, 0, bins - 1, out=idx)
+            self._counts += numpy.bincount(idx, minlength=bins)
+
+    @property
+    def min(self):
+        """Returns min. pixel value."""
+        return self._min
+
+    @property
+    def max(self):
+        """Returns max. pixel value."""
+        return self._max
+
+    @property
+    def count(self):
+        """Returns number of (finite) pixel values."""
+        return int(self._counts.sum())
+
+    @property
+    def histogram(self):
+        """Returns histogram as (counts, bin edges)."""
+        if self._lo is None:
+            return self._counts.copy(), None
+        edges = self._lo + self._width*numpy.arange(len(self._counts) + 1)
+        return self._counts.copy(), edges
+
+    def cuts(self, cutoff=.1):
+        """Returns display range (low, high), ignoring the 'cutoff'% lowest/
+        highest value pixels (same format as DM3.contrastlimits)."""
+        counts, edges = self.histogram
+        if edges is None:
+            raise Exception("Cannot compute cuts w/o data")
+        return histogram_cuts(counts, edges, cutoff)
+
+
+def image_stats(data, bins=DEFAULTBINS, max_bytes=DEFAULTCHUNKBYTES,
+                prefetch=False):
+    """Returns ImageStats of 'data' (DM3, DM3Image, LazyArray or numpy
+    array), read and processed in one pass, chunk by chunk along axis 0
+    (chunks of at most 'max_bytes' bytes; see LazyArray.iter_chunks)."""
+    stats = ImageStats(bins)
+    if hasattr(data, 'lazydata'):
+        # (DM3 or DM3Image)
+        data = data.lazydata
+    if isinstance(data, LazyArray):
+        chunks = data.iter_chunks(max_bytes=max_bytes, prefetch=prefetch)
+        for start, chunk in chunks:
+            stats.add(chunk)
+    else:
+        data = numpy.asarray(data)
+        if data.ndim == 0:
+            data = data.reshape(1)
+        n = max(max_bytes // max(data[:1].nbytes, 1), 1)
+        for start in range(0, len(data), n):
+            stats.add(data[start:start+n])
+    return stats
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+"""Persistent cache of parsed DM3/DM4 tag directories"""
+
+from __future__ import print_function
+
+import os
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ["TagCache"]
+
+# cache entry format version (entries w/ other format are ignored)
+CACHE_FORMAT = 3
+
+DEFAULTMAXSIZE = 256 * 1024**2    # bytes
+
+
+def _fileKey(filename):
+    """Returns file identity: (absolute path, size, modification time)"""
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    return (path, st.st_size, mtime)
+
+
+class TagCache(object):
+    """On-disk cache of parsed tag directories.
+
+    Entries are stored as pickle files in directory 'cache_dir', keyed by
+    file path; they are invalidated as soon as file size or modification
+    time change. Least recently used entries are evicted when total size
+    of the cache exceeds 'max_size' bytes."""
+
+    def __init__(self, cache_dir, max_size=DEFAULTMAXSIZE):
+        self._dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self._max_size = max_size
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+
+    @property
+    def cache_dir(self):
+        """Returns cache directory."""
+        return self._dir
+
+    @property
+    def max_size(self):
+        """Returns maximal size of cache (bytes)."""
+        return self._max_size
+
+    def _entryPath(self, path):
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self._dir, digest + '.tags')
+
+    def get(self, filename):
+        """Returns cached data for file filename (None if not cached or
+        if cache entry is out of date)."""
+        try:
+            key = _fileKey(filename)
+        except EnvironmentError:
+            return None
+        entry_path = self._entryPath(key[0])
+        try:
+            with open(entry_path, 'rb') as f:
+                fmt, entry_key, data = pickle.load(f)
+        except (EnvironmentError, EOFError, ValueError,
+                pickle.UnpicklingError):
+            return None
+        if (fmt != CACHE_FORMAT) or (tuple(entry_key) != key):
+            # - out of date: drop entry
+            self._remove(entry_path)
+            return None
+        # - mark entry as recently used
+        try:
+            os.utime(entry_path, None)
+        except EnvironmentError:
+            pass
+        return data
+
+    def put(self, filename, data):
+        """Stores data in cache for file filename."""
+        key = _fileKey(filename)
+        entry_path = self._entryPath(key[0])
+        # - write to temporary file first, then move to entry file
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((CACHE_FORMAT, key, data), f,
+                            pickle.HIGHEST_PROTOCOL)
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, entry_path)
+            else:
+                self._remove(entry_path)
+                os.rename(tmp_path, entry_path)
+        except:
+            self._remove(tmp_path)
+            raise
+        self._evict()
+
+    def clear(self):
+        """Removes all cache entries."""
+        for name in os.listdir(self._dir):
+            if name.endswith('.tags'):
+                self._remove(os.path.join(self._dir, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except EnvironmentError:
+            pass
+
+    def _evict(self):
+        # remove least recently used entries until cache fits in max_size
+        entries = []
+        total = 0
+        for name in os.listdir(self._dir):
+            if not name.endswith('.tags'):
+                continue
+            path = os.path.join(self._dir, name)
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self._max_size:
+                break
+            self._remove(path)
+            total -= size
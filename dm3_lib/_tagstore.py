@@ -0,0 +1,317 @@
+#!/usr/bin/python
+"""Typed tag store for parsed DM3/DM4 tag directories"""
+
+from __future__ import print_function
+
+import sys
+import fnmatch
+import threading
+
+try:
+    from collections.abc import Mapping, ItemsView, ValuesView
+except ImportError:
+    from collections import Mapping, ItemsView, ValuesView
+
+__all__ = ["TagGroup", "TagArray", "TagStore"]
+
+if sys.version_info[0] == 3:
+    unicode_str = str
+else:
+    unicode_str = unicode
+
+
+class TagGroup(dict):
+    """Tag group: dict of tag values (native Python types) and tag
+    sub-groups, by tag label.
+
+    'name' is the full (dotted) name of the group; 'offset' is the position
+    of the group in the file if it has not been read yet, None otherwise
+    ('size': size of group in file, if known)."""
+
+    __slots__ = ('name', 'offset', 'size')
+
+    def __init__(self, name, offset=None, size=None):
+        dict.__init__(self)
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.offset, self.size),
+                None, None, iter(dict.items(self)))
+
+
+class TagArray(TagGroup):
+    """Array tag: holds data 'Size' (bytes) and 'Offset' in file as tags.
+
+    'itemTypes' lists the encoded data types of array items (of the fields
+    of array items if 'isStruct')."""
+
+    __slots__ = ('itemTypes', 'isStruct')
+
+    def __init__(self, name, itemTypes=(), isStruct=False):
+        TagGroup.__init__(self, name)
+        self.itemTypes = tuple(itemTypes)
+        self.isStruct = isStruct
+
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.itemTypes, self.isStruct),
+                None, None, iter(dict.items(self)))
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._iterItems()
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        for name, value in self._mapping._iterItems():
+            yield value
+
+
+class TagStore(Mapping):
+    """Read-only mapping of tag values (native Python types) by full tag
+    name (e.g., 'root.ImageList.1.ImageData.DataType'), backed by the tree
+    of tag groups starting at 'root'.
+
+    Groups not read yet (see TagGroup.offset) are read on demand by the
+    'loadGroup' callable."""
+
+    def __init__(self, root, loadGroup=None):
+        self._root = root
+        self._loadGroup = loadGroup
+        self._lock = threading.RLock()
+
+    @property
+    def root(self):
+        """Returns root tag group."""
+        return self._root
+
+    def _load(self, group):
+        # read group if not read yet
+        if group.offset is not None:
+            with self._lock:
+                if group.offset is not None:
+                    self._loadGroup(group)
+        return group
+
+    def loadAll(self, group=None):
+        """Reads all groups not read yet (below 'group', root by default)."""
+        stack = [self._root if group is None else group]
+        while stack:
+            group = self._load(stack.pop())
+            for value in dict.values(group):
+                if isinstance(value, TagGroup):
+                    stack.append(value)
+
+    def _resolve(self, name):
+        # returns (group, label) of tag or group 'name'
+        rootName = self._root.name
+        if not name.startswith(rootName + '.'):
+            raise KeyError(name)
+        return self._find(self._root, name[len(rootName)+1:], name)
+
+    def _find(self, group, rest, name):
+        # returns (group, label) of tag or group 'rest' below group
+        while True:
+            self._load(group)
+            if rest in group:
+                return group, rest
+            # go down one level (NB: tag labels may contain dots)
+            i = rest.find('.')
+            while ( i >= 0 ):
+                child = group.get(rest[:i])
+                if isinstance(child, TagGroup):
+                    group = child
+                    rest = rest[i+1:]
+                    break
+                i = rest.find('.', i+1)
+            else:
+                raise KeyError(name)
+
+    def group(self, name):
+        """Returns tag group 'name' (read if not read yet)."""
+        if name == self._root.name:
+            return self._load(self._root)
+        group, label = self._resolve(name)
+        value = group[label]
+        if not isinstance(value, TagGroup):
+            raise KeyError(name)
+        return self._load(value)
+
+    def __getitem__(self, name):
+        group, label = self._resolve(name)
+        value = group[label]
+        if isinstance(value, TagGroup):
+            # not a tag
+            raise KeyError(name)
+        return value
+
+    def lookup(self, group, relName):
+        """Returns value of tag 'relName' relative to tag group 'group'
+        (e.g., 'Microscope Info.Voltage' in ImageTags group)."""
+        group, label = self._find(self._load(group), relName, relName)
+        value = group[label]
+        if isinstance(value, TagGroup):
+            raise KeyError(relName)
+        return value
+
+    def subtree(self, name):
+        """Returns dict of all tags below tag group 'name' (values by full
+        tag name, in file order)."""
+        return dict(self._iterItems(self.group(name)))
+
+    def query(self, pattern):
+        """Returns dict of tags matching glob 'pattern' (values by full tag
+        name): pattern is a dotted tag name where '*', '?' and '[...]'
+        match within one tag label and '**' matches any number of groups
+        (e.g. 'root.ImageList.*.ImageData.Calibrations.*'). All tags below
+        matching groups are returned.
+
+        Only groups leading to matches are visited (tag labels w/o
+        wildcards are looked up directly)."""
+        segments = pattern.split('.')
+        result = {}
+        if fnmatch.fnmatchcase(self._root.name, segments[0]):
+            self._match(self._root, segments[1:], result)
+        return result
+
+    def _match(self, group, segments, result):
+        # adds tags below group matching pattern segments to result
+        if not segments:
+            result.update(self._iterItems(group))
+            return
+        group = self._load(group)
+        if segments[0] == '**':
+            # (zero or more groups)
+            self._match(group, segments[1:], result)
+            for value in dict.values(group):
+                if isinstance(value, TagGroup):
+                    self._match(value, segments, result)
+            return
+        # - literal segments: direct lookup of labels (w/ dots or not)
+        n = 0
+        while ( n < len(segments) ) and not _isGlob(segments[n]):
+            n += 1
+        if n:
+            candidates = []
+            for i in range(1, n+1):
+                label = '.'.join(segments[:i])
+                if label in group:
+                    candidates.append((label, i))
+        else:
+            candidates = []
+            for label in group:
+                i = label.count('.') + 1
+                if ( i <= len(segments) ) and fnmatch.fnmatchcase(
+                        label, '.'.join(segments[:i])):
+                    candidates.append((label, i))
+        for label, i in candidates:
+            value = dict.__getitem__(group, label)
+            if isinstance(value, TagGroup):
+                self._match(value, segments[i:], result)
+            elif i == len(segments):
+                result[group.name + '.' + label] = value
+
+    def toDict(self, name=None):
+        """Returns tag group 'name' (root by default) as nested dicts of
+        tag values by tag label (array tags as dicts of data 'Size' and
+        'Offset')."""
+        if name is None:
+            group = self._load(self._root)
+        else:
+            group = self.group(name)
+        return self._toDict(group)
+
+    def _toDict(self, group):
+        out = {}
+        for label, value in dict.items(self._load(group)):
+            if isinstance(value, TagGroup):
+                value = self._toDict(value)
+            out[label] = value
+        return out
+
+    def _iterItems(self, group=None):
+        # depth-first iteration over (tag name, tag value), in file order
+        stack = [iter(dict.items(self._load(
+            self._root if group is None else group)))]
+        names = [self._root.name if group is None else group.name]
+        while stack:
+            for label, value in stack[-1]:
+                if isinstance(value, TagGroup):
+                    stack.append(iter(dict.items(self._load(value))))
+                    names.append(value.name)
+                    break
+                yield names[-1] + '.' + label, value
+            else:
+                stack.pop()
+                names.pop()
+
+    def __iter__(self):
+        for name, value in self._iterItems():
+            yield name
+
+    def __len__(self):
+        n = 0
+        for item in self._iterItems():
+            n += 1
+        return n
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def dump(self):
+        """Yields tag dump lines ('name = value')."""
+        for name, value in self._iterItems():
+            yield name + " = " + unicode_str(value)
+
+
+def _isGlob(segment):
+    # True if pattern segment has wildcards
+    return ( '*' in segment ) or ( '?' in segment ) or ( '[' in segment )
+
+
+class TagStringView(Mapping):
+    """Read-only mapping of tag values converted to unicode strings, by
+    full tag name (backwards compatible DM3.tags)."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, name):
+        return unicode_str(self._store[name])
+
+    def __contains__(self, name):
+        return name in self._store
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+    def _iterItems(self):
+        for name, value in self._store._iterItems():
+            yield name, unicode_str(value)
+
+    def subtree(self, name):
+        """Returns dict of all tags below tag group 'name' (see
+        TagStore.subtree)."""
+        return dict( (tag, unicode_str(value))
+                     for tag, value in self._store.subtree(name).items() )
+
+    def query(self, pattern):
+        """Returns dict of tags matching glob 'pattern' (see
+        TagStore.query)."""
+        return dict( (tag, unicode_str(value))
+                     for tag, value in self._store.query(pattern).items() )
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
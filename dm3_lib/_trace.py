@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""Tracing of DM3/DM4 file reading: time spent per phase and read counters,
+reported to callbacks and to the 'dm3_lib' logger"""
+
+from __future__ import print_function
+
+import time
+import logging
+import threading
+
+__all__ = ["FileTrace", "add_trace_hook", "remove_trace_hook", "logger"]
+
+# traced phases: header parse, tag tree parse, data read
+PHASES = ('header', 'tags', 'data')
+
+logger = logging.getLogger('dm3_lib')
+
+# timer of traced phases
+clock = getattr(time, 'perf_counter', time.time)
+
+# registered callbacks: func(trace, phase, seconds)
+_hooks = []
+
+
+class FileTrace(object):
+    """Reading statistics of a file: time spent (s) in each phase (header
+    parse, tag tree parse, data read), number of tags parsed, number of
+    data read calls and bytes read.
+
+    Statistics are only gathered while tracing is enabled, i.e. while
+    trace hooks are registered (see add_trace_hook) or debug messages of
+    the 'dm3_lib' logger are enabled."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.timings = dict( (phase, 0.) for phase in PHASES )
+        self.tags = 0
+        self.read_calls = 0
+        self.bytes_read = 0
+
+    def __repr__(self):
+        return "<FileTrace %s: %s>" % (self.filename, self.as_dict())
+
+    def as_dict(self):
+        """Returns statistics as dict (e.g., for aggregation)."""
+        return {
+            'filename': self.filename,
+            'timings': dict(self.timings),
+            'tags': self.tags,
+            'read_calls': self.read_calls,
+            'bytes_read': self.bytes_read,
+            }
+
+
+def add_trace_hook(func):
+    """Registers callback func(trace, phase, seconds), called after each
+    traced phase of any file (phase among 'header', 'tags' and 'data'; tag
+    groups read on demand and every data read are reported separately),
+    'trace' being the FileTrace of the file (see DM3.trace)."""
+    if func not in _hooks:
+        _hooks.append(func)
+
+
+def remove_trace_hook(func):
+    """Unregisters callback func (see add_trace_hook)."""
+    if func in _hooks:
+        _hooks.remove(func)
+
+
+def enabled():
+    """Returns True if tracing is enabled (hooks or logger debug level)."""
+    return bool(_hooks) or logger.isEnabledFor(logging.DEBUG)
+
+
+def emit(trace, phase, seconds, nbytes=0, ntags=0):
+    """Records phase of 'seconds' (reading 'nbytes' bytes, or parsing
+    'ntags' tags) in FileTrace trace, and reports it."""
+    with trace._lock:
+        trace.timings[phase] += seconds
+        trace.tags += ntags
+        if phase == 'data':
+            trace.read_calls += 1
+            trace.bytes_read += nbytes
+    logger.debug("%s: %s %.6fs (%s bytes, %s tags)", trace.filename, phase,
+                 seconds, nbytes, ntags)
+    for func in list(_hooks):
+        func(trace, phase, seconds)
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+"""Streaming writer of DM3/DM4 files"""
+
+from __future__ import print_function, division
+
+import os
+import struct
+import numbers
+
+import numpy
+
+from ._dm3_lib import (SHORT, LONG, USHORT, ULONG, FLOAT, DOUBLE, BOOLEAN,
+                       OCTET, LONGLONG, STRUCT, ARRAY, nativeStruct, dT_str,
+                       dataTypes)
+from ._tagstore import TagArray
+
+__all__ = ["write_dm"]
+
+# max. size (bytes) of image data chunks written at once (array data)
+CHUNKBYTES = 16 * 1024**2
+
+# max. thumbnail size (px)
+THUMBNAILSIZE = 128
+
+# numpy dtype -> encoded type of array items
+_arrayTypes = {
+    '<i2': SHORT,
+    '<i4': LONG,
+    '<i8': LONGLONG,
+    '<u2': USHORT,
+    '<u4': ULONG,
+    '<f4': FLOAT,
+    '<f8': DOUBLE,
+    '|b1': BOOLEAN,
+    }
+
+# numpy dtype -> image DataType (first DataType of dT_str w/ that dtype)
+_dataTypes = {}
+for _dataType in sorted(dT_str):
+    _dataTypes.setdefault(numpy.dtype(dT_str[_dataType]), _dataType)
+_dataTypes[numpy.dtype(bool)] = 14    # binary
+
+
+class _Data(object):
+    """Image data streamed to file: 'nbytes' bytes from 'chunks' (arrays
+    of 'dtype', written in order)."""
+
+    def __init__(self, dtype, size, chunks):
+        self.dtype = dtype
+        self.size = size
+        self.nbytes = size * dtype.itemsize
+        self.chunks = chunks
+
+
+class _Deferred(object):
+    """Tag data known once image data are written (e.g. thumbnail): tag
+    type 'info' and 'nbytes' placeholder bytes, filled w/ value() at the
+    end of writing."""
+
+    def __init__(self, info, nbytes, value):
+        self.info = info
+        self.nbytes = nbytes
+        self.value = value
+        self.offset = None
+
+
+def _int(value, version):
+    # encoded integer (group sizes, counts, types)
+    return struct.pack('>q' if version == 4 else '>l', value)
+
+
+def _scalarType(value, version):
+    # returns encoded type of scalar tag value
+    if isinstance(value, (bool, numpy.bool_)):
+        return BOOLEAN
+    if isinstance(value, numbers.Integral):
+        if -2**31 <= value < 2**31:
+            return LONG
+        elif 0 <= value < 2**32:
+            return ULONG
+        elif version == 4:
+            return LONGLONG
+        raise Exception("Integer tag value %s too large for DM3" % value)
+    if isinstance(value, numbers.Real):
+        return DOUBLE
+    return None
+
+
+def _arrayType(dtype):
+    # returns (encoded type, item size) of array items of dtype
+    encodedType = _arrayTypes.get(dtype.str)
+    if encodedType is None:
+        if dtype.kind == 'c':
+            # (complex: pairs of floats)
+            return _arrayType(numpy.dtype('<f%s' % (dtype.itemsize // 2)))
+        # (other types: bytes)
+        return OCTET, 1
+    return encodedType, dtype.itemsize
+
+
+def _tagData(value, version):
+    """Returns (type info integers, data part) of tag value (None if value
+    cannot be written)."""
+    if isinstance(value, _Data):
+        encodedType, itemSize = _arrayType(value.dtype)
+        return [ARRAY, encodedType, value.nbytes // itemSize], value
+    if isinstance(value, _Deferred):
+        return value.info, value
+    encodedType = _scalarType(value, version)
+    if encodedType is not None:
+        return [encodedType], nativeStruct[encodedType].pack(value)
+    if isinstance(value, bytes):
+        return [ARRAY, OCTET, len(value)], value
+    if isinstance(value, (str, type(u''))):
+        # string: array of (UTF-16) unsigned shorts
+        data = value.encode('utf-16-le')
+        return [ARRAY, USHORT, len(data) // 2], data
+    if isinstance(value, numpy.ndarray):
+        value = numpy.ascontiguousarray(value,
+                                        dtype=value.dtype.newbyteorder('<'))
+        encodedType, itemSize = _arrayType(value.dtype)
+        return ([ARRAY, encodedType, value.nbytes // itemSize],
+                value.tobytes())
+    if isinstance(value, tuple):
+        # struct (of scalars)
+        info = [STRUCT, 0, len(value)]
+        data = []
+        for field in value:
+            encodedType = _scalarType(field, version)
+            if encodedType is None:
+                return None
+            info += [0, encodedType]
+            data.append(nativeStruct[encodedType].pack(field))
+        return info, b''.join(data)
+    return None
+
+
+def _isList(group):
+    # True if group tags are unlabelled (labels '0', '1'...)
+    return all( label == str(i) for i, label in enumerate(group) )
+
+
+def _groupParts(group, version):
+    """Returns encoded tag group as list of parts (bytes or _Data)."""
+    parts = [b'\x00\x01', _int(len(group), version)]
+    nTags = 0
+    unlabelled = _isList(group)
+    for label, value in group.items():
+        if isinstance(value, TagArray):
+            # (array read by DM3: data not available)
+            continue
+        if isinstance(value, dict):
+            entryType = 20
+            body = _groupParts(value, version)
+        else:
+            tagData = _tagData(value, version)
+            if tagData is None:
+                raise Exception("Cannot write tag '%s' (%s value)"
+                                % (label, type(value).__name__))
+            info, data = tagData
+            entryType = 21
+            body = [b''.join([b'%%%%', _int(len(info), version)]
+                             + [_int(i, version) for i in info]),
+                    data]
+        label = b'' if unlabelled else label.encode('latin-1')
+        entry = struct.pack('>bh', entryType, len(label)) + label
+        if version == 4:
+            entry += struct.pack('>q', _partsSize(body))
+        parts.append(entry)
+        parts.extend(body)
+        nTags += 1
+    parts[1] = _int(nTags, version)
+    return parts
+
+
+def _partsSize(parts):
+    return sum( part.nbytes if isinstance(part, (_Data, _Deferred))
+                else len(part) for part in parts )
+
+
+def _imageGroup(data, dataType, dims, pixelDepth, calibrations, tags, name):
+    # returns ImageList entry of image
+    dimensions = dict( (str(i), int(n)) for i, n in enumerate(dims) )
+    if calibrations is None:
+        calibrations = [(0., 1., '')] * len(dims)
+    dimCalibrations = dict(
+        (str(i), {'Origin': float(origin), 'Scale': float(scale),
+                  'Units': units})
+        for i, (origin, scale, units) in enumerate(calibrations) )
+    return {
+        'ImageData': {
+            'Calibrations': {
+                'Brightness': {'Origin': 0., 'Scale': 1., 'Units': ''},
+                'Dimension': dimCalibrations,
+                'DisplayCalibratedUnits': True,
+                },
+            'Data': data,
+            'DataType': dataType,
+            'Dimensions': dimensions,
+            'PixelDepth': pixelDepth,
+            },
+        'ImageTags': tags if tags is not None else {},
+        'Name': name,
+        'UniqueID': {'0': 0, '1': 0, '2': 0, '3': 0},
+        }
+
+
+def _gray(chunk, ndim):
+    # returns gray levels of data chunk of 'ndim'-dimensional image
+    chunk = numpy.asarray(chunk)
+    if chunk.dtype.names:
+        # (packed colour: R)
+        names = chunk.dtype.names
+        chunk = chunk['R' if 'R' in names else names[min(2, len(names)-1)]]
+    if chunk.ndim > ndim:
+        # (trailing channel axis)
+        chunk = chunk[..., 0]
+    if chunk.dtype.kind == 'c':
+        chunk = numpy.abs(chunk)
+    return chunk
+
+
+class _Thumbnail(object):
+    """Thumbnail and display range (min/max) of 1st 2D frame of image data
+    of 'shape' ('ndim' image dimensions, then channels), built from image
+    data chunks along axis 0 as they are written (add()): only the rows
+    and columns of the thumbnail (every 'step'-th) are kept."""
+
+    def __init__(self, shape, ndim):
+        if ndim == 1:
+            height, width = 1, shape[0]
+        else:
+            height, width = shape[ndim-2:ndim]
+        self._ndim = ndim
+        self._height = height
+        self._width = width
+        self.step = max(-(-max(height, width) // THUMBNAILSIZE), 1)
+        self.shape = (max(-(-height // self.step), 1),
+                      max(-(-width // self.step), 1))
+        # (rows, or values of 1D data, seen so far)
+        self._pos = 0
+        self._parts = []
+        self.min = None
+        self.max = None
+
+    def add(self, chunk):
+        if self._ndim == 1:
+            # (1D data: chunks are parts of the only row)
+            values = _gray(chunk, 1).reshape(-1)
+            total = self._width
+        else:
+            if (self._pos >= self._height) or not self._width:
+                return
+            values = _gray(chunk, self._ndim).reshape(-1, self._width)
+            total = self._height
+        values = values[:total - self._pos]
+        if not values.size:
+            return
+        if values.dtype.kind == 'f':
+            cmin, cmax = numpy.nanmin(values), numpy.nanmax(values)
+        else:
+            cmin, cmax = values.min(), values.max()
+        if self.min is None:
+            self.min, self.max = float(cmin), float(cmax)
+        else:
+            self.min = min(self.min, float(cmin))
+            self.max = max(self.max, float(cmax))
+        start = (-self._pos) % self.step
+        if self._ndim == 1:
+            self._parts.append(values[start::self.step])
+        else:
+            self._parts.append(values[start::self.step, ::self.step])
+        self._pos += len(values)
+
+    def data(self, cuts):
+        """Returns thumbnail data (32-bit integers, gray levels as R, G
+        and B) within display range 'cuts'."""
+        if not self._parts:
+            return numpy.zeros(self.shape, dtype='<u4')
+        tn = numpy.concatenate(self._parts).astype(numpy.float64)
+        tn = tn.reshape(-1, self.shape[1])
+        low, high = cuts
+        if high > low:
+            tn = (tn - low) * (255. / (high - low))
+        else:
+            tn = tn * 0
+        tn = numpy.rint(numpy.clip(numpy.nan_to_num(tn), 0, 255))
+        out = numpy.zeros(self.shape, dtype='<u4')
+        out[:len(tn)] = tn
+        return out * 0x10101
+
+
+def _chunks(array):
+    # yields array chunks along axis 0 of at most CHUNKBYTES bytes
+    n = max(CHUNKBYTES // max(array[:1].nbytes, 1), 1)
+    for start in range(0, len(array), n):
+        yield array[start:start+n]
+
+
+def _writeFile(f, version, treeSize, parts):
+    # writes header, tag tree parts (streaming image data) and end of file
+    f.write(struct.pack('>l', version))
+    if version == 4:
+        f.write(struct.pack('>q', treeSize))
+    else:
+        f.write(struct.pack('>l', treeSize + 4))
+    f.write(struct.pack('>l', 1))
+    deferred = []
+    for part in parts:
+        if isinstance(part, _Deferred):
+            part.offset = f.tell()
+            f.write(b'\0' * part.nbytes)
+            deferred.append(part)
+            continue
+        if not isinstance(part, _Data):
+            f.write(part)
+            continue
+        written = 0
+        for chunk in part.chunks:
+            chunk = numpy.ascontiguousarray(chunk, dtype=part.dtype)
+            f.write(chunk.reshape(-1).view(numpy.uint8))
+            written += chunk.nbytes
+        if written != part.nbytes:
+            raise Exception("Image data size (%s bytes) does not match "
+                            "shape and dtype (%s bytes)"
+                            % (written, part.nbytes))
+    f.write(b'\0' * 8)
+    # - fill in deferred tag data
+    for part in deferred:
+        f.seek(part.offset)
+        f.write(part.value())
+
+
+def write_dm(filename, data, tags=None, version=4, shape=None, dtype=None,
+             data_type=None, calibrations=None, cuts=None, name='',
+             document_tags=None):
+    """Writes DM3/DM4 ('version' 3 or 4) file filename holding image
+    'data' (image 1 of ImageList) and its thumbnail (image 0).
+
+    'data' is a numpy array (e.g., numpy.memmap), or an iterable of chunks
+    along axis 0 (e.g., frames of a stack) of data array of 'shape' and
+    'dtype'; data are streamed to file chunk by chunk. 'data_type' is image
+    DataType (guessed from dtype by default; for multi-channel DataTypes,
+    data array has a trailing channel axis).
+
+    'tags' are image tags (ImageTags group, as nested dicts of tag values:
+    int, float, bool, str, tuple (struct) or numpy array; groups w/ labels
+    '0', '1'... are written as lists), 'calibrations' are image dimension
+    calibrations ((origin, scale, units) per dimension, as
+    DM3Image.calibrations), 'cuts' is display range (low, high; min/max of
+    1st frame by default), 'document_tags' go to root.DocumentTags.
+    Thumbnail (of 1st frame) and default display range are computed while
+    data are written, and filled in at the end.
+    Arrays read by DM3 (TagArray, data not loaded) are not written."""
+    # - image data characteristics, chunks
+    if isinstance(data, numpy.ndarray):
+        shape = data.shape
+        if dtype is None:
+            dtype = data.dtype
+        chunks = _chunks(data)
+    else:
+        if (shape is None) or (dtype is None):
+            raise Exception("Cannot write data chunks w/o shape and dtype")
+        chunks = iter(data)
+    shape = tuple(int(n) for n in shape)
+    dtype = numpy.dtype(dtype)
+    if dtype.subdtype is not None:
+        dtype, channels = dtype.subdtype
+        shape += channels
+    if dtype.kind == 'b':
+        dtype = numpy.dtype('u1')
+        if data_type is None:
+            data_type = 14
+    dtype = dtype.newbyteorder('<') if dtype.byteorder == '>' else dtype
+    if data_type is None:
+        data_type = _dataTypes.get(dtype)
+        if data_type is None:
+            raise Exception("No DataType for %s data" % dtype)
+    # - image dimensions (w/o channel axis if multi-channel DataType)
+    channels = numpy.dtype(dT_str.get(data_type, dtype)).shape
+    imageShape = shape[:len(shape)-len(channels)]
+    if shape[len(imageShape):] != channels:
+        raise Exception("Data shape %s does not match DataType %s (%s)"
+                        % (shape, data_type, dataTypes.get(data_type)))
+    size = int(numpy.prod(shape))
+    # (bytes per pixel, all channels)
+    pixelDepth = dtype.itemsize * int(numpy.prod(channels))
+
+    # - thumbnail and default cuts (computed from chunks as written)
+    thumbnail = _Thumbnail(shape, len(imageShape))
+
+    def observedChunks():
+        for chunk in chunks:
+            thumbnail.add(chunk)
+            yield chunk
+
+    def finalCuts():
+        if cuts is not None:
+            return float(cuts[0]), float(cuts[1])
+        if thumbnail.min is None:
+            return 0., 0.
+        return thumbnail.min, thumbnail.max
+
+    # - tag tree
+    imageData = _Data(dtype, size, observedChunks())
+    tnSize = thumbnail.shape[0] * thumbnail.shape[1]
+    tnData = _Deferred([ARRAY, ULONG, tnSize], 4 * tnSize,
+                       lambda: thumbnail.data(finalCuts()).tobytes())
+    lowLimit = _Deferred([DOUBLE], 8, lambda: nativeStruct[DOUBLE].pack(
+        finalCuts()[0]))
+    highLimit = _Deferred([DOUBLE], 8, lambda: nativeStruct[DOUBLE].pack(
+        finalCuts()[1]))
+    dims = tuple(reversed(imageShape))
+    width = dims[0]
+    height = dims[1] if len(dims) > 1 else 1
+    root = {
+        'ApplicationBounds': {'0': 0, '1': 0, '2': height, '3': width},
+        'DocumentObjectList': {'0': {
+            'AnnotationType': 20,
+            'ImageDisplayInfo': {'LowLimit': lowLimit,
+                                 'HighLimit': highLimit},
+            'ImageSource': 0,
+            }},
+        'DocumentTags': document_tags if document_tags is not None else {},
+        'ImageList': {
+            '0': _imageGroup(tnData, 23, thumbnail.shape[::-1], 4, None,
+                             None, ''),
+            '1': _imageGroup(imageData, data_type, dims, pixelDepth,
+                             calibrations, tags, name),
+            },
+        'ImageSourceList': {'0': {
+            'ClassName': 'ImageSource:Simple',
+            'Id': {'0': 0},
+            'ImageRef': 1,
+            }},
+        'InImageMode': True,
+        'Thumbnails': {'0': {
+            'ImageIndex': 0,
+            'SourceSize_Pixels': {'0': width, '1': height},
+            }},
+        }
+    parts = _groupParts(root, version)
+    treeSize = _partsSize(parts)
+    if (version == 3) and (treeSize + 4 >= 2**31):
+        raise Exception("Data too large for DM3 file (use version 4)")
+
+    # - write header, tag tree and image data (chunk by chunk)
+    try:
+        with open(filename, 'wb') as f:
+            _writeFile(f, version, treeSize, parts)
+    except Exception:
+        # (no partial file)
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
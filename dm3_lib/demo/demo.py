@@ -8,8 +8,6 @@ import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 
-from PIL import Image
-
 import dm3_lib as dm3
 
 from utilities import calcHistogram, calcDisplayRange
@@ -84,39 +82,8 @@ if args.verbose:
     plt.ylabel('Number')
 
 # convert image to various formats
+# (TIFF w/ full dynamic range, PNG and JPG w/ cuts applied)
 if args.convert:
-    # save image as TIFF
-    tif_file = os.path.join(savedir,fileref+'.tif')
-    im = Image.fromarray(aa)
-    im.save(tif_file)
-    # check TIFF dynamic range
-    tim = Image.open(tif_file)
-    if tim.mode == 'L':
-        tif_range = "8-bit"
-    else:
-        tif_range = "32-bit"
-    print("Image saved as %s TIFF."%tif_range)
-
-    # save image as PNG and JPG files
-    # - normalize image for conversion to 8-bit
-    aa_norm = aa.copy()
-    # -- apply cuts (optional)
-    if cuts[0] != cuts[1]:
-        aa_norm[ (aa <= min(cuts)) ] = float(min(cuts))
-        aa_norm[ (aa >= max(cuts)) ] = float(max(cuts))
-    # -- normalize
-    aa_norm = (aa_norm - np.min(aa_norm)) / (np.max(aa_norm) - np.min(aa_norm))
-    # -- scale to 0--255, convert to (8-bit) integer
-    aa_norm = np.uint8(np.round( aa_norm * 255 ))
-
-    if args.verbose:
-        # - display normalized image
-        plt.matshow(aa_norm, cmap=plt.cm.Greys_r)
-        plt.title("%s [8-bit display]"%filename)
-        plt.colorbar(shrink=.8)
-
-    # - save as PNG and JPG
-    im_dsp = Image.fromarray(aa_norm)
-    im_dsp.save(os.path.join(savedir,fileref+'.png'))
-    im_dsp.save(os.path.join(savedir,fileref+'.jpg'))
+    dm3.convert_file(filepath, savedir, force=True)
+    print("Image saved as TIFF, PNG and JPG in %s." % savedir)
 
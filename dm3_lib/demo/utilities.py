@@ -2,6 +2,8 @@
 
 import numpy as np
 
+from dm3_lib import histogram_cuts
+
 # histogram, re-compute cuts
 
 def calcHistogram(imdata, bins_=256):
@@ -15,21 +17,5 @@ def calcDisplayRange(imdata, cutoff=.1, bins_=512):
     (ignore the 'cutoff'% lowest/highest value pixels)'''
     # compute image histogram
     hh, bins_ = calcHistogram(imdata, bins_)
-    # check histogram format
-    if len(bins_)==len(hh):
-        bb = bins_
-    else:
-        bb = bins_[:-1]    # 'bins' == bin_edges
-       # number of pixels
-    Npx = np.sum(hh)
-    # calc. lower limit : 
-    i = 1
-    while np.sum( hh[:i] ) < Npx*cutoff/100.:
-        i += 1
-    cut0 = round( bb[i] )
-    # calc. higher limit
-    j = 1
-    while np.sum( hh[-j:] ) < Npx*cutoff/100.:
-        j += 1
-    cut1 = round( bb[-j] )
-    return cut0,cut1
+    # find cuts from cumulated histogram
+    return histogram_cuts(hh, bins_, cutoff)
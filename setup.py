@@ -6,6 +6,10 @@ setup(
 
     install_requires = ['pillow>=2.3.1', 'numpy'],
 
+    entry_points = {
+        'console_scripts': ['dm3convert = dm3_lib._convert:main'],
+    },
+
     package_data = {
         # If any package contains *.txt or *.rst files, include them:
         '': ['*.txt', '*.rst'],
@@ -0,0 +1,58 @@
+"""Tests of asyncio counterparts of DM3 opening and reading"""
+
+import asyncio
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib import _aio
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / ("image%s.dm4" % i))
+        dm3.write_dm(path, numpy.full((4, 5), i, dtype='<u2'))
+        paths.append(path)
+    yield paths
+    dm3.set_max_open(_aio.DEFAULTMAXOPEN)
+
+
+def test_aread_image(files):
+    async def main():
+        async with await dm3.DM3.aopen(files[1]) as dm3f:
+            data = await dm3f.aread_image()
+        assert dm3f.closed
+        return data
+
+    data = asyncio.run(main())
+    assert data.shape == (4, 5)
+    assert (data == 1).all()
+
+
+def test_max_open(files):
+    # files opened by aopen and not closed yet are capped
+    dm3.set_max_open(2)
+
+    async def main():
+        first = await dm3.DM3.aopen(files[0])
+        second = await dm3.DM3.aopen(files[1])
+        third = asyncio.ensure_future(dm3.DM3.aopen(files[2]))
+        await asyncio.sleep(0.2)
+        assert not third.done()
+        # (reading opened files does not take more slots)
+        assert (await second.aread_image() == 1).all()
+        first.close()
+        dm3f = await asyncio.wait_for(third, 5)
+        assert (await dm3f.aread_image() == 2).all()
+        second.close()
+        dm3f.close()
+        # (all slots released)
+        opened = [await asyncio.wait_for(dm3.DM3.aopen(path), 5)
+                  for path in files[:2]]
+        for dm3f in opened:
+            dm3f.close()
+
+    asyncio.run(main())
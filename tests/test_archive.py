@@ -0,0 +1,115 @@
+"""Tests of DM3/DM4 members read from zip/tar archives"""
+
+import os
+import tarfile
+import zipfile
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+def _stored(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as zf:
+        for name, filename in files:
+            zf.write(filename, name)
+
+
+def _deflated(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, filename in files:
+            zf.write(filename, name)
+
+
+def _tar(path, files, mode='w'):
+    with tarfile.open(path, mode) as tf:
+        for name, filename in files:
+            tf.add(filename, name)
+
+
+def _tgz(path, files):
+    _tar(path, files, 'w:gz')
+
+
+CONTAINERS = [
+    ('stored.zip', _stored, True),
+    ('deflated.zip', _deflated, False),
+    ('archive.tar', _tar, True),
+    ('archive.tgz', _tgz, False),
+    ]
+
+
+@pytest.fixture
+def members(tmp_path):
+    # member name -> (file path, image data)
+    members = {}
+    for i, version in enumerate((3, 4)):
+        data = (numpy.arange(3 * 20 * 30) * (i + 1) % 1000).astype(
+            '<u2').reshape(3, 20, 30)
+        filename = str(tmp_path / ("image%s.dm%s" % (i, version)))
+        dm3.write_dm(filename, data, {'Index': i}, version=version)
+        members["session/image%s.dm%s" % (i, version)] = (filename, data)
+    notes = str(tmp_path / "notes.txt")
+    with open(notes, 'w') as f:
+        f.write("not a DM file")
+    members["session/notes.txt"] = (notes, None)
+    return members
+
+
+@pytest.mark.parametrize('name, write, stored', CONTAINERS)
+def test_archive(tmp_path, members, name, write, stored):
+    path = str(tmp_path / name)
+    write(path, [ (member, filename)
+                  for member, (filename, data) in sorted(members.items()) ])
+    with dm3.DMArchive(path) as archive:
+        assert archive.names() == ["session/image0.dm3",
+                                   "session/image1.dm4"]
+        assert "session/notes.txt" not in archive
+        for i, member in enumerate(archive):
+            filename, data = members[member]
+            assert archive.is_stored(member) == stored
+            with archive.open(member) as dm3f:
+                assert (dm3f.imagedata == data).all()
+                assert (dm3f.lazydata[1, 5:10] == data[1, 5:10]).all()
+                assert (dm3f.lazydata[::2, :, 3] == data[::2, :, 3]).all()
+                assert dm3f.typedtags[
+                    'root.ImageList.1.ImageTags.Index'] == i
+            assert (archive.thumbnail(member) == dm3.thumbnail(filename)).all()
+            info = archive.probe(member)
+            assert info['dimensions'] == (30, 20, 3)
+            assert info == dm3.probe(filename)
+
+
+def test_archive_closed(tmp_path, members):
+    path = str(tmp_path / "stored.zip")
+    _stored(path, [ (member, filename)
+                    for member, (filename, data) in members.items() ])
+    archive = dm3.DMArchive(path)
+    dm3f = archive.open("session/image1.dm4")
+    archive.close()
+    with pytest.raises(Exception):
+        dm3f.imagedata
+    dm3f.close()
+
+
+def test_archive_index_cache(tmp_path, members):
+    # member index cached, until archive changes
+    path = str(tmp_path / "archive.tar")
+    cachedir = str(tmp_path / "cache")
+    items = sorted( (member, filename)
+                    for member, (filename, data) in members.items() )
+    _tar(path, items[:1])
+    with dm3.DMArchive(path, cache=cachedir) as archive:
+        assert archive.names() == ["session/image0.dm3"]
+    _tar(path, items)
+    os.utime(path, (0, 0))
+    with dm3.DMArchive(path, cache=cachedir) as archive:
+        assert archive.names() == ["session/image0.dm3",
+                                   "session/image1.dm4"]
+
+
+def test_not_archive(tmp_path, members):
+    filename, data = members["session/image0.dm3"]
+    with pytest.raises(Exception):
+        dm3.DMArchive(filename)
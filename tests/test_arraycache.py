@@ -0,0 +1,64 @@
+"""Tests of process-wide LRU cache of image data arrays"""
+
+import os
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.fixture
+def cache():
+    dm3.array_cache.clear()
+    dm3.array_cache.max_bytes = 1024**2
+    yield dm3.array_cache
+    dm3.array_cache.max_bytes = 0
+    dm3.array_cache.clear()
+
+
+def test_shared(tmp_path, cache):
+    # same (read-only) array for all DM3 objects of file, until it changes
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.full((40, 50), 1, dtype='<u2'))
+    with dm3.DM3(path) as dm3f:
+        ima = dm3f.imagedata
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.imagedata is ima
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert not ima.flags.writeable
+    assert cache.nbytes == ima.nbytes
+    dm3.write_dm(path, numpy.full((40, 50), 2, dtype='<u2'))
+    os.utime(path, (0, 0))
+    with dm3.DM3(path) as dm3f:
+        assert (dm3f.imagedata == 2).all()
+    assert (cache.hits, cache.misses) == (1, 2)
+    # (not cached if disabled or w/ mmap)
+    with dm3.DM3(path, mmap=True) as dm3f:
+        assert isinstance(dm3f.imagedata, numpy.memmap)
+    cache.max_bytes = 0
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.imagedata.flags.writeable
+    assert len(cache) == 0
+
+
+def test_budget():
+    cache = dm3.ArrayCache(max_bytes=3000)
+    arrays = [ numpy.full(1000, i, dtype='u1') for i in range(4) ]
+    for i in range(3):
+        cache.put(i, arrays[i])
+    assert cache.get(0) is arrays[0]
+    # (least recently used evicted)
+    cache.put(3, arrays[3])
+    assert cache.get(1) is None
+    assert [ cache.get(i) is arrays[i] for i in (0, 2, 3) ] == [True] * 3
+    assert (len(cache), cache.nbytes) == (3, 3000)
+    # (too large for cache: not stored)
+    cache.put(4, numpy.zeros(3001, dtype='u1'))
+    assert cache.get(4) is None
+    cache.max_bytes = 1000
+    assert (len(cache), cache.nbytes) == (1, 1000)
+    assert cache.get(3) is arrays[3]
+    assert cache.enabled
+    cache.max_bytes = 0
+    assert not cache.enabled and len(cache) == 0
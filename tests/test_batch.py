@@ -0,0 +1,30 @@
+"""Tests of batch reading of DM3/DM4 files"""
+
+import numpy
+
+import dm3_lib as dm3
+
+
+def test_read_many(tmp_path, monkeypatch):
+    data = numpy.arange(12 * 10, dtype='<f4').reshape(12, 10)
+    paths = []
+    for version in (3, 4):
+        path = str(tmp_path / ("image.dm%s" % version))
+        dm3.write_dm(path, data, version=version)
+        paths.append(path)
+    paths.append(str(tmp_path / "missing.dm3"))
+    closed = []
+    close = dm3.DM3.close
+
+    def recordClose(self):
+        closed.append(self.filename)
+        close(self)
+
+    monkeypatch.setattr(dm3.DM3, 'close', recordClose)
+    rows = dm3.read_many(paths, workers=1)
+    assert [row['filename'] for row in rows] == paths
+    assert [row['file_version'] for row in rows[:2]] == [3, 4]
+    assert all( row['error'] is None for row in rows[:2] )
+    assert rows[2]['error'] is not None
+    # (files closed after reading)
+    assert sorted(set(closed)) == paths[:2]
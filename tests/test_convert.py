@@ -0,0 +1,65 @@
+"""Tests of DM3/DM4 file conversion to image files"""
+
+import os
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_convert_many(tmp_path):
+    gray = (numpy.arange(30 * 40) % 200).astype('<u2').reshape(30, 40)
+    rgb = numpy.zeros((30, 40, 3), dtype='<u2')
+    dm3.write_dm(str(tmp_path / "gray.dm4"), gray)
+    dm3.write_dm(str(tmp_path / "rgb.dm4"), rgb, data_type=17)
+    outdir = str(tmp_path / "out")
+    results = dict( (os.path.basename(path), (status, error))
+                    for path, status, error in dm3.convert_many(
+                        [str(tmp_path)], outdir, formats=['png'], cuts='none',
+                        workers=1) )
+    assert results['gray.dm4'] == ('converted', None)
+    im = Image.open(os.path.join(outdir, "gray.png"))
+    assert (im.size, im.mode) == ((40, 30), 'L')
+    assert (numpy.asarray(im) == numpy.rint(gray * (255. / 199))).all()
+    # (channel axis: per-file error, no garbage output)
+    status, error = results['rgb.dm4']
+    assert status == 'failed'
+    assert 'RGB_UINT16_DATA' in error
+    assert not os.path.exists(os.path.join(outdir, "rgb.png"))
+
+
+def test_convert_tree(tmp_path):
+    # files of input directories mirrored in output directory
+    data = numpy.arange(12, dtype='<u2').reshape(3, 4)
+    for subdir in ("s1", "s2"):
+        (tmp_path / "in" / subdir).mkdir(parents=True)
+        dm3.write_dm(str(tmp_path / "in" / subdir / "img.dm3"), data)
+    outdir = tmp_path / "out"
+    results = dm3.convert_many([str(tmp_path / "in")], str(outdir),
+                               formats=['tif'], workers=1)
+    assert [status for path, status, error in results] == ['converted'] * 2
+    assert (outdir / "s1" / "img.tif").exists()
+    assert (outdir / "s2" / "img.tif").exists()
+
+
+def test_convert_duplicates(tmp_path):
+    # files w/ same output files: error before converting any file
+    data = numpy.arange(12, dtype='<u2').reshape(3, 4)
+    for name in ("s1/img.dm3", "s2/img.dm3", "s3/img.dm3", "s3/img.dm4"):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        dm3.write_dm(str(path), data)
+    outdir = str(tmp_path / "out")
+    for inputs, kwargs in [
+            ([str(tmp_path / "s1/img.dm3"), str(tmp_path / "s2/img.dm3")],
+             {'outdir': outdir}),
+            ([str(tmp_path / "s*/img.dm3")], {'outdir': outdir}),
+            ([str(tmp_path / "s3")], {}),
+            ]:
+        with pytest.raises(Exception, match="same output file"):
+            dm3.convert_many(inputs, formats=['tif'], workers=1, **kwargs)
+    assert not os.path.exists(outdir)
+    assert not (tmp_path / "s3" / "img.tif").exists()
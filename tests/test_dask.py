@@ -0,0 +1,55 @@
+"""Tests of dask arrays over lazily read image data"""
+
+import sys
+import subprocess
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib import _lazyarray
+
+DATA = (numpy.arange(6 * 20 * 30) % 1000).astype('<u2').reshape(6, 20, 30)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "stack.dm4")
+    dm3.write_dm(path, DATA)
+    return path
+
+
+def test_no_import(path):
+    # dask only imported by to_dask
+    script = ("import sys, dm3_lib\n"
+              "with dm3_lib.DM3(sys.argv[1]) as f:\n"
+              "    f.lazydata[1]\n"
+              "    f.imagedata\n"
+              "print('dask' in sys.modules)\n")
+    out = subprocess.check_output([sys.executable, '-c', script, path])
+    assert out.decode().strip() == 'False'
+
+
+def test_missing_dask(path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'dask', None)
+    monkeypatch.setitem(sys.modules, 'dask.array', None)
+    with dm3.DM3(path) as dm3f:
+        with pytest.raises(ImportError):
+            dm3f.to_dask()
+
+
+def test_to_dask(path, monkeypatch):
+    pytest.importorskip('dask.array')
+    with dm3.DM3(path) as dm3f:
+        array = dm3f.to_dask()
+        assert (array.shape, array.dtype) == (DATA.shape, DATA.dtype)
+        assert array.chunks == ((6,), (20,), (30,))
+        assert (array.compute() == DATA).all()
+        assert (array[1:4, 5, ::2].compute() == DATA[1:4, 5, ::2]).all()
+        assert float(array.sum().compute()) == DATA.sum()
+        # (default chunks: whole frames, at most DASKCHUNKBYTES bytes)
+        monkeypatch.setattr(_lazyarray, 'DASKCHUNKBYTES', 2 * 20 * 30 * 2)
+        assert dm3f.to_dask().chunks == ((2, 2, 2), (20,), (30,))
+        array = dm3f.images[1].to_dask(chunks=(4, 10, 30))
+        assert array.chunks == ((4, 2), (10, 10), (30,))
+        assert (array.max(axis=0).compute() == DATA.max(axis=0)).all()
@@ -0,0 +1,41 @@
+"""Tests of image data decoding by DataType"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib._dm3_lib import dT_str
+
+
+# packed 8-bit colour: byte offsets of B, G, R (and A) in pixel (assumed)
+PACKED = {
+    8: (0, 1, 2, 3),
+    15: (0, 1, 2, None),
+    16: (1, 2, 3, None),
+    20: (0, 1, 2, 3),
+    21: (1, 2, 3, 0),
+    22: (2, 3, 0, 1),
+    23: (3, 0, 1, 2),
+    }
+
+
+@pytest.mark.parametrize('data_type', sorted(PACKED))
+def test_packed_colour(tmp_path, data_type):
+    raw = (numpy.arange(3 * 5 * 4) % 251).astype('u1').reshape(3, 5, 4)
+    path = str(tmp_path / "colour.dm4")
+    dm3.write_dm(path, raw.view(numpy.dtype(dT_str[data_type]))[..., 0],
+                 data_type=data_type)
+    with dm3.DM3(path) as dm3f:
+        ima = dm3f.imagedata
+        assert ima.shape == (3, 5)
+        for name, offset in zip('BGRA', PACKED[data_type]):
+            if offset is None:
+                assert name not in ima.dtype.names
+            else:
+                assert (ima[name] == raw[..., offset]).all()
+        # (thumbnail of R channel)
+        assert dm3f.thumbnaildata.max() == 255
+        assert ((dm3f.thumbnaildata > 0)
+                == (ima['R'] > ima['R'].min())).all()
+        rgb = numpy.asarray(dm3f.Image)
+        assert (rgb == raw[..., list(PACKED[data_type][2::-1])]).all()
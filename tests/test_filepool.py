@@ -0,0 +1,51 @@
+"""Tests of DM3 file lifecycle and shared pool of open files"""
+
+import os
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+def _openFiles():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(20):
+        path = str(tmp_path / ("image%s.dm%s" % (i, 3 + i % 2)))
+        dm3.write_dm(path, numpy.full((8, 8), i, dtype='<u2'),
+                     {'Group': {'Index': i}}, version=3 + i % 2)
+        paths.append(path)
+    return paths
+
+
+def test_close(files):
+    with dm3.DM3(files[0]) as dm3f:
+        assert not dm3f.closed
+    assert dm3f.closed
+    with pytest.raises(Exception):
+        dm3f.imagedata
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'),
+                    reason="needs /proc/self/fd")
+@pytest.mark.parametrize('lazy', [False, True])
+def test_pool(files, lazy):
+    # open files capped at max_open, also while reading lazy tag groups
+    pool = dm3.FilePool(max_open=4)
+    n0 = _openFiles()
+    dm3fs = [dm3.DM3(path, pool=pool, lazy=lazy) for path in files]
+    assert _openFiles() - n0 <= 4
+    for i, dm3f in enumerate(dm3fs):
+        assert dm3f.typedtags['root.ImageList.1.ImageTags.Group.Index'] == i
+        assert (dm3f.imagedata == i).all()
+        assert _openFiles() - n0 <= 4
+    assert pool.open_count == 4
+    for dm3f in dm3fs:
+        dm3f.close()
+    assert pool.open_count == 0
+    assert _openFiles() == n0
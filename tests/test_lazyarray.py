@@ -0,0 +1,80 @@
+"""Tests of LazyArray (partial reads of image data)"""
+
+import threading
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.fixture
+def stack(tmp_path):
+    data = numpy.arange(3 * 16 * 20, dtype='<u2').reshape(3, 16, 20)
+    path = str(tmp_path / "stack.dm3")
+    dm3.write_dm(path, data, version=3)
+    return path, data
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_iter_chunks(stack, prefetch):
+    path, data = stack
+    with dm3.DM3(path) as dm3f:
+        chunks = list(dm3f.iter_chunks(chunk_size=2, prefetch=prefetch))
+    assert [start for start, chunk in chunks] == [0, 2]
+    assert (numpy.concatenate([c for s, c in chunks]) == data).all()
+
+
+def test_iter_chunks_prefetch_break(stack):
+    # consumer stops while reader has queued the last chunk: no hang
+    path, data = stack
+    with dm3.DM3(path) as dm3f:
+        def consume():
+            for start, chunk in dm3f.iter_chunks(chunk_size=2, prefetch=True):
+                break
+        thread = threading.Thread(target=consume)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def _lazy(data):
+    # LazyArray over bytes of data, counting bytes read
+    buf = numpy.frombuffer(data.tobytes(), dtype='u1')
+    counts = []
+
+    def readInto(offset, out):
+        out = out.reshape(-1).view('u1')
+        out[...] = buf[offset:offset+out.size]
+        counts.append(out.size)
+        return out.size
+
+    return dm3.LazyArray(readInto, 0, data.dtype, data.shape), counts
+
+
+@pytest.mark.parametrize("key", [
+    Ellipsis, 1, -1, (slice(None), 2), (Ellipsis, 3), (0, slice(2, 9)),
+    slice(None, None, -1), (slice(None), slice(14, 1, -3)),
+    (slice(8, None, -2), slice(None, None, 5)), slice(5, 2),
+    ([2, 0, 2], slice(1, 3)), (slice(None), [15, 3], [0, 19]),
+    (numpy.arange(3) % 2 == 0, None, slice(None, None, 7)),
+    ])
+def test_indexing(key):
+    data = numpy.arange(3 * 16 * 20, dtype='<u2').reshape(3, 16, 20)
+    lazy, counts = _lazy(data)
+    assert (lazy[key] == data[key]).all()
+    assert lazy[key].shape == data[key].shape
+
+
+@pytest.mark.parametrize("key, nbytes", [
+    ((slice(None, None, 500), slice(None, None, 500)), 4 * 1501 * 2),
+    ([0, 1999], 2 * 2000 * 2),
+    ((slice(1999, None, -1000), 5), 2 * 2),
+    ])
+def test_sparse_reads(key, nbytes):
+    # only selected indices of leading axes are read
+    data = numpy.arange(2000 * 2000, dtype='<u2').reshape(2000, 2000)
+    lazy, counts = _lazy(data)
+    assert (lazy[key] == data[key]).all()
+    assert sum(counts) == nbytes
@@ -0,0 +1,48 @@
+"""Tests of lazy tag tree mode (tag groups read on demand)"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+TAGS = {
+    'Group': {'Sub': {'Value': 1}, 'Name': u'h\xe9llo'},
+    'Array': numpy.arange(50, dtype='<i2'),
+    'Struct': (1, 2.5),
+    }
+
+
+@pytest.fixture(params=[3, 4])
+def path(tmp_path, request):
+    path = str(tmp_path / ("tags.dm%s" % request.param))
+    dm3.write_dm(path, numpy.arange(20, dtype='<u2').reshape(4, 5), TAGS,
+                 version=request.param, document_tags={'Note': 'x'})
+    return path
+
+
+def test_lazy_tags(path):
+    # same tags as full parse
+    with dm3.DM3(path) as full:
+        tags = dict(full.tags.items())
+    with dm3.DM3(path, lazy=True) as lazy:
+        assert dict(lazy.tags.items()) == tags
+        assert (lazy.imagedata == numpy.arange(20).reshape(4, 5)).all()
+
+
+def test_on_demand(path):
+    with dm3.DM3(path, lazy=True) as dm3f:
+        root = dm3f.typedtags.root
+        image = dict.__getitem__(dict.__getitem__(root, 'ImageList'), '1')
+        imageTags = dict.__getitem__(image, 'ImageTags')
+        thumbnails = dict.__getitem__(root, 'Thumbnails')
+        # (only groups leading to image data read when opening file)
+        assert imageTags.offset is not None
+        assert thumbnails.offset is not None
+        assert dm3f.typedtags[
+            'root.ImageList.1.ImageTags.Group.Sub.Value'] == 1
+        assert imageTags.offset is None
+        assert thumbnails.offset is not None
+        assert dm3f.tags['root.DocumentTags.Note'] == 'x'
+    # (groups not read yet cannot be read once closed)
+    with pytest.raises(Exception, match="closed file"):
+        dm3f.typedtags['root.Thumbnails.0.ImageIndex']
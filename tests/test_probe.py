@@ -0,0 +1,56 @@
+"""Tests of header-only fast probe of DM3/DM4 files"""
+
+import io
+import os
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.mark.parametrize('version', [3, 4])
+def test_probe(tmp_path, version):
+    path = str(tmp_path / ("image.dm%s" % version))
+    dm3.write_dm(path, numpy.zeros((3, 4, 5), dtype='<f4'), {'Int': 1},
+                 version=version)
+    info = dm3.probe(path)
+    size = os.path.getsize(path)
+    with dm3.DM3(path) as dm3f:
+        image = dm3f.images[1]
+        assert info == {
+            'file_version': version,
+            'file_size': size,
+            'root_len': size - (16 if version == 3 else 24),
+            'size_ok': True,
+            'dimensions': (5, 4, 3),
+            'data_type': 2,
+            'data_type_str': 'REAL4_DATA',
+            'data_offset': image.data_offset,
+            'data_size': 3 * 4 * 5 * 4,
+            }
+        assert dm3.probe(path, 0)['dimensions'] == (
+            dm3f.images[0].dimensions)
+    # (stream and file content)
+    with open(path, 'rb') as f:
+        content = f.read()
+    assert dm3.probe(io.BytesIO(content)) == info
+    assert dm3.probe(content) == info
+
+
+def test_probe_size(tmp_path):
+    # inconsistent root tag dir. size reported, not raised
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'))
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 8)
+    assert dm3.probe(path)['size_ok'] is False
+
+
+def test_probe_errors(tmp_path):
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'))
+    with pytest.raises(Exception, match="No image #2"):
+        dm3.probe(path, 2)
+    with pytest.raises(Exception, match="does not appear"):
+        dm3.probe(b"not a DM file at all")
@@ -0,0 +1,45 @@
+"""Tests of DM3 image size and pixel size"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.mark.parametrize('shape, size', [
+    ((4, 5), (5, 4)),
+    ((1, 4, 5), (5, 4)),
+    ((3, 4, 5), (5, 4, 3)),
+    ((2, 3, 4, 5), (5, 4, 3, 2)),
+    ((1, 1, 4, 5), (5, 4)),
+    ])
+def test_size(tmp_path, shape, size):
+    # (width, height) unless more than one 2D image
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.zeros(shape, dtype='<u2'))
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.size == size
+        assert dm3f.depth == int(numpy.prod(shape[:-2]))
+
+
+def test_pxsize(tmp_path):
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'),
+                 calibrations=[(0., 0.5, u'\xb5m'), (0., 0.5, u'\xb5m')])
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.pxsize == (0.5, 'micron')
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'),
+                 calibrations=[(0., 2., 'nm'), (0., 2., 'nm')])
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.pxsize == (2., b'nm')
+
+
+def test_pxsize_missing(tmp_path):
+    # no calibration tags: KeyError, no made-up calibration
+    path = str(tmp_path / "image.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'))
+    with open(path, 'rb') as f:
+        content = f.read().replace(b'Scale', b'Scalx')
+    with dm3.DM3(content) as dm3f:
+        with pytest.raises(KeyError):
+            dm3f.pxsize
@@ -0,0 +1,120 @@
+"""Tests of DM3/DM4 files read from paths, buffers and streams"""
+
+import io
+import gzip
+import bz2
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.fixture(params=[3, 4])
+def sample(request, tmp_path):
+    data = (numpy.arange(40 * 50) % 251).astype('<f4').reshape(40, 50)
+    path = str(tmp_path / ("sample.dm%s" % request.param))
+    dm3.write_dm(path, data, {'Comment': 'sample'}, version=request.param)
+    with open(path, 'rb') as f:
+        content = f.read()
+    return path, content, data
+
+
+def _sources(path, content):
+    return [
+        content,
+        bytearray(content),
+        memoryview(content),
+        io.BytesIO(content),
+        open(path, 'rb'),
+        ]
+
+
+def test_sources(sample):
+    path, content, data = sample
+    with dm3.DM3(path) as ref:
+        tags = dict(ref.typedtags.items())
+        tn = ref.thumbnaildata
+    for source in _sources(path, content):
+        for kwargs in [{}, {'lazy': True}, {'mmap': True}]:
+            with dm3.DM3(source, **kwargs) as dm3f:
+                assert (dm3f.imagedata == data).all()
+                assert dict(dm3f.typedtags.items()) == tags
+                assert (dm3f.thumbnaildata == tn).all()
+        assert dm3.probe(source)['dimensions'] == (50, 40)
+        assert (dm3.thumbnail(source) == tn).all()
+        if hasattr(source, 'close'):
+            source.close()
+
+
+def test_sources_unchanged(sample):
+    # thumbnail decoding must not modify the caller's data
+    path, content, data = sample
+    buf = bytearray(content)
+    stream = io.BytesIO(content)
+    dm3.thumbnail(buf)
+    dm3.thumbnail(stream)
+    with dm3.DM3(buf) as dm3f:
+        dm3f.thumbnaildata
+    assert bytes(buf) == content
+    assert stream.getvalue() == content
+
+
+@pytest.mark.parametrize("module", [gzip, bz2])
+def test_compressed_stream(sample, tmp_path, module):
+    # compressed streams have a file descriptor, but must not be mapped
+    path, content, data = sample
+    compressed = str(tmp_path / "sample.dm.z")
+    with module.open(compressed, 'wb') as f:
+        f.write(content)
+    with module.open(compressed, 'rb') as f:
+        with dm3.DM3(f) as dm3f:
+            assert (dm3f.imagedata == data).all()
+        assert (dm3.thumbnail(f) == dm3.thumbnail(content)).all()
+
+
+class _ReadOnlyStream(object):
+    # minimal seekable binary stream (read/seek/tell only, short reads)
+
+    def __init__(self, content):
+        self._content = content
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self._content)
+        data = self._content[self._pos:self._pos+min(size, 1000)]
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._content)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+
+@pytest.mark.parametrize("dtype, data_type", [
+    ('<f4', 2), ([('B', 'u1'), ('G', 'u1'), ('R', 'u1'), ('A', 'u1')], 8),
+    (('<u2', (3,)), 17)])
+def test_minimal_stream(tmp_path, dtype, data_type):
+    # stream w/o readinto (nor fileno, getbuffer), returning short reads
+    dtype = numpy.dtype(dtype)
+    raw = (numpy.arange(20 * 30 * dtype.itemsize) % 251).astype('u1')
+    data = raw.view(dtype.base).reshape((20, 30) + dtype.shape)
+    path = str(tmp_path / "sample.dm4")
+    dm3.write_dm(path, data, data_type=data_type)
+    with open(path, 'rb') as f:
+        content = f.read()
+    stream = _ReadOnlyStream(content)
+    with dm3.DM3(stream) as dm3f:
+        assert (dm3f.imagedata == data).all()
+        assert (dm3f.lazydata[::3, 2:] == data[::3, 2:]).all()
+        assert (dm3f.thumbnaildata == dm3.thumbnail(content)).all()
+    assert dm3.probe(stream)['dimensions'] == (30, 20)
+    assert (dm3.thumbnail(stream) == dm3.thumbnail(content)).all()
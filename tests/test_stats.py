@@ -0,0 +1,83 @@
+"""Tests of chunked image statistics and display range"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+def test_stats():
+    rng = numpy.random.RandomState(0)
+    data = rng.normal(100., 20., size=(10, 64, 64)).astype('<f4')
+    data[3, 5, 5] = numpy.nan
+    stats = dm3.image_stats(data, bins=256, max_bytes=64 * 64 * 4)
+    finite = data[numpy.isfinite(data)]
+    assert (stats.min, stats.max) == (finite.min(), finite.max())
+    assert stats.count == finite.size
+    counts, edges = stats.histogram
+    assert counts.sum() == finite.size
+    assert (edges[0] <= finite.min()) and (edges[-1] >= finite.max())
+    width = edges[1] - edges[0]
+    # (cuts within one bin of percentiles)
+    low, high = stats.cuts(1.)
+    assert abs(low - numpy.percentile(finite, 1.)) <= width + 1
+    assert abs(high - numpy.percentile(finite, 99.)) <= width + 1
+
+
+def test_growing_range():
+    # histogram range extended as chunks come in: same counts
+    stats = dm3.ImageStats(bins=8)
+    stats.add(numpy.arange(8, dtype='<u2'))
+    stats.add(numpy.arange(8, 24, dtype='<u2'))
+    stats.add(-numpy.arange(1, 9, dtype='<i4'))
+    counts, edges = stats.histogram
+    assert (stats.min, stats.max, stats.count) == (-8, 23, 32)
+    assert counts.sum() == 32
+    assert numpy.histogram(numpy.arange(-8, 24), edges)[0].tolist() == (
+        counts.tolist())
+
+
+def _baselineCuts(counts, edges, cutoff):
+    # display range as computed by demo.utilities.calcDisplayRange
+    i = 1
+    while numpy.sum(counts[:i]) < counts.sum() * cutoff / 100.:
+        i += 1
+    j = 1
+    while numpy.sum(counts[-j:]) < counts.sum() * cutoff / 100.:
+        j += 1
+    return (int(round(edges[i])), int(round(edges[:-1][-j])))
+
+
+def test_histogram_cuts():
+    counts = numpy.array([10, 0, 980, 0, 10])
+    edges = numpy.arange(6) * 10.
+    assert dm3.histogram_cuts(counts, edges, cutoff=.5) == (10, 40)
+    counts, edges = numpy.histogram(
+        numpy.random.RandomState(1).exponential(50., 10000), 512)
+    for cutoff in (0., .1, 1., 5.):
+        assert dm3.histogram_cuts(counts, edges, cutoff) == (
+            _baselineCuts(counts, edges, cutoff))
+
+
+def test_errors():
+    stats = dm3.ImageStats()
+    with pytest.raises(Exception, match="w/o data"):
+        stats.cuts()
+    with pytest.raises(Exception, match="Cannot compute statistics"):
+        stats.add(numpy.zeros(3, dtype='c8'))
+
+
+@pytest.mark.parametrize('version', [3, 4])
+def test_file_stats(tmp_path, version):
+    # one pass over file data, chunk by chunk
+    path = str(tmp_path / ("stack.dm%s" % version))
+    data = (numpy.arange(5 * 30 * 40) % 1000).astype('<u2').reshape(5, 30, 40)
+    dm3.write_dm(path, data, version=version)
+    with dm3.DM3(path) as dm3f:
+        stats = dm3f.stats(max_bytes=30 * 40 * 2)
+        lazyStats = dm3.image_stats(dm3f.lazydata)
+    full = dm3.image_stats(data)
+    assert (stats.min, stats.max, stats.count) == (0, 999, data.size)
+    assert (stats.histogram[0] == full.histogram[0]).all()
+    assert (lazyStats.histogram[0] == full.histogram[0]).all()
+    assert stats.cuts() == full.cuts()
@@ -0,0 +1,59 @@
+"""Tests of array tags read as numpy arrays (DM3.tagArray)"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib._dm3_lib import LONG, FLOAT, STRUCT, ARRAY
+from dm3_lib._writer import _Deferred
+
+PREFIX = 'root.ImageList.1.ImageTags.'
+
+# array of structs (int32, float32)
+POINTS = numpy.array([(i, i / 4.) for i in range(10)],
+                     dtype=[('f0', '<i4'), ('f1', '<f4')])
+
+
+def _structArray(array):
+    # array of structs tag (written as is, w/ struct type info)
+    return _Deferred([ARRAY, STRUCT, 0, 2, 0, LONG, 0, FLOAT, len(array)],
+                     array.nbytes, array.tobytes)
+
+
+@pytest.fixture(params=[3, 4])
+def path(tmp_path, request):
+    path = str(tmp_path / ("arrays.dm%s" % request.param))
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'), {
+        'Floats': numpy.linspace(0, 1, 300).astype('<f8'),
+        'Shorts': numpy.arange(-100, 200, dtype='<i2'),
+        'Points': _structArray(POINTS),
+        'Int': 1,
+        }, version=request.param)
+    return path
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_tag_array(path, mmap):
+    with dm3.DM3(path, mmap=mmap) as dm3f:
+        floats = dm3f.tagArray(PREFIX + 'Floats')
+        assert floats.dtype == numpy.dtype('<f8')
+        assert (floats == numpy.linspace(0, 1, 300)).all()
+        assert (dm3f.tagArray(PREFIX + 'Shorts')
+                == numpy.arange(-100, 200)).all()
+        points = dm3f.tagArray(PREFIX + 'Points')
+        assert points.dtype == POINTS.dtype
+        assert (points == POINTS).all()
+        # (image data too)
+        data = dm3f.tagArray('root.ImageList.1.ImageData.Data')
+        assert data.dtype == numpy.dtype('<u2') and data.shape == (20,)
+        if mmap:
+            assert isinstance(floats, numpy.memmap)
+            assert not floats.flags.writeable
+
+
+def test_not_array(path):
+    with dm3.DM3(path) as dm3f:
+        # (scalar tag, missing tag, tag group)
+        for name in (PREFIX + 'Int', PREFIX + 'Missing', PREFIX[:-1]):
+            with pytest.raises(KeyError):
+                dm3f.tagArray(name)
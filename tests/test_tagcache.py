@@ -0,0 +1,63 @@
+"""Tests of persistent tag cache"""
+
+import os
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+def _write(path, value, mtime):
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'), {'Value': value})
+    os.utime(path, (mtime, mtime))
+
+
+def test_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "image.dm4")
+    cachedir = str(tmp_path / "cache")
+    _write(path, 1, 1000)
+    with dm3.DM3(path, cache=cachedir) as dm3f:
+        tags = dict(dm3f.tags.items())
+    cache = dm3.TagCache(cachedir)
+    assert cache.get(path) is not None
+    # - up to date entry: no parsing
+    parse = dm3.DM3._parse
+
+    def noParse(self, *args):
+        raise AssertionError("file parsed")
+
+    monkeypatch.setattr(dm3.DM3, '_parse', noParse)
+    with dm3.DM3(path, cache=cache, lazy=True) as dm3f:
+        assert dict(dm3f.tags.items()) == tags
+        assert (dm3f.imagedata == 0).all()
+    # - file changed: entry out of date, file parsed again
+    monkeypatch.setattr(dm3.DM3, '_parse', parse)
+    _write(path, 2, 2000)
+    with dm3.DM3(path, cache=cache) as dm3f:
+        assert dm3f.typedtags['root.ImageList.1.ImageTags.Value'] == 2
+    assert cache.get(path)['tags'] is not None
+
+
+def test_eviction(tmp_path):
+    # least recently used entries evicted beyond max_size
+    cache = dm3.TagCache(str(tmp_path / "cache"))
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / ("image%s.dm4" % i))
+        _write(path, i, 1000 + i)
+        paths.append(path)
+    cache.put(paths[0], {'tags': 0})
+    entrySize = os.path.getsize(os.path.join(cache.cache_dir,
+                                             os.listdir(cache.cache_dir)[0]))
+    cache = dm3.TagCache(cache.cache_dir, max_size=int(entrySize * 2.5))
+    cache.put(paths[1], {'tags': 1})
+    os.utime(cache._entryPath(paths[0]), (0, 0))
+    os.utime(cache._entryPath(paths[1]), (1, 1))
+    cache.put(paths[2], {'tags': 2})
+    assert cache.get(paths[0]) is None
+    assert cache.get(paths[1]) == {'tags': 1}
+    assert cache.get(paths[2]) == {'tags': 2}
+    cache.clear()
+    assert cache.get(paths[2]) is None
+    assert os.listdir(cache.cache_dir) == []
@@ -0,0 +1,95 @@
+"""Tests of tag tree queries: subtrees, glob patterns and nested dicts"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+PREFIX = 'root.ImageList.1.ImageTags.'
+
+TAGS = {
+    'Microscope Info': {'Voltage': 200000., 'Name': 'TEM'},
+    'Acquisition': {'Device': {'Name': 'CCD', 'Binning': 2},
+                    'Frame': {'Exposure': .5}},
+    'Dotted.Label': 1,
+    }
+
+
+@pytest.fixture(params=[False, True])
+def dm3f(tmp_path, request):
+    path = str(tmp_path / "tags.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'), TAGS)
+    with dm3.DM3(path, lazy=request.param) as dm3f:
+        yield dm3f
+
+
+def test_subtree(dm3f):
+    assert dm3f.typedtags.subtree(PREFIX + 'Acquisition') == {
+        PREFIX + 'Acquisition.Device.Name': 'CCD',
+        PREFIX + 'Acquisition.Device.Binning': 2,
+        PREFIX + 'Acquisition.Frame.Exposure': .5,
+        }
+    assert dm3f.tags.subtree(PREFIX + 'Acquisition.Device') == {
+        PREFIX + 'Acquisition.Device.Name': 'CCD',
+        PREFIX + 'Acquisition.Device.Binning': '2',
+        }
+    with pytest.raises(KeyError):
+        dm3f.typedtags.subtree(PREFIX + 'Missing')
+
+
+def test_query(dm3f):
+    typedtags = dm3f.typedtags
+    assert typedtags.query('root.ImageList.*.ImageTags.*.Name') == {
+        PREFIX + 'Microscope Info.Name': 'TEM',
+        }
+    assert typedtags.query('root.**.Name') == {
+        'root.ImageList.0.Name': '',
+        'root.ImageList.1.Name': '',
+        PREFIX + 'Microscope Info.Name': 'TEM',
+        PREFIX + 'Acquisition.Device.Name': 'CCD',
+        }
+    assert typedtags.query(PREFIX + 'Acq*.F?ame') == {
+        PREFIX + 'Acquisition.Frame.Exposure': .5,
+        }
+    assert typedtags.query(PREFIX + 'Dotted.Label') == {
+        PREFIX + 'Dotted.Label': 1,
+        }
+    assert typedtags.query(PREFIX + 'Missing.*') == {}
+    assert dm3f.tags.query(PREFIX + 'Microscope Info.Voltage') == {
+        PREFIX + 'Microscope Info.Voltage': '200000.0',
+        }
+    # (same tags as full scan)
+    pattern = 'root.*.[0-9].ImageData.D*'
+    assert typedtags.query(pattern) == dict(
+        (name, value) for name, value in typedtags.items()
+        if name.startswith(('root.ImageList.0.ImageData.D',
+                            'root.ImageList.1.ImageData.D')) )
+
+
+def test_query_lazy(tmp_path):
+    # only groups leading to matches are read
+    path = str(tmp_path / "tags.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'), TAGS)
+    with dm3.DM3(path, lazy=True) as dm3f:
+        dm3f.typedtags.query(PREFIX + 'Acquisition.Device.*')
+        group = dm3f.typedtags.root
+        for label in ('ImageList', '1', 'ImageTags'):
+            group = dict.__getitem__(group, label)
+        assert dict.__getitem__(group, 'Acquisition').offset is None
+        assert dict.__getitem__(group, 'Microscope Info').offset is not None
+        assert dict.__getitem__(dm3f.typedtags.root,
+                                'Thumbnails').offset is not None
+
+
+def test_to_dict(dm3f):
+    tree = dm3f.typedtags.toDict(PREFIX[:-1])
+    assert tree == {
+        'Microscope Info': {'Voltage': 200000., 'Name': 'TEM'},
+        'Acquisition': {'Device': {'Name': 'CCD', 'Binning': 2},
+                        'Frame': {'Exposure': .5}},
+        'Dotted.Label': 1,
+        }
+    root = dm3f.typedtags.toDict()
+    assert root['ImageList']['1']['ImageTags'] == tree
+    data = root['ImageList']['1']['ImageData']['Data']
+    assert data == {'Size': 40, 'Offset': dm3f.images[1].data_offset}
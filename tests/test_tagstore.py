@@ -0,0 +1,72 @@
+"""Tests of typed tag store and of its string view (DM3.tags)"""
+
+import pickle
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib._tagstore import TagStore
+
+PREFIX = 'root.ImageList.1.ImageTags.'
+
+TAGS = {
+    'Int': -3,
+    'Float': 1.5,
+    'Bool': False,
+    'String': u'h\xe9llo',
+    'Struct': (1, 2.5),
+    'Group': {'Value': 7},
+    }
+
+
+@pytest.fixture
+def dm3f(tmp_path):
+    path = str(tmp_path / "tags.dm4")
+    dm3.write_dm(path, numpy.zeros((4, 5), dtype='<u2'), TAGS)
+    with dm3.DM3(path) as dm3f:
+        yield dm3f
+
+
+def test_typed(dm3f):
+    typedtags = dm3f.typedtags
+    assert typedtags[PREFIX + 'Int'] == -3
+    assert typedtags[PREFIX + 'Float'] == 1.5
+    assert typedtags[PREFIX + 'Bool'] is False
+    assert typedtags[PREFIX + 'String'] == TAGS['String']
+    assert typedtags[PREFIX + 'Struct'] == (1, 2.5)
+    assert typedtags[PREFIX + 'Group.Value'] == 7
+    # (groups are not tags)
+    assert PREFIX + 'Group' not in typedtags
+    with pytest.raises(KeyError):
+        typedtags[PREFIX + 'Group']
+    group = typedtags.group(PREFIX + 'Group')
+    assert dict(group) == {'Value': 7}
+    assert typedtags.lookup(typedtags.group(PREFIX[:-1]), 'Group.Value') == 7
+    with pytest.raises(KeyError):
+        typedtags.group(PREFIX + 'Int')
+    # (tree can be pickled, e.g. for TagCache)
+    root = pickle.loads(pickle.dumps(typedtags.root))
+    assert dict(TagStore(root).items()) == dict(typedtags.items())
+
+
+def test_strings(dm3f):
+    # DM3.tags: same tags, values as unicode strings
+    assert list(dm3f.tags) == list(dm3f.typedtags)
+    assert len(dm3f.tags) == len(dm3f.typedtags)
+    assert dm3f.tags[PREFIX + 'Int'] == '-3'
+    assert dm3f.tags[PREFIX + 'Float'] == '1.5'
+    assert dm3f.tags[PREFIX + 'Bool'] == 'False'
+    assert dm3f.tags[PREFIX + 'String'] == TAGS['String']
+    assert dm3f.tags[PREFIX + 'Struct'] == '(1, 2.5)'
+    assert dict(dm3f.tags.items()) == dict(
+        (name, str(value)) for name, value in dm3f.typedtags.items())
+
+
+def test_dump(dm3f, tmp_path):
+    dm3f.dumpTags(str(tmp_path))
+    dump = str(tmp_path / "tags.dm4.tagdump.txt")
+    with open(dump) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(dm3f.tags)
+    assert any( (PREFIX + 'Int = -3') in line for line in lines )
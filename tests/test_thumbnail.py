@@ -0,0 +1,78 @@
+"""Tests of thumbnail fast path and contact sheets"""
+
+import io
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib._dm3_lib import _decodeThumbnail
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i, version in enumerate((3, 4)):
+        data = numpy.zeros((200, 300), dtype='<f4')
+        data[:, 150:] = 100 * (i + 1)
+        path = str(tmp_path / ("image%s.dm%s" % (i, version)))
+        dm3.write_dm(path, data, version=version)
+        paths.append(path)
+    return paths
+
+
+def test_decode():
+    # px_value/65536, clipped to 255
+    tndata = numpy.array([[0, 65535, 65536, 3 << 16], [255 << 16, 256 << 16,
+                          2**32 - 1, 7]], dtype='<u4')
+    expected = numpy.array([[0, 0, 1, 3], [255, 255, 255, 0]], dtype='u1')
+    assert (_decodeThumbnail(tndata) == expected).all()
+    assert tndata[0, 1] == 65535
+    assert (_decodeThumbnail(tndata.copy(), inplace=True) == expected).all()
+
+
+def test_thumbnail(files):
+    for path in files:
+        tn = dm3.thumbnail(path)
+        with dm3.DM3(path) as dm3f:
+            assert (tn == dm3f.thumbnaildata).all()
+        assert tn.dtype == numpy.uint8 and tn.shape == (67, 100)
+        assert (tn[:, :50] == 0).all() and (tn[:, 50:] == 255).all()
+        with open(path, 'rb') as f:
+            content = f.read()
+        assert (dm3.thumbnail(content) == tn).all()
+        assert (dm3.thumbnail(io.BytesIO(content)) == tn).all()
+
+
+def test_read_thumbnails(tmp_path, files):
+    bad = str(tmp_path / "bad.dm4")
+    with open(bad, 'wb') as f:
+        f.write(b"not a DM file at all")
+    results = dm3.read_thumbnails(files + [bad], workers=1)
+    assert [filename for filename, tndata, error in results] == (
+        files + [bad])
+    for (filename, tndata, error), path in zip(results, files):
+        assert error is None
+        assert (tndata == dm3.thumbnail(path)).all()
+    filename, tndata, error = results[2]
+    assert (tndata is None) and ('does not appear' in error)
+    # (all DM3/DM4 files of directory)
+    results = dm3.read_thumbnails(str(tmp_path), workers=1)
+    assert sorted(filename for filename, tndata, error in results) == (
+        sorted(files + [bad]))
+
+
+def test_contact_sheet(tmp_path, files):
+    pytest.importorskip('PIL.Image')
+    bad = str(tmp_path / "bad.dm4")
+    with open(bad, 'wb') as f:
+        f.write(b"not a DM file at all")
+    sheet = dm3.contact_sheet(files + [bad], columns=2, tile_size=(64, 64),
+                              workers=1, background=10)
+    assert (sheet.mode, sheet.size) == ('L', (128, 128))
+    sheet = numpy.asarray(sheet)
+    # (thumbnails fitted in tiles, centered; blank tile for bad file)
+    assert (sheet[:10, :64] == 10).all()
+    assert (sheet[20:40, 5:25] == 0).all()
+    assert (sheet[20:40, 40:60] == 255).all()
+    assert (sheet[64:, :] == 10).all()
@@ -0,0 +1,72 @@
+"""Tests of tracing hooks and per-file reading statistics"""
+
+import logging
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "stack.dm4")
+    dm3.write_dm(path, numpy.zeros((3, 20, 30), dtype='<u2'),
+                 {'Group': {'Value': 1}})
+    return path
+
+
+@pytest.fixture
+def calls():
+    calls = []
+
+    def hook(trace, phase, seconds):
+        calls.append((trace, phase, seconds))
+
+    dm3.add_trace_hook(hook)
+    yield calls
+    dm3.remove_trace_hook(hook)
+
+
+def test_hooks(path, calls):
+    with dm3.DM3(path, lazy=True) as dm3f:
+        trace = dm3f.trace
+        phases = [phase for t, phase, s in calls]
+        assert phases[:2] == ['header', 'tags']
+        assert set(phases[2:]) <= set(['tags'])
+        assert trace.tags > 0
+        # (tag groups read on demand reported separately)
+        ntags = trace.tags
+        dm3f.typedtags['root.ImageList.1.ImageTags.Group.Value']
+        assert calls[-1][1] == 'tags' and trace.tags > ntags
+        # (every data read reported)
+        dm3f.imagedata
+        dm3f.lazydata[1]
+    assert all( t is trace for t, phase, s in calls )
+    assert all( s >= 0 for t, phase, s in calls )
+    assert [phase for t, phase, s in calls][-2:] == ['data', 'data']
+    assert (trace.read_calls, trace.bytes_read) == (2, 4 * 20 * 30 * 2)
+    assert trace.as_dict()['timings']['data'] == sum(
+        s for t, phase, s in calls if phase == 'data')
+    assert trace.filename == path
+
+
+def test_remove_hook(path, calls):
+    hook = dm3._trace._hooks[0]
+    dm3.remove_trace_hook(hook)
+    with dm3.DM3(path) as dm3f:
+        dm3f.imagedata
+    assert calls == []
+    # (no statistics w/o hooks)
+    assert (dm3f.trace.tags, dm3f.trace.read_calls) == (0, 0)
+    dm3.add_trace_hook(hook)
+
+
+def test_logger(path, caplog):
+    # debug messages of 'dm3_lib' logger enable tracing
+    with caplog.at_level(logging.DEBUG, logger='dm3_lib'):
+        with dm3.DM3(path) as dm3f:
+            dm3f.imagedata
+    assert dm3f.trace.read_calls == 1
+    assert any( "data" in record.getMessage()
+                for record in caplog.records )
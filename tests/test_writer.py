@@ -0,0 +1,121 @@
+"""Round-trip tests of DM3/DM4 files written by write_dm"""
+
+import numpy
+import pytest
+
+import dm3_lib as dm3
+from dm3_lib._dm3_lib import dT_str
+
+
+TAGS = {
+    'Int': -3,
+    'Float': 1.5,
+    'Bool': True,
+    'String': u'h\xe9llo',
+    'Struct': (1, 2.5, 3),
+    'Array': numpy.arange(300, dtype='<i4'),
+    'Group': {'Value': 7, 'List': {'0': 'a', '1': 'b'}},
+    }
+
+CALIBRATIONS = [(1., 2., 'nm'), (0.5, 0.25, u'\xb5m')]
+
+# DataType: data of 2x3 image (w/ channel axis if multi-channel)
+DATATYPES = [1, 2, 3, 6, 7, 9, 10, 11, 12, 13, 14, 8, 17, 18, 24, 27, 33,
+             35, 36]
+
+
+def _sample(data_type, shape=(2, 3)):
+    dtype = numpy.dtype(dT_str[data_type])
+    size = int(numpy.prod(shape)) * dtype.itemsize
+    raw = (numpy.arange(size) * 7 % 97).astype('u1')
+    if data_type == 14:
+        raw = raw % 2
+    return raw.view(dtype.base).reshape(shape + dtype.shape)
+
+
+def _readBack(path):
+    with dm3.DM3(path) as dm3f:
+        image = dm3f.images[1]
+        tags = dict( (k[len('root.ImageList.1.ImageTags.'):], v)
+                     for k, v in dm3f.typedtags.items()
+                     if k.startswith('root.ImageList.1.ImageTags.') )
+        return (dm3f.imagedata, image.data_type, image.dimensions,
+                image.calibrations, tags,
+                dm3f.tagArray('root.ImageList.1.ImageTags.Array'))
+
+
+@pytest.mark.parametrize('version', [3, 4])
+def test_tags(tmp_path, version):
+    path = str(tmp_path / ("tags.dm%s" % version))
+    data = _sample(2)
+    dm3.write_dm(path, data, TAGS, version=version,
+                 calibrations=CALIBRATIONS)
+    imagedata, data_type, dims, calibrations, tags, array = _readBack(path)
+    assert (imagedata == data).all()
+    assert data_type == 2
+    assert dims == (3, 2)
+    assert calibrations == CALIBRATIONS
+    assert (array == TAGS['Array']).all()
+    assert tags['Int'] == -3
+    assert tags['Float'] == 1.5
+    assert tags['Bool'] is True
+    assert tags['String'] == TAGS['String']
+    assert tags['Struct'] == (1, 2.5, 3)
+    assert tags['Group.Value'] == 7
+    assert (tags['Group.List.0'], tags['Group.List.1']) == ('a', 'b')
+
+
+@pytest.mark.parametrize('version', [3, 4])
+@pytest.mark.parametrize('data_type', DATATYPES)
+def test_datatypes(tmp_path, version, data_type):
+    path = str(tmp_path / ("image.dm%s" % version))
+    data = _sample(data_type)
+    dm3.write_dm(path, data, version=version, data_type=data_type)
+    with dm3.DM3(path) as dm3f:
+        assert dm3f.images[1].data_type == data_type
+        assert dm3f.images[1].dimensions == (3, 2)
+        assert dm3f.typedtags['root.ImageList.1.ImageData.PixelDepth'] == (
+            numpy.dtype(dT_str[data_type]).itemsize)
+        assert dm3f.imagedata.dtype == data.dtype
+        assert (dm3f.imagedata.view('u1') == data.view('u1')).all()
+
+
+@pytest.mark.parametrize('version', [3, 4])
+def test_chunks(tmp_path, version):
+    # stack written frame by frame, thumbnail and cuts of whole 1st frame
+    path = str(tmp_path / ("stack.dm%s" % version))
+    data = numpy.zeros((3, 300, 200), dtype='<f4')
+    data[0, 150:] = 100
+    data[1:] = 500
+    dm3.write_dm(path, iter(data), {'Int': 1}, version=version,
+                 shape=data.shape, dtype=data.dtype,
+                 calibrations=CALIBRATIONS + [(0., 1., 's')])
+    with dm3.DM3(path) as dm3f:
+        assert (dm3f.imagedata == data).all()
+        assert dm3f.images[1].dimensions == (200, 300, 3)
+        assert dm3f.images[1].calibrations == CALIBRATIONS + [(0., 1., 's')]
+        assert dm3f.typedtags['root.ImageList.1.ImageTags.Int'] == 1
+        assert tuple(dm3f.cuts) == (0, 100)
+        # (2D frame size, not depth)
+        bounds = dm3f.typedtags.group('root.ApplicationBounds')
+        assert (bounds['2'], bounds['3']) == (300, 200)
+        size = dm3f.typedtags.group('root.Thumbnails.0.SourceSize_Pixels')
+        assert (size['0'], size['1']) == (200, 300)
+        tn = dm3f.thumbnaildata
+    assert tn.shape == (100, 67)
+    assert (tn[:50] == 0).all() and (tn[50:] == 255).all()
+
+
+def test_thumbnail_rows(tmp_path):
+    # 2D image written in row blocks: thumbnail of whole image
+    path = str(tmp_path / "rows.dm4")
+    data = numpy.zeros((1000, 600), dtype='<u2')
+    data[:, 300:] = 1000
+    dm3.write_dm(path, (data[i:i+33] for i in range(0, 1000, 33)),
+                 shape=data.shape, dtype=data.dtype)
+    with dm3.DM3(path) as dm3f:
+        assert (dm3f.imagedata == data).all()
+        assert tuple(dm3f.cuts) == (0, 1000)
+        tn = dm3f.thumbnaildata
+    assert tn.shape == (125, 75)
+    assert (tn[:, :38] == 0).all() and (tn[:, 38:] == 255).all()